@@ -4,10 +4,7 @@ from common import log
 
 
 class PrintHandler(IHandler):
-    def can_handle(self, data_type: bytes) -> bool:
-        if data_type == b'print':
-            return True
-        return False
+    data_types = (b'print', )
 
     def handle(self, data_type: bytes, data: bytes) -> bytes:
         log(str(data, 'utf-8'))
@@ -15,10 +12,7 @@ class PrintHandler(IHandler):
 
 
 class PingHandler(IHandler):
-    def can_handle(self, data_type: bytes) -> bool:
-        if data_type == b'ping':
-            return True
-        return False
+    data_types = (b'ping', )
 
     def handle(self, data_type: bytes, data: bytes) -> bytes:
         log(str(data, 'utf-8'))
@@ -0,0 +1,580 @@
+"""Schema-aware binary codec of networking payloads.
+
+Values of registered types are encoded by their schema, made from
+type annotations: TypedDict fields are written in order without keys,
+lists are written by columns, so list of MidiBuf becomes array of
+doubles, bytes of buses and bytes of MIDI messages. Tag of the schema
+is put into the codec byte of frame header, so receiver decodes
+payload without knowing its type.
+
+bytes and str are sent raw, anything else falls back to pickle. Pickle
+runs arbitrary code of the sender, so it is only a send-side fallback:
+decode() rejects it, unless receiver opts in (e.g. on loopback only).
+
+Example
+-------
+    class Port(te.TypedDict):
+        idx: int
+        name: str
+
+    PORTS = codec.register(42, ty.List[Port])
+    tag, data = codec.encode([Port(idx=1, name='out')], PORTS)
+    assert codec.decode(tag, data) == [{'idx': 1, 'name': 'out'}]
+"""
+
+import collections.abc as abc
+import pickle
+import struct
+import typing as ty
+import typing_extensions as te
+from itertools import accumulate, chain
+
+import reapy as rpr
+
+CODEC_RAW = 0
+CODEC_PICKLE = 1
+FIRST_TAG = 16
+"""Tags below are reserved for codecs without schema."""
+
+Data = ty.Union[bytes, bytearray, memoryview]
+"""Bytes-like payload, as it is sent and received."""
+_Writer = ty.Callable[[bytearray, ty.Any], None]
+_Reader = ty.Callable[[memoryview, int], ty.Tuple[ty.Any, int]]
+_ColumnWriter = ty.Callable[[bytearray, ty.Sequence[ty.Any]], None]
+_ColumnReader = ty.Callable[[memoryview, int, int],
+                            ty.Tuple[ty.List[ty.Any], int]]
+_Codecs = ty.Tuple[_Writer, _Reader, _ColumnWriter, _ColumnReader]
+
+_DOUBLE = struct.Struct('!d')
+_INT_BYTES, _INT32, _INT64, _INT_VARINTS = range(4)
+_INT_FORMATS = {_INT32: ('i', 4), _INT64: ('q', 8)}
+
+
+class CodecError(Exception):
+    """Payload can not be encoded or decoded."""
+
+
+def write_varint(out: bytearray, value: int) -> None:
+    """Write unsigned int by 7 bits per byte."""
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: memoryview, pos: int) -> ty.Tuple[int, int]:
+    """Read unsigned int, written by write_varint().
+
+    Returns
+    -------
+    Tuple[int, int]
+        value and position after it
+    """
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_int(out: bytearray, value: int) -> None:
+    write_varint(out, value << 1 if value >= 0 else (~value << 1) | 1)
+
+
+def _read_int(data: memoryview, pos: int) -> ty.Tuple[int, int]:
+    value, pos = read_varint(data, pos)
+    return (~(value >> 1) if value & 1 else value >> 1), pos
+
+
+def _write_float(out: bytearray, value: float) -> None:
+    out += _DOUBLE.pack(value)
+
+
+def _read_float(data: memoryview, pos: int) -> ty.Tuple[float, int]:
+    return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+
+
+def _write_bool(out: bytearray, value: bool) -> None:
+    out.append(1 if value else 0)
+
+
+def _read_bool(data: memoryview, pos: int) -> ty.Tuple[bool, int]:
+    return bool(data[pos]), pos + 1
+
+
+def _write_bytes(out: bytearray, value: Data) -> None:
+    write_varint(out, len(value))
+    out += value
+
+
+def _read_bytes(data: memoryview, pos: int) -> ty.Tuple[bytes, int]:
+    size, pos = read_varint(data, pos)
+    return bytes(data[pos:pos + size]), pos + size
+
+
+def _write_str(out: bytearray, value: str) -> None:
+    _write_bytes(out, value.encode())
+
+
+def _read_str(data: memoryview, pos: int) -> ty.Tuple[str, int]:
+    size, pos = read_varint(data, pos)
+    return str(data[pos:pos + size], 'utf-8'), pos + size
+
+
+def _write_int_column(out: bytearray, values: ty.Sequence[int]) -> None:
+    low, high = (min(values), max(values)) if values else (0, 0)
+    if low >= 0 and high < 0x100:
+        out.append(_INT_BYTES)
+        out += bytes(values)
+    elif -0x80000000 <= low and high < 0x80000000:
+        out.append(_INT32)
+        out += struct.pack(f'<{len(values)}i', *values)
+    elif -0x8000000000000000 <= low and high < 0x8000000000000000:
+        out.append(_INT64)
+        out += struct.pack(f'<{len(values)}q', *values)
+    else:
+        out.append(_INT_VARINTS)
+        for value in values:
+            _write_int(out, value)
+
+
+def _read_int_column(data: memoryview, pos: int,
+                     size: int) -> ty.Tuple[ty.List[int], int]:
+    kind, pos = data[pos], pos + 1
+    if kind == _INT_BYTES:
+        return list(data[pos:pos + size]), pos + size
+    if kind in _INT_FORMATS:
+        fmt, width = _INT_FORMATS[kind]
+        values = struct.unpack_from(f'<{size}{fmt}', data, pos)
+        return list(values), pos + size * width
+    out = []
+    for _ in range(size):
+        value, pos = _read_int(data, pos)
+        out.append(value)
+    return out, pos
+
+
+def _write_float_column(
+    out: bytearray, values: ty.Sequence[float]
+) -> None:
+    out += struct.pack(f'<{len(values)}d', *values)
+
+
+def _read_float_column(data: memoryview, pos: int,
+                       size: int) -> ty.Tuple[ty.List[float], int]:
+    values = struct.unpack_from(f'<{size}d', data, pos)
+    return list(values), pos + size * 8
+
+
+def _write_bool_column(out: bytearray, values: ty.Sequence[bool]) -> None:
+    out += bytes(1 if value else 0 for value in values)
+
+
+def _read_bool_column(data: memoryview, pos: int,
+                      size: int) -> ty.Tuple[ty.List[bool], int]:
+    return [bool(byte) for byte in data[pos:pos + size]], pos + size
+
+
+def _write_bytes_column(out: bytearray, values: ty.Sequence[Data]) -> None:
+    _write_int_column(out, [len(value) for value in values])
+    for value in values:
+        out += value
+
+
+def _read_bytes_column(data: memoryview, pos: int,
+                       size: int) -> ty.Tuple[ty.List[bytes], int]:
+    lengths, pos = _read_int_column(data, pos, size)
+    out = []
+    for length in lengths:
+        out.append(bytes(data[pos:pos + length]))
+        pos += length
+    return out, pos
+
+
+def _write_str_column(out: bytearray, values: ty.Sequence[str]) -> None:
+    _write_bytes_column(out, [value.encode() for value in values])
+
+
+def _read_str_column(data: memoryview, pos: int,
+                     size: int) -> ty.Tuple[ty.List[str], int]:
+    lengths, pos = _read_int_column(data, pos, size)
+    end = pos + sum(lengths)
+    text = str(data[pos:end], 'utf-8')
+    if len(text) != end - pos:
+        out = []
+        for length in lengths:
+            out.append(str(data[pos:pos + length], 'utf-8'))
+            pos += length
+        return out, end
+    # ascii, so offsets in text are the same
+    bounds = list(accumulate(lengths, initial=0))
+    return [
+        text[start:stop] for start, stop in zip(bounds, bounds[1:])
+    ], end
+
+
+_PRIMITIVES: ty.Dict[object, _Codecs] = {
+    int: (_write_int, _read_int, _write_int_column, _read_int_column),
+    float: (
+        _write_float, _read_float, _write_float_column, _read_float_column
+    ),
+    bool: (_write_bool, _read_bool, _write_bool_column, _read_bool_column),
+    bytes: (
+        _write_bytes, _read_bytes, _write_bytes_column, _read_bytes_column
+    ),
+    str: (_write_str, _read_str, _write_str_column, _read_str_column),
+}
+_custom: ty.Dict[object, _Codecs] = {}
+
+
+def register_type(
+    type_: type,
+    as_type: object,
+    to_value: ty.Callable[[ty.Any], ty.Any],
+    from_value: ty.Callable[[ty.Any], ty.Any],
+) -> None:
+    """Make type, unknown to codec, encodable as other type.
+
+    Parameters
+    ----------
+    type_ : type
+        e.g. reapy.Track
+    as_type : object
+        type annotation, codec can encode, e.g. str
+    to_value : Callable[[Any], Any]
+        makes value of as_type from object of type_
+    from_value : Callable[[Any], Any]
+        makes object of type_ from value of as_type
+    """
+    write, read, write_column, read_column = _compile(as_type)
+
+    def write_custom(out: bytearray, value: ty.Any) -> None:
+        write(out, to_value(value))
+
+    def read_custom(data: memoryview, pos: int) -> ty.Tuple[ty.Any, int]:
+        value, pos = read(data, pos)
+        return from_value(value), pos
+
+    def write_custom_column(
+        out: bytearray, values: ty.Sequence[ty.Any]
+    ) -> None:
+        write_column(out, [to_value(value) for value in values])
+
+    def read_custom_column(data: memoryview, pos: int,
+                           size: int) -> ty.Tuple[ty.List[ty.Any], int]:
+        values, pos = read_column(data, pos, size)
+        return [from_value(value) for value in values], pos
+
+    _custom[type_] = (
+        write_custom, read_custom, write_custom_column, read_custom_column
+    )
+
+
+def _compile(type_: object) -> _Codecs:
+    """Make codecs of the single value and of the column of values."""
+    if type_ in _custom:
+        return _custom[type_]
+    if type_ in _PRIMITIVES:
+        return _PRIMITIVES[type_]
+    if te.is_typeddict(type_):
+        return _compile_typeddict(type_)
+    origin, args = te.get_origin(type_), te.get_args(type_)
+    if origin in (list, abc.Sequence):
+        return _compile_list(args[0])
+    if origin is tuple and len(args) == 2 and args[1] is Ellipsis:
+        return _compile_list(args[0], tuple)
+    if origin is tuple:
+        return _by_rows(*_compile_tuple(args))
+    if origin is dict:
+        return _by_rows(*_compile_dict(*args))
+    if origin is ty.Union and len(args) == 2 and type(None) in args:
+        return _by_rows(
+            *_compile_optional(args[0] if args[1] is type(None) else args[1])
+        )
+    raise CodecError(f'no schema for type {type_}')
+
+
+def _by_rows(write: _Writer, read: _Reader) -> _Codecs:
+    """Make codecs, writing column value by value."""
+
+    def write_column(out: bytearray, values: ty.Sequence[ty.Any]) -> None:
+        for value in values:
+            write(out, value)
+
+    def read_column(data: memoryview, pos: int,
+                    size: int) -> ty.Tuple[ty.List[ty.Any], int]:
+        out = []
+        for _ in range(size):
+            value, pos = read(data, pos)
+            out.append(value)
+        return out, pos
+
+    return write, read, write_column, read_column
+
+
+def _compile_list(
+    item_type: object,
+    container: ty.Callable[[ty.List[ty.Any]], ty.Any] = list
+) -> _Codecs:
+    """List is written as the column of items.
+
+    Column of lists is written as lengths of lists and the column
+    of all their items.
+    """
+    _, _, write_items, read_items = _compile(item_type)
+
+    def write(out: bytearray, value: ty.Sequence[ty.Any]) -> None:
+        write_varint(out, len(value))
+        write_items(out, value)
+
+    def read(data: memoryview, pos: int) -> ty.Tuple[ty.Any, int]:
+        size, pos = read_varint(data, pos)
+        items, pos = read_items(data, pos, size)
+        return container(items), pos
+
+    def write_column(
+        out: bytearray, values: ty.Sequence[ty.Sequence[ty.Any]]
+    ) -> None:
+        _write_int_column(out, [len(value) for value in values])
+        write_items(out, list(chain.from_iterable(values)))
+
+    def read_column(data: memoryview, pos: int,
+                    size: int) -> ty.Tuple[ty.List[ty.Any], int]:
+        lengths, pos = _read_int_column(data, pos, size)
+        items, pos = read_items(data, pos, sum(lengths))
+        bounds = list(accumulate(lengths, initial=0))
+        return [
+            container(items[start:end])
+            for start, end in zip(bounds, bounds[1:])
+        ], pos
+
+    return write, read, write_column, read_column
+
+
+def _compile_tuple(item_types: ty.Tuple[object, ...]
+                   ) -> ty.Tuple[_Writer, _Reader]:
+    items = [_compile(item_type)[:2] for item_type in item_types]
+
+    def write(out: bytearray, value: ty.Tuple[ty.Any, ...]) -> None:
+        for (write_item, _), item in zip(items, value):
+            write_item(out, item)
+
+    def read(data: memoryview,
+             pos: int) -> ty.Tuple[ty.Tuple[ty.Any, ...], int]:
+        out = []
+        for _, read_item in items:
+            item, pos = read_item(data, pos)
+            out.append(item)
+        return tuple(out), pos
+
+    return write, read
+
+
+def _compile_dict(key_type: object,
+                  value_type: object) -> ty.Tuple[_Writer, _Reader]:
+    write_key, read_key = _compile(key_type)[:2]
+    write_value, read_value = _compile(value_type)[:2]
+
+    def write(out: bytearray, value: ty.Dict[ty.Any, ty.Any]) -> None:
+        write_varint(out, len(value))
+        for key, item in value.items():
+            write_key(out, key)
+            write_value(out, item)
+
+    def read(data: memoryview,
+             pos: int) -> ty.Tuple[ty.Dict[ty.Any, ty.Any], int]:
+        size, pos = read_varint(data, pos)
+        out = {}
+        for _ in range(size):
+            key, pos = read_key(data, pos)
+            out[key], pos = read_value(data, pos)
+        return out, pos
+
+    return write, read
+
+
+def _compile_optional(type_: object) -> ty.Tuple[_Writer, _Reader]:
+    write_value, read_value = _compile(type_)[:2]
+
+    def write(out: bytearray, value: ty.Any) -> None:
+        if value is None:
+            out.append(0)
+        else:
+            out.append(1)
+            write_value(out, value)
+
+    def read(data: memoryview, pos: int) -> ty.Tuple[ty.Any, int]:
+        if not data[pos]:
+            return None, pos + 1
+        return read_value(data, pos + 1)
+
+    return write, read
+
+
+def _compile_typeddict(type_: object) -> _Codecs:
+    """TypedDict is written as values of fields without keys.
+
+    Column of TypedDict is written as columns of its fields, unless
+    some of its keys are not required.
+    """
+    hints = te.get_type_hints(type_)
+    required = getattr(type_, '__required_keys__', set(hints))
+    keys = list(hints)
+    fields = [(key, key in required, *_compile(hints[key])) for key in keys]
+
+    def write(out: bytearray, value: ty.Mapping[str, ty.Any]) -> None:
+        for key, is_required, write_field, *_ in fields:
+            if is_required:
+                write_field(out, value[key])
+            elif key in value:
+                out.append(1)
+                write_field(out, value[key])
+            else:
+                out.append(0)
+
+    def read(data: memoryview,
+             pos: int) -> ty.Tuple[ty.Dict[str, ty.Any], int]:
+        out = {}
+        for key, is_required, _, read_field, *_ in fields:
+            if not is_required:
+                pos += 1
+                if not data[pos - 1]:
+                    continue
+            out[key], pos = read_field(data, pos)
+        return out, pos
+
+    if len(required) < len(keys):
+        return _by_rows(write, read)
+
+    def write_column(
+        out: bytearray, values: ty.Sequence[ty.Mapping[str, ty.Any]]
+    ) -> None:
+        for key, _, _, _, write_field_column, _ in fields:
+            write_field_column(out, [value[key] for value in values])
+
+    def read_column(data: memoryview, pos: int,
+                    size: int) -> ty.Tuple[ty.List[ty.Dict[str, ty.Any]], int]:
+        columns = []
+        for *_, read_field_column in fields:
+            column, pos = read_field_column(data, pos, size)
+            columns.append(column)
+        return [dict(zip(keys, row)) for row in zip(*columns)], pos
+
+    return write, read, write_column, read_column
+
+
+class Schema:
+    """Binary codec of values of one type, registered by register()."""
+
+    def __init__(self, tag: int, type_: object) -> None:
+        self.tag = tag
+        self.type_ = type_
+        self._write, self._read = _compile(type_)[:2]
+
+    def encode(self, value: ty.Any) -> bytes:
+        out = bytearray()
+        self._write(out, value)
+        return bytes(out)
+
+    def decode(self, data: Data) -> ty.Any:
+        """Decode value.
+
+        Raises
+        ------
+        CodecError
+            if data is broken
+        """
+        view = memoryview(data)
+        try:
+            value, pos = self._read(view, 0)
+        except (IndexError, UnicodeDecodeError, struct.error) as e:
+            raise CodecError(f'broken {self.type_} payload: {e}') from e
+        if pos != len(view):
+            raise CodecError(
+                f'{self.type_} payload of {len(view)} bytes, read {pos}'
+            )
+        return value
+
+
+_schemas: ty.Dict[int, Schema] = {}
+
+
+def register(tag: int, type_: object) -> Schema:
+    """Make schema of type to be encoded and decoded by the tag.
+
+    Parameters
+    ----------
+    tag : int
+        from FIRST_TAG to 255, unique for the project
+    type_ : object
+        type annotation, e.g. List[MidiBuf]
+
+    Returns
+    -------
+    Schema
+    """
+    assert FIRST_TAG <= tag < 256, f'bad tag {tag}'
+    assert tag not in _schemas, f'tag {tag} is used by {_schemas[tag].type_}'
+    schema = _schemas[tag] = Schema(tag, type_)
+    return schema
+
+
+def encode(
+    value: ty.Any,
+    schema: ty.Optional[Schema] = None
+) -> ty.Tuple[int, Data]:
+    """Encode value by its schema, fall back to pickle if not given.
+
+    bytes-like values are always sent raw, so handler with schema
+    still can respond with b'success' or b'fail'.
+
+    Returns
+    -------
+    Tuple[int, bytes]
+        codec tag and data
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return CODEC_RAW, value
+    if schema is not None:
+        return schema.tag, schema.encode(value)
+    if isinstance(value, str):
+        return CODEC_RAW, value.encode()
+    return CODEC_PICKLE, pickle.dumps(value)
+
+
+def decode(tag: int, data: Data, allow_pickle: bool = False) -> ty.Any:
+    """Decode data, encoded by encode().
+
+    Raw data is returned as is.
+
+    Parameters
+    ----------
+    tag : int
+    data : Data
+    allow_pickle : bool, optional
+        unpickle data of CODEC_PICKLE. Has to be set only if sender is
+        trusted, as unpickling runs arbitrary code.
+
+    Raises
+    ------
+    CodecError
+        if tag is unknown, data is broken or is pickled, but pickle
+        is not allowed
+    """
+    if tag == CODEC_RAW:
+        return data
+    if tag == CODEC_PICKLE:
+        if not allow_pickle:
+            raise CodecError('pickled data is not accepted')
+        return pickle.loads(data)
+    if tag not in _schemas:
+        raise CodecError(f'unknown codec {tag}')
+    return _schemas[tag].decode(data)
+
+
+# reapy objects are valid only on the same machine, but are sent by id
+# inside the session anyway.
+register_type(rpr.Track, str, lambda track: track.id, rpr.Track)
@@ -0,0 +1,240 @@
+"""Host-local agent, serving Jack and Reaper MIDI ports of its host.
+
+Agent keeps the inventory current by itself: Jack graph is observed
+by JackObserver, Reaper MIDI devices are re-read from the defer loop.
+So master gets all ports of the host by one request, without
+performing actions and passing pickles through ext state.
+
+Master sends the stamp of inventory it already has, and agent replies
+b'same' if nothing changed. Inventory is sent encoded by INVENTORY
+schema. The stamp alone is served as well (see
+jack_backend.HostPortsCache).
+
+Example
+-------
+    agent = InventoryAgent()
+    server = AsyncReaperServer(HOST, AGENT_PORT, [])
+    server.register_handler(agent)
+
+    def main_loop() -> None:
+        agent.run()
+        server.run()
+        rpr.defer(main_loop)
+
+    rpr.at_exit(server.at_exit)
+"""
+
+import typing as ty
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from reasession import codec
+from reasession.common import TimeCallback
+from reasession.networking import AGENT_PORT
+from reasession.networking import IHandler
+from reasession.networking import request
+from . import interface as iface
+from .jack_backend import HOST_STAMP_TYPE, JackObserver, get_observer
+from .jack_backend import _HostPorts, _RMidiPort, _read_midi_ports
+
+INVENTORY_TYPE = 'inventory'
+SAME = 'same'
+
+
+class Inventory(_HostPorts):
+    """Ports of the host with the stamp of their state."""
+
+    stamp: str
+
+
+INVENTORY = codec.register(19, Inventory)
+
+
+class InventoryAgent(IHandler):
+    """Serves inventory of the host, has to be run in defer loop."""
+
+    data_types = (INVENTORY_TYPE.encode(), HOST_STAMP_TYPE.encode())
+    schema = INVENTORY
+
+    def __init__(
+        self,
+        observer: ty.Optional[ty.Callable[[], JackObserver]] = get_observer,
+        refresh: float = 1,
+    ) -> None:
+        """Serves inventory of the host.
+
+        Parameters
+        ----------
+        observer : Optional[Callable[[], JackObserver]], optional
+            getter of the local jack observer, None for host without jack
+        refresh : float, optional
+            seconds between reading of Reaper MIDI devices
+        """
+        self._observer = observer
+        self._midi_ports: ty.Tuple[ty.List[_RMidiPort],
+                                   ty.List[_RMidiPort]] = ([], [])
+        self._midi_hash = ''
+        self._timer = TimeCallback(self._read_midi, refresh)
+
+    def run(self) -> None:
+        """Callback to be put in defer loop."""
+        self._timer.run()
+
+    def handle(
+        self, data_type: bytes, data: bytes
+    ) -> ty.Union[bytes, Inventory]:
+        if data_type == HOST_STAMP_TYPE.encode():
+            return self.stamp().encode()
+        inventory = self.inventory()
+        if bytes(data).decode() == inventory['stamp']:
+            return SAME.encode()
+        return inventory
+
+    def stamp(self) -> str:
+        """Get stamp of the inventory without reading jack ports.
+
+        Returns
+        -------
+        str
+            changes with Reaper MIDI devices and with the jack graph
+        """
+        version = 0 if self._observer is None else self._observer().version
+        return f'{self._midi_hash}:{version}'
+
+    def inventory(self) -> Inventory:
+        """Get ports of the host.
+
+        Returns
+        -------
+        Inventory
+        """
+        (reaper_in_ports, reaper_out_ports), midi_hash = (
+            self._midi_ports, self._midi_hash
+        )
+        if self._observer is None:
+            jack_in_ports, jack_out_ports, version = [], [], 0
+        else:
+            observer = self._observer()
+            version = observer.version
+            jack_in_ports = observer.midi_ports()
+            jack_out_ports = observer.midi_ports(want_output=True)
+        return Inventory(
+            stamp=f'{midi_hash}:{version}',
+            jack_in_ports=jack_in_ports,
+            jack_out_ports=jack_out_ports,
+            reaper_in_ports=reaper_in_ports,
+            reaper_out_ports=reaper_out_ports,
+        )
+
+    def _read_midi(self) -> None:
+        ins, outs = _read_midi_ports()
+        midi_hash = hashlib.sha1(json.dumps([ins, outs]).encode()).hexdigest()
+        # both are replaced at once, as handler reads them from other thread
+        self._midi_ports, self._midi_hash = (ins, outs), midi_hash
+
+
+def request_inventory(
+    host: str,
+    port: int = AGENT_PORT,
+    stamp: str = '',
+    timeout: float = 1,
+) -> ty.Optional[Inventory]:
+    """Get inventory from the agent of the host.
+
+    Parameters
+    ----------
+    host : str
+        'localhost' or IPV4 address
+    port : int, optional
+    stamp : str, optional
+        stamp of the inventory, already got from the host
+    timeout : float, optional
+
+    Returns
+    -------
+    Optional[Inventory]
+        None if inventory has not changed since the stamp
+    """
+    if host == 'localhost':
+        host = '127.0.0.1'
+    response = request(INVENTORY_TYPE, stamp, host, port, timeout)
+    if response == SAME.encode():
+        return None
+    return ty.cast(Inventory, response)
+
+
+class AgentPortsCache:
+    """Ports of hosts, got from their InventoryAgent.
+
+    Can be used as ports cache of jack_backend.Connector.
+    Every host is asked once per get(), all hosts in parallel.
+    """
+
+    def __init__(
+        self,
+        port: int = AGENT_PORT,
+        timeout: float = 1,
+        max_workers: ty.Optional[int] = None,
+    ) -> None:
+        """Ports of hosts, got from their InventoryAgent.
+
+        Parameters
+        ----------
+        port : int, optional
+            port of agents
+        timeout : float, optional
+            seconds to wait for every host
+        max_workers : Optional[int], optional
+            of the thread pool
+        """
+        self.port = port
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers)
+        self._inventory: ty.Dict[str, Inventory] = {}
+
+    def get(self, hosts: ty.Sequence[str]) -> ty.Dict[str, _HostPorts]:
+        """Get ports of hosts.
+
+        Parameters
+        ----------
+        hosts : Sequence[str]
+            'localhost' or IPV4 addresses
+
+        Returns
+        -------
+        Dict[str, _HostPorts]
+            by host
+
+        Raises
+        ------
+        ConnectionsError
+            if agent of host did not answer
+        """
+        futures = {
+            host: self._pool.submit(
+                request_inventory, host, self.port,
+                self._inventory[host]['stamp']
+                if host in self._inventory else '', self.timeout
+            )
+            for host in hosts
+        }
+        for host, future in futures.items():
+            try:
+                inventory = future.result()
+            except Exception as e:
+                raise iface.ConnectionsError(
+                    f"can't get inventory of host '{host}': {e}"
+                ) from e
+            if inventory is not None:
+                self._inventory[host] = inventory
+        return {host: self._inventory[host] for host in hosts}
+
+    def invalidate(self, host: ty.Optional[str] = None) -> None:
+        """Force full inventory of the host, or of all hosts if not given."""
+        for name in ([host] if host else list(self._inventory)):
+            self._inventory.pop(name, None)
+
+    def close(self) -> None:
+        """Shutdown thread pool."""
+        self._pool.shutdown()
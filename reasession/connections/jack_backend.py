@@ -14,19 +14,38 @@ Attributes
 ----------
 CONN_NAME_REGEXP : compilled regexp
     used by the 'parce_host_name(port: jack.Port)'
+REAPER_PORT_REGEXP : str
+    jack ports, watched by JackObserver
+HOST_STAMP_TYPE : str
+    request type of the host stamp, served by inventory.InventoryAgent
 
 """
 
 import typing as ty
+import hashlib
 import re
+import threading
+import time
+from collections import defaultdict, deque
+from functools import partial
+from concurrent.futures import Executor
+from concurrent.futures import TimeoutError
 import typing_extensions as te
 import jack
 import reapy as rpr
 from reapy import reascript_api as RPR
+from reasession import codec
+from reasession.host_pool import HostPool
+from reasession.host_pool import shared_pool
+from reasession.networking import AGENT_PORT
+from reasession.networking import request
 from reasession import persistence as prs
 from . import interface as iface
 
 CONN_NAME_REGEXP = re.compile(r'(.+):(.+)')
+REAPER_PORT_REGEXP = r'REAPER.+'
+HOST_STAMP_TYPE = 'host_stamp'
+T = ty.TypeVar('T')
 
 
 class PortNameError(Exception):
@@ -66,13 +85,18 @@ class _HostInfo(te.TypedDict):
     out_tracks: ty.List[_ROutTrack]
 
 
-class _RTrackPort(te.TypedDict):
+class _RTrackPortBase(te.TypedDict):
 
     host: str
     track: rpr.Track
     port: _RMidiPort
 
 
+class _RTrackPort(_RTrackPortBase, total=False):
+
+    channel: int
+
+
 class _RHostPort(te.TypedDict):
 
     host: str
@@ -80,6 +104,10 @@ class _RHostPort(te.TypedDict):
     dest_host: str
 
 
+HOST_INFO = codec.register(17, _HostInfo)
+R_MIDI_PORTS = codec.register(18, ty.List[_RMidiPort])
+
+
 def parce_port_name(port: jack.Port) -> ty.Tuple[str, str]:
     """Return tuple from 'jack.Port().name'.
 
@@ -101,12 +129,197 @@ def parce_port_name(port: jack.Port) -> ty.Tuple[str, str]:
         in case jack gave strange name pattern
 
     """
-    m = re.match(CONN_NAME_REGEXP, port.name)
+    return _split_port_name(port.name)
+
+
+def _split_port_name(name: str) -> ty.Tuple[str, str]:
+    m = re.match(CONN_NAME_REGEXP, name)
     if not m:
-        raise PortNameError(f'strange port name: {port.name}')
+        raise PortNameError(f'strange port name: {name}')
     return ty.cast(ty.Tuple[str, str], m.groups())
 
 
+class JackObserver:
+    """Long-living jack client, keeping graph of Reaper MIDI ports.
+
+    Graph is read from jack once and then is updated by port
+    registration and connection callbacks, so queries do not touch
+    jack server at all.
+
+    Note
+    ----
+    jack calls callbacks from its own thread, and they must not
+    interact with jack server. So they only update the graph, and
+    anything unexpected just marks it dirty to be re-read at the
+    next query.
+
+    Attributes
+    ----------
+    version : int
+        incremented at every change of the graph
+    """
+
+    def __init__(
+        self,
+        name: str = 'observer',
+        client: ty.Optional[jack.Client] = None
+    ) -> None:
+        """Long-living jack client, keeping graph of Reaper MIDI ports.
+
+        Parameters
+        ----------
+        name : str, optional
+            jack client name
+        client : Optional[jack.Client], optional
+            not activated client, made by the name if not given
+        """
+        self._client = client or jack.Client(name)
+        self._lock = threading.Lock()
+        self._ports: ty.Dict[str, bool] = {}
+        self._connections: ty.Dict[str, ty.List[str]] = {}
+        self._dirty = True
+        self.version = 0
+        self.closed = False
+        self._client.set_port_registration_callback(self._on_port_register)
+        self._client.set_port_connect_callback(self._on_port_connect)
+        self._client.set_graph_order_callback(self._on_graph_order)
+        self._client.set_shutdown_callback(self._on_shutdown)
+        self._client.activate()
+
+    def close(self) -> None:
+        """Deactivate and close jack client."""
+        if self.closed:
+            return
+        self.closed = True
+        self._client.deactivate()
+        self._client.close()
+
+    def invalidate(self) -> None:
+        """Force reading of the whole graph at the next query."""
+        with self._lock:
+            self._dirty = True
+            self.version += 1
+
+    def midi_ports(self, want_output: bool = False) -> ty.List[_JMidiPort]:
+        """Get Reaper MIDI ports, connected to exactly one port.
+
+        Parameters
+        ----------
+        want_output : bool, optional
+            If not set — input ports will be returned
+
+        Returns
+        -------
+        List[_JMidiPort]
+        """
+        self._refresh()
+        midi_ports: ty.List[_JMidiPort] = []
+        with self._lock:
+            for name, is_output in self._ports.items():
+                if is_output != want_output:
+                    continue
+                connections = self._connections[name]
+                if len(connections) != 1:
+                    continue
+                _, port_name = _split_port_name(name)
+                c_host, c_name = _split_port_name(connections[0])
+                midi_ports.append(
+                    _JMidiPort(
+                        name=port_name,
+                        connection=_JConnection(host=c_host, name=c_name)
+                    )
+                )
+        return midi_ports
+
+    def _refresh(self) -> None:
+        """Read the whole graph, if it is dirty.
+
+        Changes, reported while graph is read, may be missed by the
+        read, so graph stays dirty and is read again at the next query.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            version = self.version
+        ports: ty.Dict[str, bool] = {}
+        connections: ty.Dict[str, ty.List[str]] = {}
+        for is_output in (False, True):
+            for port in self._client.get_ports(
+                REAPER_PORT_REGEXP,
+                is_midi=True,
+                is_output=is_output,
+                is_input=not is_output
+            ):
+                ports[port.name] = is_output
+                connections[port.name] = [
+                    conn.name
+                    for conn in self._client.get_all_connections(port)
+                ]
+        with self._lock:
+            self._dirty = self.version != version
+            self._ports = ports
+            self._connections = connections
+            self.version += 1
+
+    def _is_watched(self, port: jack.Port) -> bool:
+        return bool(
+            port.is_midi and re.match(REAPER_PORT_REGEXP, port.name)
+        )
+
+    def _on_port_register(self, port: jack.Port, register: bool) -> None:
+        if not self._is_watched(port):
+            return
+        with self._lock:
+            if register:
+                self._ports[port.name] = port.is_output
+                self._connections[port.name] = []
+            else:
+                self._ports.pop(port.name, None)
+                self._connections.pop(port.name, None)
+            self.version += 1
+
+    def _on_port_connect(
+        self, a: jack.Port, b: jack.Port, connect: bool
+    ) -> None:
+        with self._lock:
+            for port, other in ((a, b), (b, a)):
+                connections = self._connections.get(port.name)
+                if connections is None:
+                    continue
+                if connect and other.name not in connections:
+                    connections.append(other.name)
+                elif not connect and other.name in connections:
+                    connections.remove(other.name)
+            self.version += 1
+
+    def _on_graph_order(self) -> None:
+        with self._lock:
+            self.version += 1
+
+    def _on_shutdown(self, status: object, reason: str) -> None:
+        with self._lock:
+            self.closed = True
+            self._dirty = True
+            self.version += 1
+
+
+_observer: ty.Optional[JackObserver] = None
+
+
+def get_observer() -> JackObserver:
+    """Get module-wide JackObserver, made at the first call.
+
+    Returns
+    -------
+    JackObserver
+        new one is made if jack server shut down the previous
+    """
+    global _observer
+    if _observer is None or _observer.closed:
+        _observer = JackObserver()
+    return _observer
+
+
 def get_jack_ports_parametrized(want_output: bool = False
                                 ) -> ty.List[_JMidiPort]:
     """Get all Reraper jack Midi in either out ports in dict.
@@ -125,28 +338,7 @@ def get_jack_ports_parametrized(want_output: bool = False
             name: str
 
     """
-    is_input = not want_output
-    is_output = want_output
-    # print(is_input, is_output)
-    client = jack.Client('observer')
-    ports = client.get_ports(
-        r'REAPER.+', is_midi=True, is_output=is_output, is_input=is_input
-    )
-    # print([p.name for p in ports])
-    midi_ports: ty.List[_JMidiPort] = []
-    for port in ports:
-        connections = client.get_all_connections(port)
-        # print(connections)
-        if len(connections) == 1:
-            _, port_name = parce_port_name(port)
-            c_host, c_name = parce_port_name(connections[0])
-            midi_ports.append(
-                _JMidiPort(
-                    name=port_name,
-                    connection=_JConnection(host=c_host, name=c_name)
-                )
-            )
-    return midi_ports
+    return get_observer().midi_ports(want_output)
 
 
 def get_jack_ports() -> ty.Tuple[ty.List[_JMidiPort], ty.List[_JMidiPort]]:
@@ -173,14 +365,14 @@ def set_track_midi_out(
     track : rpr.Track
         Description
     out_idx : int
-        MIDI device id
+        MIDI device id, -1 to disconnect
     out_ch : int, optional
         all channels by default
     track : reapy.Track
 
     """
     CH_BITS = 5
-    value = (out_idx << CH_BITS) + out_ch
+    value = (out_idx << CH_BITS) + out_ch if out_idx >= 0 else -1
     RPR.SetMediaTrackInfo_Value(track.id, 'I_MIDIHWOUT', value)  # type:ignore
 
 
@@ -192,7 +384,7 @@ def set_track_midi_in(track: rpr.Track, out_idx: int, out_ch: int = 0) -> None:
     track : rpr.Track
         Description
     out_idx : int
-        MIDI device id
+        MIDI device id, -1 to disconnect
     out_ch : int, optional
         all channels by default
     track : reapy.Track
@@ -200,10 +392,63 @@ def set_track_midi_in(track: rpr.Track, out_idx: int, out_ch: int = 0) -> None:
     """
     MIDI_FLAG = 4096
     CH_BITS = 5
-    value = MIDI_FLAG + (out_idx << CH_BITS) + out_ch
+    value = MIDI_FLAG + (out_idx << CH_BITS) + out_ch if out_idx >= 0 else -1
     RPR.SetMediaTrackInfo_Value(track.id, 'I_RECINPUT', value)  # type:ignore
 
 
+class JackPortIndex:
+    """Lookup tables of jack ports for matching them to Reaper ports.
+
+    Reaper port is matched to jack port if they have the same name,
+    or if Reaper name starts with the host of jack port connection and
+    ends with its name (e.g. 'system:midi_capture_1').
+
+    Tables are built once, so matching of every Reaper port costs one
+    lookup by name and one lookup per distinct length of connection
+    names instead of comparing it with every jack port.
+    """
+
+    def __init__(self, j_ports: ty.List[_JMidiPort]) -> None:
+        """Lookup tables of jack ports.
+
+        Parameters
+        ----------
+        j_ports : List[_JMidiPort]
+        """
+        self.j_ports = j_ports
+        self._by_name: ty.Dict[str, ty.List[int]] = {}
+        self._by_conn_name: ty.Dict[str, ty.List[int]] = {}
+        for idx, j_port in enumerate(j_ports):
+            self._by_name.setdefault(j_port['name'], []).append(idx)
+            self._by_conn_name.setdefault(j_port['connection']['name'],
+                                          []).append(idx)
+        self._conn_name_lengths = sorted(
+            {len(name) for name in self._by_conn_name}
+        )
+
+    def match(self, name: str) -> ty.List[_JMidiPort]:
+        """Get jack ports, valid for the Reaper port name.
+
+        Parameters
+        ----------
+        name : str
+            Reaper MIDI port name
+
+        Returns
+        -------
+        List[_JMidiPort]
+            in the order jack ports were given
+        """
+        found = set(self._by_name.get(name, ()))
+        for length in self._conn_name_lengths:
+            if length > len(name):
+                break
+            for idx in self._by_conn_name.get(name[len(name) - length:], ()):
+                if name.startswith(self.j_ports[idx]['connection']['host']):
+                    found.add(idx)
+        return [self.j_ports[idx] for idx in sorted(found)]
+
+
 def match_host_ports_parametrized(
     r_ports: ty.List[_RMidiPort],
     j_ports: ty.List[_JMidiPort],
@@ -226,44 +471,23 @@ def match_host_ports_parametrized(
 
     """
     out: ty.List[_RHostPort] = []
-
-    def validate_name(r_port: _RMidiPort, j_port: _JMidiPort) -> bool:
-        """Check if Reaper midi port is valid jack port.
-
-        Parameters
-        ----------
-        r_port : _RMidiPort
-        j_port : _JMidiPort
-
-        Returns
-        -------
-        bool
-
-        """
-        if r_port['name'] == j_port['name']:
-            return True
-        if r_port['name'].startswith(j_port['connection']['host']):
-            if r_port['name'].endswith(j_port['connection']['name']):
-                return True
-        return False
-
+    index = JackPortIndex(j_ports)
     for r_port in r_ports:
-        for j_port in j_ports:
-            if validate_name(r_port, j_port):
-                dest_host = j_port['connection']['host']
-                if hostname == 'localhost' and dest_host == 'system':
-                    continue
-                if hostname != 'localhost' and dest_host == 'system':
-                    dest_host = 'localhost'
-                if dest_host == 'REAPER':
-                    dest_host = 'localhost'
-                out.append(
-                    dict(
-                        host=hostname,
-                        port=r_port,
-                        dest_host=dest_host,
-                    )
+        for j_port in index.match(r_port['name']):
+            dest_host = j_port['connection']['host']
+            if hostname == 'localhost' and dest_host == 'system':
+                continue
+            if hostname != 'localhost' and dest_host == 'system':
+                dest_host = 'localhost'
+            if dest_host == 'REAPER':
+                dest_host = 'localhost'
+            out.append(
+                dict(
+                    host=hostname,
+                    port=r_port,
+                    dest_host=dest_host,
                 )
+            )
     return out
 
 
@@ -365,8 +589,326 @@ def get_hosts_in_tracks(hosts: ty.Sequence[_HostInfo]
     return tracks
 
 
+class ConnectionAssignment(te.TypedDict):
+    """Result of ports assignment, made by assign_ports().
+
+    Parameters
+    ----------
+    midi_outs : List[_RTrackPort]
+        master tracks with their out ports
+    midi_ins : List[_RTrackPort]
+        slave tracks with their in ports
+    errors : List[str]
+        why out tracks were not assigned
+    free_ports : Dict[str, Tuple[int, int]]
+        number of unused in and out ports by host
+    """
+
+    midi_outs: ty.List[_RTrackPort]
+    midi_ins: ty.List[_RTrackPort]
+    errors: ty.List[str]
+    free_ports: ty.Dict[str, ty.Tuple[int, int]]
+
+
+class PortMatcher:
+    """Assigns Reaper ports of one host to the requested destinations.
+
+    Every port can be valid for several destination hosts, so this is
+    a bipartite matching of requests to ports. Request takes the first
+    free port of its destination queue. If there is no one, it tries to
+    move previous requests to other ports along an augmenting path.
+    So the request fails only if there is no valid assignment at all.
+    """
+
+    def __init__(self, ports: ty.List[_RHostPort]) -> None:
+        """Assigns Reaper ports of one host to destinations.
+
+        Parameters
+        ----------
+        ports : List[_RHostPort]
+            the same Reaper port can appear with different dest_host
+        """
+        self.ports: ty.List[_RMidiPort] = []
+        positions: ty.Dict[int, int] = {}
+        self._candidates: ty.Dict[str, ty.List[int]] = {}
+        for port in ports:
+            idx = port['port']['idx']
+            if idx not in positions:
+                positions[idx] = len(self.ports)
+                self.ports.append(port['port'])
+            self._candidates.setdefault(port['dest_host'],
+                                        []).append(positions[idx])
+        self._free = {
+            dest: deque(cands)
+            for dest, cands in self._candidates.items()
+        }
+        self._owner: ty.List[ty.Optional[int]] = [None] * len(self.ports)
+        self._dests: ty.List[str] = []
+        self._assigned: ty.List[ty.Optional[int]] = []
+
+    @property
+    def n_free(self) -> int:
+        """Number of ports, not assigned to any request."""
+        return self._owner.count(None)
+
+    def request(self, dest_host: str) -> ty.Optional[int]:
+        """Assign port, valid for the destination host.
+
+        Parameters
+        ----------
+        dest_host : str
+
+        Returns
+        -------
+        Optional[int]
+            request id to get the final port by port_of()
+            or None if the port cannot be assigned
+        """
+        req = len(self._dests)
+        self._dests.append(dest_host)
+        self._assigned.append(None)
+        free = self._free.get(dest_host)
+        while free:
+            pos = free.popleft()
+            if self._owner[pos] is None:
+                self._assign(req, pos)
+                return req
+        if self._augment(req):
+            return req
+        return None
+
+    def release(self, req: int) -> None:
+        """Free port of the request, so the next requests can take it.
+
+        Parameters
+        ----------
+        req : int
+            request id, returned by request()
+        """
+        pos = self._assigned[req]
+        if pos is None:
+            return
+        self._assigned[req] = None
+        self._owner[pos] = None
+        for dest, cands in self._candidates.items():
+            if pos in cands:
+                self._free[dest].appendleft(pos)
+
+    def port_of(self, req: int) -> _RMidiPort:
+        """Get port of the request.
+
+        Note
+        ----
+        Port can be changed by the next requests, so it should be read
+        after all requests are made.
+        """
+        pos = self._assigned[req]
+        assert pos is not None, f'request {req} is not assigned'
+        return self.ports[pos]
+
+    def _assign(self, req: int, pos: int) -> None:
+        self._assigned[req] = pos
+        self._owner[pos] = req
+
+    def _augment(self, req: int) -> bool:
+        visited: ty.Set[int] = set()
+        reached_by: ty.Dict[int, int] = {}
+        stack = [(req, iter(self._candidates.get(self._dests[req], ())))]
+        while stack:
+            current, candidates = stack[-1]
+            for pos in candidates:
+                if pos in visited:
+                    continue
+                visited.add(pos)
+                reached_by[pos] = current
+                owner = self._owner[pos]
+                if owner is None:
+                    self._flip_path(req, pos, reached_by)
+                    return True
+                stack.append(
+                    (owner, iter(self._candidates[self._dests[owner]]))
+                )
+                break
+            else:
+                stack.pop()
+        return False
+
+    def _flip_path(
+        self, req: int, pos: int, reached_by: ty.Dict[int, int]
+    ) -> None:
+        while True:
+            owner = reached_by[pos]
+            previous = self._assigned[owner]
+            self._assign(owner, pos)
+            if owner == req or previous is None:
+                return
+            pos = previous
+
+
+_Link = ty.Tuple[int, int, int]
+"""Request ids of out port and in port, and the channel."""
+
+
+class PortLinkAllocator:
+    """Allocates pairs of master out port and slave in port.
+
+    Every pair (link) can carry several tracks on distinct MIDI
+    channels. So with 16 channels per link one port is used by up
+    to 16 tracks instead of one.
+
+    Note
+    ----
+    Master track sends all its MIDI to the channel of the link,
+    and slave track listens only to this channel.
+    """
+
+    def __init__(
+        self,
+        out_matchers: ty.Dict[str, PortMatcher],
+        in_matchers: ty.Dict[str, PortMatcher],
+        channels: int = 1,
+    ) -> None:
+        """Allocates pairs of master out port and slave in port.
+
+        Parameters
+        ----------
+        out_matchers : Dict[str, PortMatcher]
+            of out ports by host
+        in_matchers : Dict[str, PortMatcher]
+            of in ports by host
+        channels : int, optional
+            tracks per link, from 1 (all channels) to 16
+        """
+        assert 1 <= channels <= 16, 'MIDI has 16 channels'
+        self.out_matchers = out_matchers
+        self.in_matchers = in_matchers
+        self.channels = channels
+        self._open: ty.Dict[ty.Tuple[str, str], _Link] = {}
+
+    def allocate(self, o_host: str, i_host: str) -> _Link:
+        """Get link from master host to slave host for one more track.
+
+        Parameters
+        ----------
+        o_host : str
+        i_host : str
+
+        Returns
+        -------
+        Tuple[int, int, int]
+            out request, in request (see PortMatcher.port_of())
+            and the channel: 0 (all) if 1 channel per link,
+            or from 1 to 16
+
+        Raises
+        ------
+        ConnectionsError
+            if there are no ports for the new link
+        """
+        link = self._open.get((o_host, i_host))
+        if link is not None and link[2] < self.channels:
+            link = (link[0], link[1], link[2] + 1)
+            self._open[(o_host, i_host)] = link
+            return link
+        if i_host not in self.in_matchers:
+            raise iface.ConnectionsError(f"host '{i_host}' is not known")
+        i_req = self.in_matchers[i_host].request('localhost')
+        if i_req is None:
+            raise iface.ConnectionsError(
+                f"not enough in ports for host '{i_host}'"
+            )
+        o_req = self.out_matchers[o_host].request(i_host)
+        if o_req is None:
+            # failed link should not hold the in port of the next ones
+            self.in_matchers[i_host].release(i_req)
+            raise iface.ConnectionsError(
+                f"not enough out ports for host '{o_host}' to '{i_host}'"
+            )
+        if self.channels == 1:
+            return o_req, i_req, 0
+        link = (o_req, i_req, 1)
+        self._open[(o_host, i_host)] = link
+        return link
+
+
+def assign_ports(
+    hosts: ty.Sequence[_HostInfo], channels: int = 1
+) -> ConnectionAssignment:
+    """Assign ports to all out tracks and their slave tracks.
+
+    Out tracks, which cannot be assigned, are skipped and reported
+    in errors, the rest of tracks are connected anyway.
+
+    Parameters
+    ----------
+    hosts : Sequence[_HostInfo]
+    channels : int, optional
+        tracks per port, see PortLinkAllocator
+
+    Returns
+    -------
+    ConnectionAssignment
+    """
+    hosts_ports = match_hosts_ports(hosts)
+    in_matchers = {h: PortMatcher(p[0]) for h, p in hosts_ports.items()}
+    out_matchers = {h: PortMatcher(p[1]) for h, p in hosts_ports.items()}
+    allocator = PortLinkAllocator(out_matchers, in_matchers, channels)
+    slave_tracks: ty.Dict[ty.Tuple[str, object],
+                          ty.Deque[rpr.Track]] = defaultdict(deque)
+    for host in hosts:
+        for i_track in host['in_tracks']:
+            slave_tracks[(host['host'], i_track.id)].append(i_track)
+
+    errors: ty.List[str] = []
+    requests: ty.List[ty.Tuple[str, _ROutTrack, str, rpr.Track, _Link]] = []
+    for host in hosts:
+        o_host = host['host']
+        for o_track in host['out_tracks']:
+            i_host = o_track['slave']['host']
+            s_track = o_track['slave']['track']
+            i_tracks = slave_tracks.get((i_host, s_track.id))
+            if not i_tracks:
+                errors.append(
+                    "can't find track {n} in project {p} at {s}".format(
+                        n=s_track.name, p=s_track.project, s=i_host
+                    )
+                )
+                continue
+            i_track = i_tracks.popleft()
+            try:
+                link = allocator.allocate(o_host, i_host)
+            except iface.ConnectionsError as e:
+                errors.append(str(e))
+                continue
+            requests.append((o_host, o_track, i_host, i_track, link))
+
+    assignment = ConnectionAssignment(
+        midi_outs=[], midi_ins=[], errors=errors, free_ports={}
+    )
+    for o_host, o_track, i_host, i_track, link in requests:
+        o_req, i_req, channel = link
+        o_port = _RTrackPort(
+            host=o_host,
+            track=o_track['track'],
+            port=out_matchers[o_host].port_of(o_req)
+        )
+        i_port = _RTrackPort(
+            host=i_host, track=i_track, port=in_matchers[i_host].port_of(i_req)
+        )
+        if channel:
+            o_port['channel'] = i_port['channel'] = channel
+        assignment['midi_outs'].append(o_port)
+        assignment['midi_ins'].append(i_port)
+    for host_name in hosts_ports:
+        assignment['free_ports'][host_name] = (
+            in_matchers[host_name].n_free, out_matchers[host_name].n_free
+        )
+    return assignment
+
+
 def get_connection_task(
-    hosts: ty.Sequence[_HostInfo]
+    hosts: ty.Sequence[_HostInfo],
+    channels: int = 1,
 ) -> ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]]:
     """Make task from _HostInfo.
 
@@ -374,158 +916,230 @@ def get_connection_task(
 
     Parameters
     ----------
-    hosts : ty.Sequence[_HostInfo]
-        Description
     hosts : Sequence[_HostInfo]
+    channels : int, optional
+        tracks per port, see PortLinkAllocator
 
     Returns
     ------------------
     Tuple[out_tracks: _RTrackPort, in_tracks: _RTrackPort]
 
+    Raises
+    ------
+    ConnectionsError
+        if any of out tracks cannot be assigned, see assign_ports()
+
     """
-    midi_outs: ty.List[_RTrackPort] = []
-    midi_ins: ty.List[_RTrackPort] = []
+    assignment = assign_ports(hosts, channels)
+    if assignment['errors']:
+        raise iface.ConnectionsError('; '.join(assignment['errors']))
+    return assignment['midi_outs'], assignment['midi_ins']
 
-    hosts_ports: ty.Dict[str, _HostPortsMatched] = match_hosts_ports(hosts)
-    hosts_out_tracks: ty.Dict[str, ty.
-                              List[_ROutTrack]] = get_hosts_out_tracks(hosts)
-    hosts_in_tracks: ty.Dict[str, ty.List[rpr.
-                                          Track]] = get_hosts_in_tracks(hosts)
-    for o_host, o_tracks in hosts_out_tracks.items():
-        for o_track in o_tracks:
-            # str, rpr.Track
-            i_host, i_track = _match_slave_track(o_track, hosts_in_tracks)
-            # !UNCLEAN lists will be modified!
-            _pop_out_port(hosts_ports, o_host, i_host, o_track, midi_outs)
-            # !UNCLEAN lists will be modified!
-            _pop_in_ports(hosts_ports, i_host, i_track, midi_ins)
 
-    return midi_outs, midi_ins
+_ProjectTask = ty.Tuple[rpr.Project, ty.List[_RTrackPort],
+                        ty.List[_RTrackPort]]
 
 
-def _pop_in_ports(
-    hosts_ports: ty.Dict[str, _HostPortsMatched], i_host: str,
-    i_track: rpr.Track, midi_ins: ty.List[_RTrackPort]
-) -> None:
-    """Pop reaper midi port from host info and put into the midi_ins.
+def group_task_by_host(
+    task: ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]]
+) -> ty.Dict[str, ty.List[_ProjectTask]]:
+    """Split connection task to the host and project groups.
 
     Parameters
     ----------
-    hosts_ports : ty.Dict[str, _HostPortsMatched]
-    i_host : str
-        IP or lovalhost
-    i_track : rpr.Track
-    midi_ins : ty.List[_RTrackPort]
-        lost to insert the port
-
-    """
-    assigned = False
-    miss_in_ports_msg = "not enough in ports for host '%s'"
-    for idx, i_port in enumerate(hosts_ports[i_host][0]):
-        if i_port['dest_host'] == 'localhost':
-            midi_ins.append(
-                _RTrackPort(
-                    host=i_host,
-                    track=i_track,
-                    port=hosts_ports[i_host][0].pop(idx)['port']
-                )
-            )
-            assigned = True
-            break
-    if not assigned:
-        raise iface.ConnectionsError(miss_in_ports_msg % i_host)
+    task : Tuple[List[_RTrackPort], List[_RTrackPort]]
+        in ports and out ports, see 'connect_by_task(task)'
 
+    Returns
+    -------
+    Dict[str, List[Tuple[rpr.Project, List[_RTrackPort],
+                         List[_RTrackPort]]]]
+        project with its in ports and out ports by host
+    """
+    groups: ty.Dict[str, ty.Dict[object, _ProjectTask]] = {}
 
-def _pop_out_port(
-    hosts_ports: ty.Dict[str, _HostPortsMatched], o_host: str, i_host: str,
-    o_track: _ROutTrack, midi_outs: ty.List[_RTrackPort]
-) -> None:
-    """Pop reaper midi port from host info and put into the midi_outs.
-
-    Parameters
-    ----------
-    hosts_ports : ty.Dict[str, _HostPortsMatched]
-    o_host : str
-        IP or localhost
-    i_host : str
-        IP or localhost
-    o_track : _ROutTrack
-        master track with slave info
-    midi_outs : ty.List[_RTrackPort]
-        list to insert the port
-
-    """
-    miss_out_ports_msg = "not enough out ports for host '%s'"
-    assigned = False
-    for idx, o_port in enumerate(hosts_ports[o_host][1]):
-        if o_port['dest_host'] == i_host:
-            r_o_port = _RTrackPort(
-                host=o_host,
-                track=o_track['track'],
-                port=hosts_ports[o_host][1].pop(idx)['port']
-            )
-            midi_outs.append(r_o_port)
-            assigned = True
-            break
-    if not assigned:
-        raise iface.ConnectionsError(miss_out_ports_msg % i_host)
+    def get_group(port: _RTrackPort) -> _ProjectTask:
+        project = port['track'].project
+        host_groups = groups.setdefault(port['host'], {})
+        if project.id not in host_groups:
+            host_groups[project.id] = (project, [], [])
+        return host_groups[project.id]
 
+    for i_port in task[0]:
+        get_group(i_port)[1].append(i_port)
+    for o_port in task[1]:
+        get_group(o_port)[2].append(o_port)
+    return {host: list(prs.values()) for host, prs in groups.items()}
 
-def _match_slave_track(
-    o_track: _ROutTrack, hosts_in_tracks: ty.Dict[str, ty.List[rpr.Track]]
-) -> ty.Tuple[str, rpr.Track]:
-    """Get slave track from the slave host info.
 
-    Warning
-    -------
-    slave track will be poped from list.
+def connect_host(host: str, projects: ty.List[_ProjectTask]) -> None:
+    """Connect tracks of one host in one round-trip burst.
 
     Parameters
     ----------
-    o_track : _ROutTrack
-        master track with slave info
-    hosts_in_tracks : ty.Dict[str, ty.List[rpr.Track]]
-
-    """
-    s_track = o_track['slave']['track']
-    assigned = False
-    i_host = o_track['slave']['host']
-    i_tracks = hosts_in_tracks[i_host]
-    for idx, i_track in enumerate(i_tracks):
-        if s_track == i_track:
-            assigned = True
-            i_track = i_tracks.pop(idx)
-            break
-    if not assigned:
-        raise iface.ConnectionsError(
-            "can't find track {n} in project {p} at {s}".format(
-                n=s_track.name, p=s_track.project, s=i_host
-            )
-        )
-    #  pylint: disable=W0631
-    return i_host, i_track
-    #  pylint: enable=W0631
+    host : str
+        'localhost' or IPV4 address
+    projects : List[Tuple[rpr.Project, List[_RTrackPort],
+                          List[_RTrackPort]]]
+        see 'group_task_by_host(task)'
+    """
+    with rpr.connect(host):
+        with rpr.inside_reaper():
+            for project, i_ports, o_ports in projects:
+                with project.make_current_project():
+                    for i_port in i_ports:
+                        set_track_midi_in(
+                            i_port['track'], i_port['port']['idx'],
+                            i_port.get('channel', 0)
+                        )
+                    for o_port in o_ports:
+                        set_track_midi_out(
+                            o_port['track'], o_port['port']['idx'],
+                            o_port.get('channel', 0)
+                        )
 
 
 def connect_by_task(
-    task: ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]]
+    task: ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]],
+    executor: ty.Optional[Executor] = None,
 ) -> None:
     """Make a final connection of all tracks.
 
+    Tracks are grouped by host and project. Every host is connected
+    once, and hosts are connected in parallel.
+
+    Note
+    ----
+    reapy keeps the selected host globally, so hosts are connected
+    in different processes.
+
     Parameters
     ----------
     task : ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]]
-        see 'get_connections_task(hosts)'
+        in ports and out ports
+    executor : Optional[Executor], optional
+        long-lived HostPool with worker for every host by default
 
     """
-    for i_port in task[0]:
-        with rpr.connect(i_port['host']):
-            with i_port['track'].project.make_current_project():
-                set_track_midi_in(i_port['track'], i_port['port']['idx'])
-    for o_port in task[1]:
-        with rpr.connect(o_port['host']):
-            with o_port['track'].project.make_current_project():
-                set_track_midi_out(o_port['track'], o_port['port']['idx'])
+    groups = group_task_by_host(task)
+    if len(groups) < 2 and executor is None:
+        for host, projects in groups.items():
+            connect_host(host, projects)
+        return
+    pool = executor or shared_pool
+    futures = [
+        pool.submit(connect_host, host, projects)
+        for host, projects in groups.items()
+    ]
+    for future in futures:
+        future.result()
+
+
+_Task = ty.Tuple[ty.List[_RTrackPort], ty.List[_RTrackPort]]
+_TaskKey = ty.Tuple[str, object]
+
+
+class TaskDiff(te.TypedDict):
+    """Difference between two connection tasks.
+
+    Parameters
+    ----------
+    ins : List[_RTrackPort]
+        added or changed in ports
+    outs : List[_RTrackPort]
+        added or changed out ports
+    removed_ins : List[_RTrackPort]
+        in ports of the old task, no more used
+    removed_outs : List[_RTrackPort]
+        out ports of the old task, no more used
+    """
+
+    ins: ty.List[_RTrackPort]
+    outs: ty.List[_RTrackPort]
+    removed_ins: ty.List[_RTrackPort]
+    removed_outs: ty.List[_RTrackPort]
+
+
+def _index_ports(ports: ty.List[_RTrackPort]
+                 ) -> ty.Dict[_TaskKey, _RTrackPort]:
+    return {(port['host'], port['track'].id): port for port in ports}
+
+
+def diff_tasks(old: _Task, new: _Task) -> TaskDiff:
+    """Find track ports, which have to be connected or disconnected.
+
+    Tracks are compared by host and id, ports by index and channel.
+
+    Parameters
+    ----------
+    old : Tuple[List[_RTrackPort], List[_RTrackPort]]
+        in ports and out ports, applied before
+    new : Tuple[List[_RTrackPort], List[_RTrackPort]]
+        in ports and out ports
+
+    Returns
+    -------
+    TaskDiff
+    """
+    diff = TaskDiff(ins=[], outs=[], removed_ins=[], removed_outs=[])
+    for n, (changed, removed) in enumerate(
+        ((diff['ins'], diff['removed_ins']),
+         (diff['outs'], diff['removed_outs']))
+    ):
+        old_ports = _index_ports(old[n])
+        new_ports = _index_ports(new[n])
+        for key, port in new_ports.items():
+            old_port = old_ports.get(key)
+            if old_port is None or \
+                    old_port['port']['idx'] != port['port']['idx'] or \
+                    old_port.get('channel') != port.get('channel'):
+                changed.append(port)
+        removed.extend(
+            port for key, port in old_ports.items() if key not in new_ports
+        )
+    return diff
+
+
+def _disconnected(port: _RTrackPort) -> _RTrackPort:
+    return _RTrackPort(
+        host=port['host'],
+        track=port['track'],
+        port=_RMidiPort(idx=-1, name=''),
+    )
+
+
+JACK_PORTS_ACTION = '_RSc3a0868bee74abaf333ac661af9a4a27257c37c1'
+
+
+class _HostPorts(te.TypedDict):
+
+    jack_in_ports: ty.List[_JMidiPort]
+    jack_out_ports: ty.List[_JMidiPort]
+    reaper_in_ports: ty.List[_RMidiPort]
+    reaper_out_ports: ty.List[_RMidiPort]
+
+
+def _read_jack_ports(
+) -> ty.Tuple[ty.List[_JMidiPort], ty.List[_JMidiPort]]:
+    a_id: int = RPR.NamedCommandLookup(JACK_PORTS_ACTION)  # type:ignore
+    rpr.perform_action(a_id)
+    return ty.cast(
+        ty.Tuple[ty.List[_JMidiPort], ty.List[_JMidiPort]],
+        prs.loads('slave_ports')
+    )
+
+
+def _read_midi_ports(
+) -> ty.Tuple[ty.List[_RMidiPort], ty.List[_RMidiPort]]:
+    ins = [
+        _RMidiPort(idx=i, name=port)
+        for i, port in enumerate(rpr.midi.get_input_names())
+    ]
+    outs = [
+        _RMidiPort(idx=i, name=port)
+        for i, port in enumerate(rpr.midi.get_output_names())
+    ]
+    return ins, outs
 
 
 def get_host_jack_ports(
@@ -553,13 +1167,7 @@ def get_host_jack_ports(
         host = None
     with rpr.connect(host):
         with rpr.inside_reaper():
-            a_id: int = RPR.NamedCommandLookup(
-                '_RSc3a0868bee74abaf333ac661af9a4a27257c37c1'
-            )
-            rpr.perform_action(a_id)
-            ports = prs.loads('slave_ports')
-            # print(ports)
-            return ports
+            return _read_jack_ports()
 
 
 def get_host_midi_ports(
@@ -580,61 +1188,408 @@ def get_host_midi_ports(
     """
     if host == 'localhost':
         host = None
+    with rpr.connect(host):
+        with rpr.inside_reaper():
+            return _read_midi_ports()
+
+
+def get_host_ports(host: ty.Optional[str] = None) -> _HostPorts:
+    """Get Jack and Reaper MIDI ports of the host in one remote call.
+
+    Note
+    ----
+    the same reascript, as for get_host_jack_ports(), is needed.
+
+    Parameters
+    ----------
+    host : ty.Optional[str], optional
+        'localhost' or IPV4 address
 
-    ins, outs = [], []
+    Returns
+    -------
+    _HostPorts
+    """
+    if host == 'localhost':
+        host = None
     with rpr.connect(host):
         with rpr.inside_reaper():
-            for i, port in enumerate(rpr.midi.get_input_names()):
-                ins.append(_RMidiPort(idx=i, name=port))
-            for i, port in enumerate(rpr.midi.get_output_names()):
-                outs.append(_RMidiPort(idx=i, name=port))
-    return ins, outs
+            jack_in_ports, jack_out_ports = _read_jack_ports()
+            reaper_in_ports, reaper_out_ports = _read_midi_ports()
+    return _HostPorts(
+        jack_in_ports=jack_in_ports,
+        jack_out_ports=jack_out_ports,
+        reaper_in_ports=reaper_in_ports,
+        reaper_out_ports=reaper_out_ports,
+    )
 
 
-def update_host_info(hosts: ty.List[iface.HostInfo]) -> ty.List[_HostInfo]:
-    """Make backend-specific host info from the given one.
+def _gather_from_hosts(
+    func: ty.Callable[[str], T],
+    hosts: ty.Sequence[str],
+    timeout: float,
+    executor: ty.Optional[Executor],
+) -> ty.Dict[str, T]:
+    if not hosts:
+        return {}
+    pool = executor or shared_pool
+    futures = {host: pool.submit(func, host) for host in hosts}
+    deadline = time.monotonic() + timeout
+    try:
+        results: ty.Dict[str, T] = {}
+        for host, future in futures.items():
+            try:
+                results[host] = future.result(
+                    max(0, deadline - time.monotonic())
+                )
+            except TimeoutError:
+                # hung reapy calls would keep their workers forever
+                if isinstance(pool, HostPool):
+                    pool.recycle(
+                        host for host, future in futures.items()
+                        if not future.done()
+                    )
+                raise iface.ConnectionsError(
+                    f"host '{host}' did not answer in {timeout} s"
+                )
+            except Exception as e:
+                raise iface.ConnectionsError(
+                    f"can't get ports of host '{host}': {e}"
+                ) from e
+        return results
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def gather_hosts_ports(
+    hosts: ty.Sequence[str],
+    timeout: float = 5,
+    executor: ty.Optional[Executor] = None,
+) -> ty.Dict[str, _HostPorts]:
+    """Call get_host_ports() on all hosts concurrently.
+
+    Note
+    ----
+    reapy keeps the selected host globally, so hosts are asked
+    in different processes.
 
     Parameters
     ----------
-    hosts : ty.List[iface.HostInfo]
-        ip and list of in and out tracks
+    hosts : Sequence[str]
+        'localhost' or IPV4 addresses
+    timeout : float, optional
+        seconds to wait for every host
+    executor : Optional[Executor], optional
+        long-lived HostPool with worker for every host by default
 
     Returns
     -------
-    ty.List[_HostInfo]
-        ip, list of tracks and list of midi ports
+    Dict[str, _HostPorts]
+        by host
+
+    Raises
+    ------
+    ConnectionsError
+        if host did not answer in time or failed
+    """
+    return _gather_from_hosts(get_host_ports, hosts, timeout, executor)
+
+
+def get_host_stamp(host: ty.Optional[str] = None) -> str:
+    """Get hash of Reaper MIDI devices of the host.
+
+    It is much cheaper than get_host_ports(), as no action is
+    performed.
+
+    Parameters
+    ----------
+    host : ty.Optional[str], optional
+        'localhost' or IPV4 address
+
+    Returns
+    -------
+    str
+    """
+    if host == 'localhost':
+        host = None
+    with rpr.connect(host):
+        with rpr.inside_reaper():
+            ins, outs = _read_midi_ports()
+    names = [port['name'] for port in ins] + ['\n'] + [
+        port['name'] for port in outs
+    ]
+    return hashlib.sha1('\n'.join(names).encode()).hexdigest()
+
+
+def request_host_stamp(
+    host: str, port: int = AGENT_PORT, timeout: float = 1
+) -> str:
+    """Get stamp of the host from its inventory agent.
+
+    Unlike get_host_stamp(), Reaper of the host is not asked: agent
+    keeps the stamp current by itself, and it includes version of the
+    jack graph of the host (see inventory.InventoryAgent).
+
+    Parameters
+    ----------
+    host : str
+        'localhost' or IPV4 address
+    port : int, optional
+        port of agent
+    timeout : float, optional
+
+    Returns
+    -------
+    str
+        empty if the host has no agent
+    """
+    if host == 'localhost':
+        host = '127.0.0.1'
+    try:
+        stamp = request(HOST_STAMP_TYPE, '', host, port, timeout)
+    except OSError:
+        return ''
+    return bytes(stamp).decode()
+
+
+def _get_stamp(host: str, agent_port: ty.Optional[int] = AGENT_PORT) -> str:
+    """Get stamp from the agent, or from Reaper if host has no agent."""
+    stamp = request_host_stamp(host, agent_port) if agent_port else ''
+    return stamp or get_host_stamp(host)
+
+
+class PortsCache(te.Protocol):
+    """Anything, that can give ports of hosts to the Connector."""
+
+    def get(self, hosts: ty.Sequence[str]) -> ty.Dict[str, _HostPorts]:
+        """Get ports by host."""
+        ...
+
+
+class HostPortsCache:
+    """Ports of hosts, refreshed only if host has changed.
+
+    Host is considered changed if its stamp differs from the cached one.
+    Stamp is got from the inventory agent of the host, so it is cheap
+    and includes version of the host jack graph. Stamp of host without
+    agent is the hash of its Reaper MIDI devices, got by remote call
+    (see get_host_stamp). If observer is given, version of the local
+    jack graph (see JackObserver) is also compared for the 'localhost'.
+
+    Attributes
+    ----------
+    max_age : float
+        seconds, after which host ports are refreshed anyway
+    """
+
+    def __init__(
+        self,
+        max_age: float = 60,
+        timeout: float = 5,
+        executor: ty.Optional[Executor] = None,
+        observer: ty.Optional[ty.Callable[[], JackObserver]] = None,
+        agent_port: ty.Optional[int] = AGENT_PORT,
+    ) -> None:
+        """Ports of hosts, refreshed only if host has changed.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            seconds, after which host ports are refreshed anyway
+        timeout : float, optional
+            seconds to wait for every host
+        executor : Optional[Executor], optional
+            shared HostPool by default
+        observer : Optional[Callable[[], JackObserver]], optional
+            getter of the local jack observer (e.g. get_observer),
+            needed only if the 'localhost' has no agent
+        agent_port : Optional[int], optional
+            port of inventory agents, None to ask Reaper of hosts
+        """
+        self.max_age = max_age
+        self.timeout = timeout
+        self._executor = executor
+        self._observer = observer
+        self._agent_port = agent_port
+        self._ports: ty.Dict[str, _HostPorts] = {}
+        self._stamps: ty.Dict[str, ty.Tuple[str, int]] = {}
+        self._times: ty.Dict[str, float] = {}
+
+    def get(self, hosts: ty.Sequence[str]) -> ty.Dict[str, _HostPorts]:
+        """Get ports of hosts, asking only changed hosts for them.
+
+        Parameters
+        ----------
+        hosts : Sequence[str]
+            'localhost' or IPV4 addresses
+
+        Returns
+        -------
+        Dict[str, _HostPorts]
+            by host
+
+        Raises
+        ------
+        ConnectionsError
+            if host did not answer in time or failed
+        """
+        executor = self._executor
+        now = time.monotonic()
+        stamps = {
+            host: (stamp, self._jack_version(host))
+            for host, stamp in _gather_from_hosts(
+                partial(_get_stamp, agent_port=self._agent_port), hosts,
+                self.timeout, executor
+            ).items()
+        }
+        stale = [
+            host for host in hosts if host not in self._ports
+            or self._stamps.get(host) != stamps[host]
+            or now - self._times[host] > self.max_age
+        ]
+        fresh = _gather_from_hosts(
+            get_host_ports, stale, self.timeout, executor
+        )
+        for host, ports in fresh.items():
+            self._ports[host] = ports
+            self._stamps[host] = stamps[host]
+            self._times[host] = now
+        return {host: self._ports[host] for host in hosts}
+
+    def invalidate(self, host: ty.Optional[str] = None) -> None:
+        """Force refresh of the host, or of all hosts if not given."""
+        for name in ([host] if host else list(self._ports)):
+            self._ports.pop(name, None)
 
+    def close(self) -> None:
+        """Shutdown HostPool, if it is used, the next call restarts it."""
+        if self._executor is None:
+            shared_pool.shutdown()
+
+    def _jack_version(self, host: str) -> int:
+        if host != 'localhost' or self._observer is None:
+            return 0
+        return self._observer().version
+
+
+def make_host_info(
+    hosts: ty.List[iface.HostInfo], ports: ty.Dict[str, _HostPorts]
+) -> ty.List[_HostInfo]:
+    """Join tracks of hosts with their ports.
+
+    Parameters
+    ----------
+    hosts : List[iface.HostInfo]
+    ports : Dict[str, _HostPorts]
+        by host
+
+    Returns
+    -------
+    List[_HostInfo]
     """
     hosts_new: ty.List[_HostInfo] = []
     for host in hosts:
-        jack_in_ports, jack_out_ports = get_host_jack_ports(host['host'])
-        reaper_in_ports, reaper_out_ports = get_host_midi_ports(host['host'])
+        host_ports = ports[host['host']]
         hosts_new.append(
             _HostInfo(
                 host=host['host'],
                 in_tracks=host['in_tracks'],
                 out_tracks=host['out_tracks'],
-                jack_in_ports=jack_in_ports,
-                jack_out_ports=jack_out_ports,
-                reaper_in_ports=reaper_in_ports,
-                reaper_out_ports=reaper_out_ports,
+                jack_in_ports=host_ports['jack_in_ports'],
+                jack_out_ports=host_ports['jack_out_ports'],
+                reaper_in_ports=host_ports['reaper_in_ports'],
+                reaper_out_ports=host_ports['reaper_out_ports'],
             )
         )
     return hosts_new
 
 
+def update_host_info(
+    hosts: ty.List[iface.HostInfo],
+    timeout: float = 5,
+    executor: ty.Optional[Executor] = None,
+) -> ty.List[_HostInfo]:
+    """Make backend-specific host info from the given one.
+
+    Ports of all hosts are gathered concurrently.
+
+    Parameters
+    ----------
+    hosts : ty.List[iface.HostInfo]
+        ip and list of in and out tracks
+    timeout : float, optional
+        seconds to wait for every host
+    executor : Optional[Executor], optional
+        see gather_hosts_ports()
+
+    Returns
+    -------
+    ty.List[_HostInfo]
+        ip, list of tracks and list of midi ports
+
+    Raises
+    ------
+    ConnectionsError
+        if any host did not answer
+
+    """
+    ports = gather_hosts_ports([host['host'] for host in hosts], timeout,
+                               executor)
+    return make_host_info(hosts, ports)
+
+
 class Connector(iface.Connector):
     """Concrete Connector realization.
 
     Accepts HostInfo and connects tracks by Jack backend
 
+    In differential mode 'update()' applies only routings, changed
+    since the last connection. Tracks, which are no more connected, are
+    disconnected, if their project is still known.
+
     Init Parameters
     ---------------
     hosts : List[HostInfo]
             see interface.HostInfo
+    ports_cache : Optional[PortsCache]
+            HostPortsCache with default parameters if not given,
+            see also inventory.AgentPortsCache
+    differential : bool
+            True by default
+    channels : int
+            tracks per port, see PortLinkAllocator
 
     """
 
+    def __init__(
+        self,
+        hosts: ty.List[iface.HostInfo],
+        ports_cache: ty.Optional[PortsCache] = None,
+        differential: bool = True,
+        channels: int = 1,
+    ) -> None:
+        super().__init__(hosts)
+        self.ports_cache: PortsCache = ports_cache or HostPortsCache()
+        self.differential = differential
+        self.channels = channels
+        self.last_task: ty.Optional[_Task] = None
+
+    def update(self, hosts: ty.List[iface.HostInfo]) -> None:
+        """Update hosts list of Connector.
+
+        Called by the Connector user.
+
+        Parameters
+        ----------
+        hosts : List[HostInfo]
+
+        """
+        self._hosts = hosts
+        if self.differential and self.last_task is not None:
+            self.connect_changed()
+        else:
+            self.connect_all()
+
     def connect_all(self) -> None:
         """Call by the class user.
 
@@ -645,6 +1600,50 @@ class Connector(iface.Connector):
         sessioin_management.connections.interface.ConnectionsError
 
         """
-        host_info = update_host_info(self.hosts)
-        task = get_connection_task(host_info)
+        task = self._make_task()
         connect_by_task(task)
+        self.last_task = task
+
+    def connect_changed(self) -> TaskDiff:
+        """Apply only routings, changed since the last connection.
+
+        Returns
+        -------
+        TaskDiff
+            what was applied
+
+        Raises
+        ------
+        sessioin_management.connections.interface.ConnectionsError
+
+        """
+        task = self._make_task()
+        diff = diff_tasks(self.last_task or ([], []), task)
+        alive = self._alive_projects()
+        ins = diff['ins'] + [
+            _disconnected(port) for port in diff['removed_ins']
+            if (port['host'], port['track'].project.id) in alive
+        ]
+        outs = diff['outs'] + [
+            _disconnected(port) for port in diff['removed_outs']
+            if (port['host'], port['track'].project.id) in alive
+        ]
+        if ins or outs:
+            connect_by_task((ins, outs))
+        self.last_task = task
+        return diff
+
+    def _make_task(self) -> _Task:
+        ports = self.ports_cache.get([host['host'] for host in self.hosts])
+        host_info = make_host_info(self.hosts, ports)
+        midi_outs, midi_ins = get_connection_task(host_info, self.channels)
+        return midi_ins, midi_outs
+
+    def _alive_projects(self) -> ty.Set[ty.Tuple[str, object]]:
+        alive: ty.Set[ty.Tuple[str, object]] = set()
+        for host in self.hosts:
+            for track in host['in_tracks']:
+                alive.add((host['host'], track.project.id))
+            for o_track in host['out_tracks']:
+                alive.add((host['host'], o_track['track'].project.id))
+        return alive
@@ -177,6 +177,7 @@ class Main(kivy.uix.floatlayout.FloatLayout, IHandler):
     gui_info = ty.cast(GuiInfo, ObjectProperty(example_gui_info))
     master_project_name = StringProperty('<master name>')
     count = 0
+    data_types = (b'slave_list', )
 
     def redraw_gui_from_info(self) -> None:
         print('redrawing')
@@ -202,15 +203,11 @@ class Main(kivy.uix.floatlayout.FloatLayout, IHandler):
         for track_info in self.gui_info['tracked_tracks']:
             self.tracked_tracks.add_widget(TrackedTrack(track_info))
 
-    def can_handle(self, data_type: bytes) -> bool:
-        if data_type == b'slave_list': return True
-        return False
-
     def handle(self, data_type: bytes, data: bytes) -> bytes:
         for slave in self.slaves:
             self.slaves_wid.remove_widget(slave)
         self.slaves.clear()
-        slaves = ty.cast(ty.List[str], js.loads(data, encoding='utf-8'))
+        slaves = ty.cast(ty.List[str], js.loads(bytes(data), encoding='utf-8'))
         print(slaves)
         for host in slaves:
             slave = Slave()
@@ -4,36 +4,40 @@ import IPy as ipy
 from enum import Enum
 
 from networking import IHandler
-from networking import ReaperServer
+from networking import AsyncReaperServer
 from networking import GUI_PORT, MASTER_PORT, DEF_HOST
-from networking import send_data
-from networking import encode_data
+from networking import request
 from basic_handlers import PrintHandler
 from slaves import Slaves
+# registry of schemas has to be shared with networking
+from reasession.codec import register
+
+GuiSlaves = te.TypedDict('GuiSlaves', {'slaves': ty.List[str]})
+GUI_SLAVES = register(20, GuiSlaves)
 
 
 class GuiHandler(IHandler):
+    schema = GUI_SLAVES
+
     def __init__(self, parent: 'GuiServer') -> None:
-        self._handlers: ty.Dict[bytes, ty.Callable[[bytes], bytes]] = {
+        self._handlers: ty.Dict[bytes, ty.Callable[[bytes], GuiSlaves]] = {
             b'gui_start': self._gui_start,
         }
+        self.data_types = tuple(self._handlers)
         self._parent = parent
 
-    def can_handle(self, data_type: bytes) -> bool:
-        if data_type in self._handlers:
-            return True
-        return False
-
-    def handle(self, data_type: bytes, data: bytes) -> bytes:
+    def handle(self, data_type: bytes, data: bytes) -> GuiSlaves:
         return self._handlers[data_type](data)
 
-    def _gui_start(self, data: bytes) -> bytes:
-        return encode_data(self._parent.update_gui_info())
+    def _gui_start(self, data: bytes) -> GuiSlaves:
+        return self._parent.update_gui_info()
 
 
 class GuiServer:
     def __init__(self, slaves: Slaves) -> None:
-        self._server = ReaperServer(DEF_HOST, MASTER_PORT, [PrintHandler])
+        self._server = AsyncReaperServer(
+            DEF_HOST, MASTER_PORT, [PrintHandler]
+        )
         self._gui_handler = GuiHandler(self)
         self._server.register_handler(self._gui_handler)
         self._slaves = slaves
@@ -45,12 +49,16 @@ class GuiServer:
         return self._server.at_exit()
 
     def uptade_gui(self) -> None:
-        send_data(
-            'gui_update', self.update_gui_info(), host=DEF_HOST, port=GUI_PORT
+        request(
+            'gui_update',
+            self.update_gui_info(),
+            host=DEF_HOST,
+            port=GUI_PORT,
+            schema=GUI_SLAVES
         )
 
-    def update_gui_info(self) -> ty.Dict[str, ty.List[str]]:
-        return {'slaves': self._slaves.active_slaves_list()}
+    def update_gui_info(self) -> GuiSlaves:
+        return GuiSlaves(slaves=self._slaves.active_slaves_list())
 
 
 T_slave_servers = ty.List[ipy.IP]
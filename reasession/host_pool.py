@@ -0,0 +1,114 @@
+"""Long-lived worker processes, calling REAPER hosts.
+
+Starting a process pool for every call to hosts costs more, than the
+call itself, so HostPool keeps one worker per host between calls.
+
+Example
+-------
+    futures = [
+        shared_pool.submit(get_host_ports, host) for host in hosts
+    ]
+    ports = [future.result(5) for future in futures]
+"""
+
+import threading
+import typing as ty
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing import pool as mp_pool
+
+T = ty.TypeVar('T')
+
+
+class HostPool(Executor):
+    """Long-lived worker process per host.
+
+    reapy keeps the selected host globally, so hosts are called
+    in different processes. Calls are routed by their first argument,
+    which has to be the host. Worker of the host is started by the
+    first call to it and reused.
+
+    Worker, hung in a call, can only be killed: recycle() kills workers
+    of the given hosts only, and the next call starts the new one.
+    """
+
+    def __init__(self) -> None:
+        self._pools: ty.Dict[str, mp_pool.Pool] = {}
+        self._pending: ty.Dict[str, ty.Set['Future[ty.Any]']] = {}
+        self._lock = threading.Lock()
+
+    def submit(  # type:ignore
+        self, fn: ty.Callable[..., T], *args: ty.Any, **kwargs: ty.Any
+    ) -> 'Future[T]':
+        host = args[0]
+        future: 'Future[T]' = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            if host not in self._pools:
+                self._pools[host] = mp_pool.Pool(1)
+                self._pending[host] = set()
+            pending = self._pending[host]
+            pending.add(future)
+            self._pools[host].apply_async(
+                fn, args, kwargs,
+                partial(self._resolve, pending, future),
+                partial(self._resolve, pending, future, None)
+            )
+        return future
+
+    def recycle(self, hosts: ty.Iterable[str]) -> None:
+        """Kill workers of hosts, their calls fail with BrokenProcessPool.
+        """
+        for host in hosts:
+            with self._lock:
+                pool = self._pools.pop(host, None)
+                pending = self._pending.pop(host, set())
+                futures = list(pending)
+                pending.clear()
+            if pool is None:
+                continue
+            pool.terminate()
+            error = BrokenProcessPool(f'worker of {host} is killed')
+            for future in futures:
+                future.set_exception(error)
+
+    def shutdown(
+        self, wait: bool = True, *, cancel_futures: bool = False
+    ) -> None:
+        if cancel_futures:
+            with self._lock:
+                hosts = list(self._pools)
+            self.recycle(hosts)
+            return
+        with self._lock:
+            pools, self._pools = self._pools, {}
+            self._pending = {}
+        for pool in pools.values():
+            pool.close()
+            if wait:
+                pool.join()
+            else:
+                # pool is terminated, when collected, so it is kept
+                # by the thread until running calls finish
+                threading.Thread(target=pool.join, daemon=True).start()
+
+    def _resolve(
+        self,
+        pending: ty.Set['Future[ty.Any]'],
+        future: 'Future[ty.Any]',
+        result: ty.Any,
+        error: ty.Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            if future not in pending:  # worker is killed
+                return
+            pending.discard(future)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+
+shared_pool = HostPool()
+"""Module-wide pool, meant to be shared by all callers of the process."""
@@ -1,20 +1,68 @@
+import asyncio
+import queue
+import select
+import zlib
 import socket as st
 import socketserver as ss
 # import json as js
-import pickle as pcl
+import struct
 import typing as ty
+from concurrent.futures import Future
+from functools import partial
 from threading import current_thread
+from threading import Lock
 from threading import Thread
 from threading import main_thread
 from threading import enumerate as tr_enum
+from reasession.codec import CODEC_RAW
+from reasession.codec import CodecError
+from reasession.codec import Data
+from reasession.codec import Schema
+from reasession.codec import decode
+from reasession.codec import encode
 from reasession.common import log
 from reasession.common import TimeCallback
 from reasession.config import ANNOUNCE_STRING
 
+try:
+    import lzma
+except ImportError:  # python, built without liblzma
+    lzma = None  # type:ignore
+
 DEF_HOST: str = '127.0.0.1'
 DEF_PORT: int = 49541
 MASTER_PORT: int = 49542
 GUI_PORT: int = 49543
+AGENT_PORT: int = 49544
+
+FRAME_MAGIC = b'RSF\x01'
+FRAME_HEADER = struct.Struct('!4sBB10sII')
+"""magic, flags, codec, type, request id, data size."""
+FLAG_RESPONSE = 0x01
+FLAG_ZLIB = 0x02
+FLAG_LZMA = 0x04
+FLAG_ERROR = 0x08
+"""Response flag: handlers failed, data is the error message."""
+IDLE_TIMEOUT: float = 30
+"""Seconds, server keeps silent persistent connection."""
+COMPRESS_TYPE = b'compress'
+"""Frame type, negotiating compression of the connection."""
+COMPRESSIONS: ty.Tuple[str, ...] = ('zlib', 'lzma')
+"""Supported compressions, in order of preference."""
+COMPRESS_THRESHOLD = 4096
+"""Bytes, payloads of smaller size are never compressed."""
+MAX_FRAME_SIZE = 64 * 2**20
+"""Bytes, larger frames and packages are rejected before receiving."""
+
+_Compressor = ty.Tuple[int, ty.Callable[[Data], bytes],
+                       ty.Callable[[Data], bytes], ty.Type[Exception]]
+_compressors: ty.Dict[str, _Compressor] = {
+    'zlib': (FLAG_ZLIB, zlib.compress, zlib.decompress, zlib.error),
+}
+if lzma is not None:
+    _compressors['lzma'] = (
+        FLAG_LZMA, lzma.compress, lzma.decompress, lzma.LZMAError
+    )
 
 
 def _fill_prefix(prefix: str) -> bytes:
@@ -24,15 +72,12 @@ def _fill_prefix(prefix: str) -> bytes:
     return str(prefix).encode().zfill(10)
 
 
-def encode_data(data: object) -> bytes:
-    if isinstance(data, bytes):
-        data_enc = data
-    elif isinstance(data, str):
-        data_enc = bytes(data, 'utf-8')
-    else:
-        # data_enc = bytes(js.dumps(data), 'utf-8')
-        data_enc = pcl.dumps(data)
-    return data_enc
+def encode_data(data: object, schema: ty.Optional[Schema] = None) -> bytes:
+    """Encode data by schema, or by pickle if schema is not given.
+
+    str is encoded as utf-8, bytes are left as is.
+    """
+    return bytes(encode(data, schema)[1])
 
 
 def send_data(
@@ -65,87 +110,753 @@ def send_data(
         sock.connect((host, port))
         sock.sendall(type_enc + size + data_enc)
 
-        # Receive data from the server and shut down
-        received = str(sock.recv(1024), "utf-8")
+        # Receive data until the server closes connection
+        chunks = []
+        while True:
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        received = str(b''.join(chunks), "utf-8")
         # sock.close()
     return received
 
 
+class ProtocolError(Exception):
+    """Peer sent something, that is not an expected frame."""
+
+
+class RemoteError(Exception):
+    """Server handlers failed to handle the request."""
+
+
+class Frame(ty.NamedTuple):
+    """Message of persistent connection.
+
+    type_ is up to 10 bytes, data is encoded by codec.encode(),
+    codec is the tag, it is encoded by.
+    """
+
+    type_: bytes
+    data: Data
+    request_id: int = 0
+    flags: int = 0
+    codec: int = CODEC_RAW
+
+
+def pack_frame(frame: Frame) -> bytes:
+    """Make bytes of the frame: fixed size header, then data."""
+    assert len(frame.type_) <= 10, 'too long type'
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC, frame.flags, frame.codec, frame.type_.zfill(10),
+        frame.request_id, len(frame.data)
+    )
+    return header + frame.data
+
+
+def recv_exact(sock: st.socket, size: int) -> bytes:
+    """Receive exactly size bytes.
+
+    Raises
+    ------
+    ConnectionError
+        if connection is closed before
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError('connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_view(sock: st.socket, size: int) -> memoryview:
+    """Receive exactly size bytes into the preallocated buffer.
+
+    Unlike recv_exact(), data is not copied: chunks are received
+    directly into the buffer, and the view of it is returned.
+
+    Raises
+    ------
+    ConnectionError
+        if connection is closed before
+    """
+    view = memoryview(bytearray(size))
+    pos = 0
+    while pos < size:
+        received = sock.recv_into(view[pos:])
+        if not received:
+            raise ConnectionError('connection closed by peer')
+        pos += received
+    return view
+
+
+def read_frame(sock: st.socket, head: bytes = b'') -> Frame:
+    """Receive one frame.
+
+    Data of the frame is memoryview of the received buffer.
+
+    Parameters
+    ----------
+    sock : socket
+    head : bytes, optional
+        beginning of the header, if it is already received
+
+    Raises
+    ------
+    ConnectionError
+        if connection is closed
+    ProtocolError
+        if peer sent not a frame
+    """
+    header = head + recv_exact(sock, FRAME_HEADER.size - len(head))
+    frame, size = _unpack_header(header)
+    return frame._replace(data=recv_view(sock, size))
+
+
+def error_frame(request: Frame, error: Exception) -> Frame:
+    """Make response to the request, that handlers failed with error."""
+    return Frame(
+        request.type_, repr(error).encode(), request.request_id,
+        FLAG_RESPONSE | FLAG_ERROR
+    )
+
+
+def _is_stale(sock: st.socket) -> bool:
+    """Check without blocking, if kept socket is closed by peer.
+
+    Idle socket has nothing to read, so readable one is either closed,
+    or has unexpected data.
+    """
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def _unpack_header(header: bytes) -> ty.Tuple[Frame, int]:
+    """Get frame without data and size of the data.
+
+    Raises
+    ------
+    ProtocolError
+        if header is not of frame, or data is larger than MAX_FRAME_SIZE
+    """
+    magic, flags, codec, type_, request_id, size = FRAME_HEADER.unpack(
+        header
+    )
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f'not a frame: {header!r}')
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f'too large frame: {size} bytes')
+    return Frame(type_.lstrip(b'0'), b'', request_id, flags, codec), size
+
+
+def _package_size(header: bytes) -> int:
+    """Get size of data of the legacy package.
+
+    Raises
+    ------
+    ProtocolError
+        if size is not a number, or is larger than MAX_FRAME_SIZE
+    """
+    try:
+        size = int(header[10:20])
+    except ValueError as e:
+        raise ProtocolError(f'not a package: {header!r}') from e
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f'too large package: {size} bytes')
+    return size
+
+
+def compress_frame(
+    frame: Frame,
+    compression: ty.Optional[str],
+    threshold: int = COMPRESS_THRESHOLD
+) -> Frame:
+    """Compress data of the frame, if it is large enough.
+
+    Parameters
+    ----------
+    frame : Frame
+    compression : Optional[str]
+        negotiated for the connection, None if data is sent raw
+    threshold : int, optional
+        bytes
+
+    Returns
+    -------
+    Frame
+        with compression flag if data is compressed
+    """
+    if compression is None or len(frame.data) < threshold:
+        return frame
+    flag, compress, _, _ = _compressors[compression]
+    data = compress(frame.data)
+    if len(data) >= len(frame.data):
+        return frame
+    return frame._replace(data=data, flags=frame.flags | flag)
+
+
+def decompress_frame(frame: Frame) -> Frame:
+    """Decompress data of the frame, if it is compressed.
+
+    Raises
+    ------
+    ProtocolError
+        if compression is unknown or data is broken
+    """
+    for flag, _, decompress, error in _compressors.values():
+        if frame.flags & flag:
+            try:
+                data = decompress(frame.data)
+            except error as e:
+                raise ProtocolError(f'broken compressed data: {e}') from e
+            return frame._replace(
+                data=memoryview(data), flags=frame.flags & ~flag
+            )
+    if frame.flags & (FLAG_ZLIB | FLAG_LZMA):
+        raise ProtocolError(f'unsupported compression: {frame.flags:#x}')
+    return frame
+
+
+def supported_compressions(names: ty.Sequence[str]) -> ty.List[str]:
+    """Filter out compressions, that are not available."""
+    return [name for name in names if name in _compressors]
+
+
+def choose_compression(offered: Data) -> ty.Optional[str]:
+    """Get the first supported of compressions, offered by client."""
+    for name in bytes(offered).decode().split(','):
+        if name in _compressors:
+            return name
+    return None
+
+
+class Connection:
+    """Persistent framed connection to ReaperServer.
+
+    Socket is opened at the first request and kept open. If the kept
+    socket is closed by server (e.g. for idle), the new one is opened.
+    Request is repeated on the new socket only if it failed to be sent,
+    so it never runs twice. If handlers fail, server responds with
+    error, and request() raises RemoteError.
+
+    Compression is negotiated at opening of the socket. Servers, that
+    don't know about compression, answer to negotiation with empty
+    response, and data is sent raw.
+
+    Pickled responses are rejected, unless allow_pickle is set.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float = 1,
+        compressions: ty.Sequence[str] = COMPRESSIONS,
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
+    ) -> None:
+        """Persistent framed connection to ReaperServer.
+
+        Parameters
+        ----------
+        host : str
+            ip address of server
+        port : int
+        timeout : float, optional
+            default timeout of requests
+        compressions : Sequence[str], optional
+            to offer to server, in order of preference, empty to send
+            all data raw
+        compress_threshold : int, optional
+            bytes, smaller payloads are sent raw
+        allow_pickle : bool, optional
+            decode pickled responses, only for trusted server,
+            see codec.decode()
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.compressions = supported_compressions(compressions)
+        self.compress_threshold = compress_threshold
+        self.allow_pickle = allow_pickle
+        self.compression: ty.Optional[str] = None
+        self._sock: ty.Optional[st.socket] = None
+        self._lock = Lock()
+        self._last_id = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._sock is not None
+
+    def request(
+        self,
+        type_: str,
+        data: object,
+        timeout: ty.Optional[float] = None,
+        schema: ty.Optional[Schema] = None,
+    ) -> ty.Any:
+        """Send data and wait for response.
+
+        Parameters
+        ----------
+        type_ : str
+            up to 10 bytes, see IHandler
+        data : object
+            see encode_data()
+        timeout : Optional[float], optional
+            connection default if not given
+        schema : Optional[Schema], optional
+            of data, see codec.register()
+
+        Returns
+        -------
+        Any
+            response of server handlers, bytes if handler responded
+            with bytes, otherwise decoded by the codec of response
+
+        Raises
+        ------
+        ConnectionRefusedError
+            if server is not running
+        socket.timeout
+            connection is closed, as response can come later
+        ConnectionError
+            if connection is broken after request is sent
+        RemoteError
+            if server handlers failed
+        ProtocolError
+        CodecError
+            if response can not be decoded, or is pickled, but pickle
+            is not allowed
+        """
+        codec, payload = encode(data, schema)
+        frame = Frame(type_.encode(), payload, codec=codec)
+        with self._lock:
+            response = self._request_once_more(frame, timeout)
+        if response.flags & FLAG_ERROR:
+            raise RemoteError(bytes(response.data).decode('utf-8', 'replace'))
+        if response.codec == CODEC_RAW:
+            return bytes(response.data)
+        return decode(response.codec, response.data, self.allow_pickle)
+
+    def close(self) -> None:
+        """Close socket, it will be opened by the next request."""
+        with self._lock:
+            self._close()
+
+    def _request_once_more(
+        self, frame: Frame, timeout: ty.Optional[float]
+    ) -> Frame:
+        if self._sock is not None and _is_stale(self._sock):
+            self._close()
+        reused = self._sock is not None
+        try:
+            request_id = self._send(frame, timeout)
+        except OSError:
+            # request is not sent, so handlers did not get it
+            if not reused:
+                raise
+            request_id = self._send(frame, timeout)
+        try:
+            return decompress_frame(self._receive(request_id))
+        except Exception:
+            self._close()
+            raise
+
+    def _send(self, frame: Frame, timeout: ty.Optional[float]) -> int:
+        """Open socket if needed and send the request.
+
+        Socket is closed if failed.
+
+        Returns
+        -------
+        int
+            id of the request
+        """
+        try:
+            if self._sock is None:
+                self._sock = st.create_connection(
+                    (self.host, self.port), timeout or self.timeout
+                )
+                if self.compressions:
+                    self._sock.settimeout(timeout or self.timeout)
+                    self.compression = self._negotiate()
+            self._sock.settimeout(timeout or self.timeout)
+            return self._send_frame(
+                compress_frame(
+                    frame, self.compression, self.compress_threshold
+                )
+            )
+        except Exception:
+            self._close()
+            raise
+
+    def _negotiate(self) -> ty.Optional[str]:
+        response = self._exchange(
+            Frame(COMPRESS_TYPE, ','.join(self.compressions).encode())
+        )
+        name = bytes(response.data).decode()
+        return name if name in self.compressions else None
+
+    def _exchange(self, frame: Frame) -> Frame:
+        return self._receive(self._send_frame(frame))
+
+    def _send_frame(self, frame: Frame) -> int:
+        assert self._sock is not None
+        self._last_id = self._last_id % 0xffffffff + 1
+        self._sock.sendall(
+            pack_frame(frame._replace(request_id=self._last_id))
+        )
+        return self._last_id
+
+    def _receive(self, request_id: int) -> Frame:
+        assert self._sock is not None
+        response = read_frame(self._sock)
+        if response.request_id != request_id:
+            raise ProtocolError(
+                f'response {response.request_id} to {request_id} request'
+            )
+        return response
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            self.compression = None
+
+
+class ConnectionManager:
+    """Keeps one persistent connection per server.
+
+    Module-wide instance 'connections' is meant to be shared by all
+    clients of the process.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 1,
+        compressions: ty.Sequence[str] = COMPRESSIONS,
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
+    ) -> None:
+        """Parameters are passed to every Connection."""
+        self.timeout = timeout
+        self.compressions = compressions
+        self.compress_threshold = compress_threshold
+        self.allow_pickle = allow_pickle
+        self._connections: ty.Dict[ty.Tuple[str, int], Connection] = {}
+        self._lock = Lock()
+
+    def get(self, host: str, port: int) -> Connection:
+        """Get connection to server, made if needed."""
+        with self._lock:
+            key = (host, port)
+            if key not in self._connections:
+                self._connections[key] = Connection(
+                    host, port, self.timeout, self.compressions,
+                    self.compress_threshold, self.allow_pickle
+                )
+            return self._connections[key]
+
+    def request(
+        self,
+        type_: str,
+        data: object,
+        host: str = DEF_HOST,
+        port: int = DEF_PORT,
+        timeout: ty.Optional[float] = None,
+        schema: ty.Optional[Schema] = None,
+    ) -> ty.Any:
+        """See Connection.request()."""
+        return self.get(host, port).request(type_, data, timeout, schema)
+
+    def close(self, host: str, port: int) -> None:
+        """Close and forget connection to the server."""
+        with self._lock:
+            conn = self._connections.pop((host, port), None)
+        if conn is not None:
+            conn.close()
+
+    def close_all(self) -> None:
+        """Has to be called at exit."""
+        with self._lock:
+            conns = list(self._connections.values())
+            self._connections.clear()
+        for conn in conns:
+            conn.close()
+
+
+connections = ConnectionManager()
+
+
+def request(
+    type_: str,
+    data: object,
+    host: str = DEF_HOST,
+    port: int = DEF_PORT,
+    timeout: ty.Optional[float] = None,
+    schema: ty.Optional[Schema] = None,
+) -> ty.Any:
+    """Send data by the shared persistent connection and get response.
+
+    type: str
+        string up to 10 bytes, which will be handled
+        by one of IHandler classes
+    data: object
+        if it is str or bytes will be sent as bytes encoded as utf-8
+    host: str
+        ip address of server
+    port: int
+        port of server
+    timeout: Optional[float]
+        seconds, connection default if not given
+    schema: Optional[Schema]
+        of data, see codec.register()
+
+    Returns bytes if handler responded with bytes, otherwise decoded
+    response, see Connection.request()
+    """
+    return connections.request(type_, data, host, port, timeout, schema)
+
+
 class IHandler:
     """Base class for slave handlers.
 
+    data_types: Tuple[bytes, ...]
+        types of data, handler accepts. Servers route them to the
+        handler by lookup in the DispatchTable.
     can_handle(self, data_type: bytes) -> bool:
-        should return True if class can handle data of type
-    handle(self, data_type: bytes, data: bytes) -> bytes:
+        should return True if class can handle data of type.
+        Is used for routing only if handler declares no data_types.
+    handle(self, data_type: bytes, data: Any) -> Any:
         should return bytes to response back to master
         if no response expected use 'success' or 'fail'
+        If it raises, client gets error response, see RemoteError.
+        data is memoryview of the received buffer, it has to be
+        copied by bytes(data) only if the handler keeps it.
+        If data was sent with schema, handler gets decoded object.
+        Handler can return object instead of bytes, it is encoded
+        by its schema.
+    schema: Optional[Schema]
+        of responses, that are not bytes. Pickle is used if None, so
+        only clients, allowing pickle, can decode the response.
+        Handler with schema has to be the only handler of its types:
+        responses of several handlers are joined by b'\\n', so they
+        have to be bytes or str.
+    main_thread: bool
+        if True, AsyncReaperServer calls handle() from the defer loop,
+        so it can touch REAPER. Otherwise handle() is called
+        from the thread pool and should not call REAPER API.
     """
+    data_types: ty.Tuple[bytes, ...] = ()
+    main_thread = False
+    schema: ty.Optional[Schema] = None
+
     def can_handle(self, data_type: bytes) -> bool:
         """Return True if class can handle data of type."""
-        return False
+        return data_type in self.data_types
 
-    def handle(self, data_type: bytes, data: bytes) -> bytes:
-        """Process data and return bytes-like response."""
+    def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+        """Process data and return bytes-like response or object."""
         return bytes('%s passed' % self.__class__.__name__, 'utf-8')
 
 
-class SlaveTCPHandler(ss.BaseRequestHandler):
-    """TCP Handler to be used by socketserver.
+class DispatchTable:
+    """Handlers of one server by type of data.
 
-    Any instancce of IHandler can be registered to handler and process
-    incoming packages.
+    Handlers with declared data_types are found by one dict lookup,
+    can_handle() is asked only of handlers without them.
     """
-    request: st.socket
-    client_address: ty.Tuple[str, int]
-    _handlers: ty.List[IHandler] = []
 
-    @classmethod
-    def register(cls, handler: IHandler) -> None:
-        """Register handler to be proceed by server."""
+    def __init__(self) -> None:
+        self._by_type: ty.Dict[bytes, ty.List[IHandler]] = {}
+        self._generic: ty.List[IHandler] = []
+
+    def register(self, handler: IHandler) -> None:
+        """Add handler to be routed to."""
         assert isinstance(
             handler, IHandler
         ), 'accept only instances of IHandler'
-        cls._handlers.append(handler)
+        for data_type in handler.data_types:
+            others = self._by_type.get(data_type, [])
+            assert not others or (
+                handler.schema is None
+                and not any(other.schema for other in others)
+            ), f'handler with schema has to be the only one of {data_type!r}'
+        # tables are replaced, as they are read by server threads
+        if not handler.data_types:
+            self._generic = self._generic + [handler]
+            return
+        by_type = dict(self._by_type)
+        for data_type in handler.data_types:
+            by_type[data_type] = by_type.get(data_type, []) + [handler]
+        self._by_type = by_type
+
+    def handlers(self, data_type: bytes) -> ty.List[IHandler]:
+        """Get handlers of data type in order of registration."""
+        handlers = self._by_type.get(data_type, [])
+        if self._generic:
+            handlers = handlers + [
+                handler for handler in self._generic
+                if handler.can_handle(data_type)
+            ]
+        return handlers
+
+
+def _get_response(
+    handlers: ty.Sequence[IHandler],
+    data_type: bytes,
+    data: Data,
+    codec: int = CODEC_RAW,
+    allow_pickle: bool = False,
+) -> ty.Tuple[int, Data]:
+    """Get codec and data of response of handlers.
+
+    Responses of several handlers are joined by b'\\n'.
+
+    Raises
+    ------
+    CodecError
+        if data can not be decoded by the codec, is pickled, but pickle
+        is not allowed, or one of several handlers responded with object
+    """
+    data = decode(codec, data, allow_pickle)
+    if len(handlers) == 1:
+        return encode(handlers[0].handle(data_type, data), handlers[0].schema)
+    responses = []
+    for handler in handlers:
+        codec, response = encode(
+            handler.handle(data_type, data), handler.schema
+        )
+        if codec != CODEC_RAW:
+            raise CodecError(
+                f'{handler.__class__.__name__} responded to {data_type!r} '
+                'with object, but it is not the only handler'
+            )
+        responses.append(response)
+    return CODEC_RAW, b'\n'.join(responses)
+
+
+class SlaveTCPServer(ss.TCPServer):
+    """TCPServer with the state, shared by its SlaveTCPHandler."""
+
+    def __init__(
+        self,
+        address: ty.Tuple[str, int],
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
+    ) -> None:
+        super().__init__(address, SlaveTCPHandler, bind_and_activate=False)
+        self.dispatch = DispatchTable()
+        # persistent connections, to be closed at exit
+        self.open_sockets: ty.Set[st.socket] = set()
+        # of responses to clients, negotiated compression
+        self.compress_threshold = compress_threshold
+        # unpickle requests, only if clients are trusted
+        self.allow_pickle = allow_pickle
+
+
+class SlaveTCPHandler(ss.BaseRequestHandler):
+    """TCP Handler to be used by SlaveTCPServer.
+
+    Incoming packages are processed by IHandler instances, registered
+    in the DispatchTable of the server (server.dispatch).
+    """
+    request: st.socket
+    client_address: ty.Tuple[str, int]
+    server: SlaveTCPServer
 
     def handle(self) -> None:
-        """Get data from client and process with handlers."""
-        # self.request = st.socket()
-        # conn = self.request.accept()
-        package = self.request.recv(1024)
-        data_type = package[:10].strip(b'0')
-        data_size = package[11:20].strip(b'0')
-        data = package[20:]
-        data = self._request_data(data, data_size, package)
-        response = self._get_response(data_type, data)
+        """Get data from client and process with handlers.
+
+        Client, starting with frame, is served until it closes the
+        connection. Otherwise one legacy package is processed.
+        """
+        try:
+            head = recv_exact(self.request, len(FRAME_MAGIC))
+        except OSError:
+            return
+        if head == FRAME_MAGIC:
+            self._handle_frames(head)
+        else:
+            self._handle_package(head)
+
+    def _handle_frames(self, head: bytes) -> None:
+        open_sockets = self.server.open_sockets
+        open_sockets.add(self.request)
+        self.request.settimeout(IDLE_TIMEOUT)
+        threshold = self.server.compress_threshold
+        compression: ty.Optional[str] = None
+        try:
+            while True:
+                frame = decompress_frame(read_frame(self.request, head))
+                head = b''
+                if frame.type_ == COMPRESS_TYPE:
+                    compression = choose_compression(frame.data)
+                    response_frame = Frame(
+                        frame.type_, (compression or '').encode(),
+                        frame.request_id, FLAG_RESPONSE
+                    )
+                else:
+                    response_frame = self._get_response_frame(frame)
+                self.request.sendall(
+                    pack_frame(
+                        compress_frame(response_frame, compression, threshold)
+                    )
+                )
+        except (OSError, ProtocolError) as e:
+            log(f'closing connection with {self.client_address}: {e}')
+        finally:
+            open_sockets.discard(self.request)
+
+    def _get_response_frame(self, frame: Frame) -> Frame:
+        try:
+            codec, response = self._get_response(
+                frame.type_, frame.data, frame.codec
+            )
+        except Exception as e:
+            log(f'request {frame.request_id} of {self.client_address}: {e!r}')
+            return error_frame(frame, e)
+        return Frame(
+            frame.type_, response, frame.request_id, FLAG_RESPONSE, codec
+        )
+
+    def _handle_package(self, head: bytes) -> None:
+        try:
+            header = head + recv_exact(self.request, 20 - len(head))
+            data_type = header[:10].lstrip(b'0')
+            data = recv_view(self.request, _package_size(header))
+            _, response = self._get_response(data_type, data)
+        except (OSError, ProtocolError, CodecError) as e:
+            log(f'bad package from {self.client_address}: {e}')
+            self.request.close()
+            return
         log('response length:', len(response))
         log(f'tread: {current_thread()}')
         self.request.sendall(response)
         self.request.close()
         # log(self.request._closed)
 
-    def _get_response(self, data_type: bytes, data: bytes) -> bytes:
-        response = b''
-        for nr, handler in enumerate(self._handlers):
-            if handler.can_handle(data_type):
-                if nr > 0:
-                    response += b'\n'
-                response += handler.handle(data_type, data)
-        return response
-
-    def _request_data(
-        self, data: bytes, data_size: bytes, package: bytes
-    ) -> bytes:
-        while len(data) < int(data_size):
-            package = self.request.recv(1024)
-            if not package:
-                break
-            data = data + package
-        return data
+    def _get_response(
+        self, data_type: bytes, data: Data, codec: int = CODEC_RAW
+    ) -> ty.Tuple[int, Data]:
+        return _get_response(
+            self.server.dispatch.handlers(data_type), data_type, data, codec,
+            self.server.allow_pickle
+        )
 
 
 class ReaperServer:
     """TCP server able to run in reascript defer.
 
+    Pickled requests are rejected, unless allow_pickle is set: it has
+    to be set only for server, that listens on loopback.
+
     Example:
         handlers = [PrintHandler, PingHandler]
         server = ReaperServer(HOST, PORT, handlers)
@@ -164,13 +875,18 @@ class ReaperServer:
         main_loop()
     """
     def __init__(
-        self, host: str, port: int, handlers: ty.List[ty.Type[IHandler]]
+        self,
+        host: str,
+        port: int,
+        handlers: ty.List[ty.Type[IHandler]],
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
     ) -> None:
-        for handler in handlers:
-            SlaveTCPHandler.register(handler())
-        self._server = ss.TCPServer(
-            (host, port), SlaveTCPHandler, bind_and_activate=False
+        self._server = SlaveTCPServer(
+            (host, port), compress_threshold, allow_pickle
         )
+        for handler in handlers:
+            self.register_handler(handler())
         self._server.timeout = .02
         self._server.allow_reuse_address = True
         log(f'starting server at {host}:{port}')
@@ -178,15 +894,20 @@ class ReaperServer:
         self._server.server_activate()
 
     def register_handler(self, handler: IHandler) -> None:
-        SlaveTCPHandler.register(handler)
+        self._server.dispatch.register(handler)
 
     def run(self) -> None:
         """Callback to be put in defer loop."""
-        Thread(target=self._server.handle_request).start()
+        Thread(target=self._server.handle_request, daemon=True).start()
 
     def at_exit(self) -> None:
         """Has to be put into repy.at_exit."""
         log('closing master')
+        for sock in list(self._server.open_sockets):
+            try:
+                sock.shutdown(st.SHUT_RDWR)
+            except OSError:
+                pass
         log('active threads:')
         for tr in tr_enum():
             if tr is main_thread():
@@ -204,6 +925,229 @@ class ReaperServer:
         log('master closed')
 
 
+_Response = ty.Tuple[int, Data]
+_Call = ty.Tuple[ty.Callable[[], _Response], 'Future[_Response]']
+
+
+class AsyncReaperServer:
+    """TCP server, serving all connections by one asyncio thread.
+
+    Both framed and legacy packages are served. Requests, pipelined
+    by one connection, are served concurrently and responded as soon
+    as they are ready, see rpc.RpcConnection. Handlers with
+    main_thread flag are called from run(), so they can touch REAPER,
+    others are called by the thread pool of the event loop.
+    Unlike ReaperServer, run() starts no threads, it only calls
+    handlers, queued for the main thread. Pickled requests are
+    rejected, unless allow_pickle is set, see ReaperServer.
+
+    Example:
+        server = AsyncReaperServer(HOST, PORT, [PrintHandler, PingHandler])
+
+        def main_loop() -> None:
+            server.run()
+            rpr.defer(main_loop)
+
+        rpr.at_exit(server.at_exit)
+        main_loop()
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        handlers: ty.List[ty.Type[IHandler]],
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
+    ) -> None:
+        self.compress_threshold = compress_threshold
+        self.allow_pickle = allow_pickle
+        self._dispatch_table = DispatchTable()
+        for handler in handlers:
+            self._dispatch_table.register(handler())
+        self._calls: 'queue.SimpleQueue[_Call]' = queue.SimpleQueue()
+        self._writers: ty.Set[asyncio.StreamWriter] = set()
+        self._loop = asyncio.new_event_loop()
+        log(f'starting server at {host}:{port}')
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(
+                self._serve, host, port, reuse_address=True
+            )
+        )
+        self.address: ty.Tuple[str, int] = (
+            self._server.sockets[0].getsockname()[:2]
+        )
+        self._thread = Thread(
+            target=self._loop.run_forever, name='AsyncReaperServer',
+            daemon=True
+        )
+        self._thread.start()
+
+    def register_handler(self, handler: IHandler) -> None:
+        self._dispatch_table.register(handler)
+
+    def run(self) -> None:
+        """Callback to be put in defer loop."""
+        while True:
+            try:
+                call, future = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+
+    def at_exit(self) -> None:
+        """Has to be put into repy.at_exit."""
+        log('closing server')
+        while True:
+            try:
+                _, future = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+        asyncio.run_coroutine_threadsafe(
+            self._close(), self._loop
+        ).result(1)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(1)
+        self._loop.close()
+        log('server closed')
+
+    async def _close(self) -> None:
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        tasks = [
+            task for task in asyncio.all_tasks()
+            if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _dispatch(
+        self, data_type: bytes, data: Data, codec: int = CODEC_RAW
+    ) -> _Response:
+        handlers = self._dispatch_table.handlers(data_type)
+        call = partial(
+            _get_response, handlers, data_type, data, codec,
+            self.allow_pickle
+        )
+        if any(handler.main_thread for handler in handlers):
+            future: 'Future[_Response]' = Future()
+            self._calls.put((call, future))
+            return await asyncio.wrap_future(future)
+        return await self._loop.run_in_executor(None, call)
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        peer = writer.get_extra_info('peername')
+        tasks: ty.Set['asyncio.Task[None]'] = set()
+        try:
+            head = await asyncio.wait_for(
+                reader.readexactly(len(FRAME_MAGIC)), IDLE_TIMEOUT
+            )
+            if head != FRAME_MAGIC:
+                await self._serve_package(head, reader, writer)
+                return
+            compression: ty.Optional[str] = None
+            write_lock = asyncio.Lock()
+            while True:
+                header = head + await reader.readexactly(
+                    FRAME_HEADER.size - len(head)
+                )
+                frame, size = _unpack_header(header)
+                frame = frame._replace(data=await reader.readexactly(size))
+                if frame.type_ == COMPRESS_TYPE:
+                    compression = choose_compression(frame.data)
+                    await self._send(
+                        writer, write_lock,
+                        Frame(
+                            frame.type_, (compression or '').encode(),
+                            frame.request_id, FLAG_RESPONSE
+                        )
+                    )
+                else:
+                    # requests are served concurrently, so responses
+                    # go in order of readiness
+                    task = self._loop.create_task(
+                        self._respond(frame, compression, writer, write_lock)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                head = await asyncio.wait_for(
+                    reader.readexactly(len(FRAME_MAGIC)),
+                    None if tasks else IDLE_TIMEOUT
+                )
+        except (
+            asyncio.IncompleteReadError, asyncio.TimeoutError, OSError,
+            ProtocolError, CodecError, ValueError
+        ) as e:
+            log(f'closing connection with {peer}: {e!r}')
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(
+        self, frame: Frame, compression: ty.Optional[str],
+        writer: asyncio.StreamWriter, write_lock: asyncio.Lock
+    ) -> None:
+        try:
+            if frame.flags & (FLAG_ZLIB | FLAG_LZMA):
+                frame = await self._loop.run_in_executor(
+                    None, decompress_frame, frame
+                )
+            codec, response = await self._dispatch(
+                frame.type_, memoryview(frame.data), frame.codec
+            )
+            response_frame = Frame(
+                frame.type_, response, frame.request_id, FLAG_RESPONSE, codec
+            )
+            if compression and len(response) >= self.compress_threshold:
+                response_frame = await self._loop.run_in_executor(
+                    None, compress_frame, response_frame, compression,
+                    self.compress_threshold
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f'request {frame.request_id} failed: {e!r}')
+            response_frame = error_frame(frame, e)
+        try:
+            await self._send(writer, write_lock, response_frame)
+        except OSError as e:
+            log(f'closing connection: request {frame.request_id}: {e!r}')
+            writer.close()
+
+    async def _send(
+        self, writer: asyncio.StreamWriter, write_lock: asyncio.Lock,
+        frame: Frame
+    ) -> None:
+        async with write_lock:
+            writer.write(pack_frame(frame))
+            await writer.drain()
+
+    async def _serve_package(
+        self, head: bytes, reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        header = head + await reader.readexactly(20 - len(head))
+        data = await reader.readexactly(_package_size(header))
+        _, response = await self._dispatch(
+            header[:10].lstrip(b'0'), memoryview(data)
+        )
+        writer.write(response)
+        await writer.drain()
+
+
 class Announce:
     """Broadcast ip address once per 5 seconds."""
     def __init__(self, host: str, port: int) -> None:
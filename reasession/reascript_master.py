@@ -3,7 +3,7 @@ import typing as ty
 import reapy as rpr
 import reapy.reascript_api as RPR
 
-from networking import ReaperServer
+from networking import AsyncReaperServer
 from networking import DEF_HOST, MASTER_PORT, DEF_PORT
 from basic_handlers import PrintHandler
 from basic_handlers import PingHandler
@@ -20,7 +20,7 @@ slaves = Slaves(DEF_PORT)
 HOST, PORT = DEF_HOST, MASTER_PORT
 
 handlers = [PrintHandler, PingHandler]
-gui_server = ReaperServer(HOST, PORT, handlers)
+gui_server = AsyncReaperServer(HOST, PORT, handlers)
 
 
 def main_loop() -> None:
@@ -5,62 +5,100 @@ render_midi = {}
 
 -- track: reaper track (reaper.GetSelectedTrack(int project, int idx))
 -- fx: int index of render_midi JSFX slot
--- RETURN: Array contains table of midi messages
---     {[1]={qn=float PPQ,msg1=int,msg2=int,msg3=int}}
--- NOTE: JSFX will be deleted
+-- RETURN: Array contains table of midi messages of the next chunk,
+--     number of events lost by overflow and events remaining in JSFX
+--     {[1]={qn=float PPQ,bufBus=int,bufOut={int,...}}}, int, int
+-- NOTE: JSFX will be deleted after the last chunk
 function render_midi.get_midi_from_track(track, fx)
-    -- msg(track, fx)
-    -- reaper.ShowConsoleMsg('\nget_midi_from_track start = ' .. tostring(os.clock()))
     reaper.TrackFX_SetParam(track, fx, 0, 1)
-    -- while (reaper.TrackFX_GetParam(track, fx, 0) > 0) do
-    --     reaper.ShowConsoleMsg('.')
-    -- end
     reaper.gmem_attach("ReasessionRenderMidi")
     local size = reaper.gmem_read(0)
-    -- reaper.ShowConsoleMsg('\nsize = ' .. tostring(size))
-    -- msg("size:" .. size)
-    local qnOffset = 500000
-    local bufPtr = 1000000
-    local bufLen = 1500000
-    local bufBus = 2000000
-    local bufOut = 2500000
+    local overflow = reaper.gmem_read(1)
+    local remaining = reaper.gmem_read(2)
+    -- layout of the chunk is set by JSFX, as it depends on chunk size
+    local qnOffset = reaper.gmem_read(3)
+    local bufPtr = reaper.gmem_read(4)
+    local bufLen = reaper.gmem_read(5)
+    local bufBus = reaper.gmem_read(6)
+    local bufOut = reaper.gmem_read(7)
     local trackbuf = {}
-    if (size == 0) then
-        return -1
-    end
     for i = 1, size do
-        -- reaper.ShowConsoleMsg(string.format('\n%s', i))
         trackbuf[i] = {}
         trackbuf[i]['qn'] = reaper.gmem_read(i + qnOffset - 1)
         trackbuf[i]['bufPtr'] = reaper.gmem_read(i + bufPtr - 1)
         trackbuf[i]['bufLen'] = reaper.gmem_read(i + bufLen - 1)
         trackbuf[i]['bufBus'] = reaper.gmem_read(i + bufBus - 1)
-        -- reaper.ShowConsoleMsg(string.format('\n----qn:%s, ptr:%s, len:%s, bus:%s', trackbuf[i]['qn'],trackbuf[i]['bufPtr'],trackbuf[i]['bufLen'],trackbuf[i]['bufBus']))
         trackbuf[i]['bufOut'] = {}
-        -- reaper.ShowConsoleMsg('\n----bufout:')
         for i2 = 1, trackbuf[i]['bufLen'] do
             trackbuf[i]['bufOut'][i2] =
             reaper.gmem_read(bufOut + (trackbuf[i]['bufPtr'] + (i2 - 1)))
-            -- reaper.ShowConsoleMsg(string.format('\n--------%s', trackbuf[i]['bufOut'][i2]))
         end
+    end
+    if remaining == 0 then
         reaper.TrackFX_Delete(track, fx)
     end
-    -- reaper.ShowConsoleMsg('\nget_midi_from_track end = ' .. tostring(os.clock()))
-    return trackbuf
+    return trackbuf, overflow, remaining
+end
+
+-- proj_idx: int project index, or -1 to search in all projects
+-- guid: string track GUID
+-- RETURN: Reaper Track object or nil
+function render_midi.find_track(proj_idx, guid)
+    local idx, last = proj_idx, proj_idx
+    if proj_idx < 0 then
+        idx, last = 0, math.huge
+    end
+    while idx <= last do
+        local proj = reaper.EnumProjects(idx)
+        if not proj then
+            break
+        end
+        for i = 0, reaper.CountTracks(proj) - 1 do
+            local track = reaper.GetTrack(proj, i)
+            if reaper.GetTrackGUID(track) == guid then
+                return track
+            end
+        end
+        idx = idx + 1
+    end
+    return nil
 end
 
 -- RETURN: track, fx
 --     `track` is Reaper Track object, `fx` is fx index
+--     track is addressed by GUID, so indexes of tracks do not matter
 function render_midi.get_task()
     -- reaper.ShowConsoleMsg('\nget_task start = ' .. tostring(os.clock()))
-    fx = tonumber(reaper.GetExtState(SECTION, 'render_midi_fx_idx'))
-    trackidx = tonumber(reaper.GetExtState(SECTION, 'render_midi_track_idx'))
-    proj = tonumber(reaper.GetExtState(SECTION, 'render_midi_proj_idx'))
-    track = reaper.GetTrack(proj, trackidx)
+    local fx = tonumber(reaper.GetExtState(SECTION, 'render_midi_fx_idx'))
+    local guid = reaper.GetExtState(SECTION, 'render_midi_track_guid')
+    local proj = tonumber(reaper.GetExtState(SECTION, 'render_midi_proj_idx'))
+    local track = render_midi.find_track(proj or -1, guid)
+    if track and (fx == nil or fx < 0) then
+        fx = reaper.TrackFX_AddByName(
+            track, 'levitanus(reasession)_render_midi', false, 0)
+    end
     -- reaper.ShowConsoleMsg('\nget_task end = ' .. tostring(os.clock()))
     return track, fx
 end
 
+-- dir: string directory of rendered audio
+-- NOTE: only files are removed, the directory is reused by next render
+function render_midi.clean_dir(dir)
+    local files = {}
+    local idx = 0
+    while true do
+        local name = reaper.EnumerateFiles(dir, idx)
+        if not name then
+            break
+        end
+        files[#files + 1] = name
+        idx = idx + 1
+    end
+    for _, name in ipairs(files) do
+        os.remove(dir .. '/' .. name)
+    end
+end
+
 function get_buf_str(buf)
     local buftbl = {}
     for i, v in ipairs(buf) do
@@ -95,10 +133,25 @@ end
 -- fx = 0
 -- trackbuf_now = render_midi.get_midi_from_track(track, fx)
 
+render_dir = reaper.GetExtState(SECTION, 'render_midi_cleanup')
+if render_dir ~= '' then
+    render_midi.clean_dir(render_dir)
+    reaper.SetExtState(SECTION, 'render_midi_cleanup', '', false)
+    return
+end
+
 track, fx = render_midi.get_task()
-trackbuf = render_midi.get_midi_from_track(track, fx)
+if not track or fx < 0 then
+    reaper.SetExtState(SECTION, 'render_midi_output', '', false)
+    return
+end
+trackbuf, overflow, remaining = render_midi.get_midi_from_track(track, fx)
 -- reaper.ShowConsoleMsg('\n' .. render_midi.trackbuf_to_str(trackbuf))
 reaper.SetExtState(SECTION,
     'render_midi_output',
     render_midi.trackbuf_to_str(trackbuf),
     false)
+reaper.SetExtState(SECTION,
+    'render_midi_overflow', string.format('%d', overflow), false)
+reaper.SetExtState(SECTION,
+    'render_midi_remaining', string.format('%d', remaining), false)
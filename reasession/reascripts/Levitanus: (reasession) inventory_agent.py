@@ -0,0 +1,22 @@
+import reapy as rpr
+from reasession.config import EXT_SECTION, ADDRESS_KEY_SLAVE
+from reasession.connections.inventory import InventoryAgent
+from reasession.networking import AGENT_PORT
+from reasession.networking import DEF_HOST
+from reasession.networking import AsyncReaperServer
+
+if __name__ == '__main__':
+    host = DEF_HOST
+    if rpr.has_ext_state(EXT_SECTION, ADDRESS_KEY_SLAVE):
+        host = rpr.get_ext_state(EXT_SECTION, ADDRESS_KEY_SLAVE)
+    agent = InventoryAgent()
+    server = AsyncReaperServer(host, AGENT_PORT, [])
+    server.register_handler(agent)
+
+    def main_loop() -> None:
+        agent.run()
+        server.run()
+        rpr.defer(main_loop)
+
+    rpr.at_exit(server.at_exit)
+    main_loop()
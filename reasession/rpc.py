@@ -0,0 +1,280 @@
+"""Multiplexed requests over one persistent connection.
+
+Unlike networking.Connection, RpcConnection does not wait for response
+before sending the next request: every request gets Future, resolved
+by the reader thread when response with its id comes. AsyncReaperServer
+serves pipelined requests concurrently and responds out of order,
+ReaperServer serves them one by one.
+
+Example
+-------
+    conn = RpcConnection(slave_host, DEF_PORT)
+    tree = conn.submit('tree', '')
+    recarm = conn.submit('recarm', '')
+    ports = conn.submit('inventory', '')
+    handle_state(tree.result(1), recarm.result(1), ports.result(1))
+"""
+
+import socket as st
+import typing as ty
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+from threading import Lock
+from threading import Thread
+
+from reasession.codec import CODEC_RAW
+from reasession.codec import Schema
+from reasession.codec import decode
+from reasession.codec import encode
+from reasession.common import log
+from reasession.networking import COMPRESS_THRESHOLD
+from reasession.networking import COMPRESS_TYPE
+from reasession.networking import COMPRESSIONS
+from reasession.networking import FLAG_ERROR
+from reasession.networking import Frame
+from reasession.networking import ProtocolError
+from reasession.networking import RemoteError
+from reasession.networking import compress_frame
+from reasession.networking import decompress_frame
+from reasession.networking import pack_frame
+from reasession.networking import read_frame
+from reasession.networking import supported_compressions
+
+
+class RpcConnection:
+    """Persistent connection with many requests in flight.
+
+    Socket is opened by the first request. If it is broken, all
+    pending requests fail with ConnectionError, and the next request
+    opens the new socket. If handlers of one request fail, only its
+    future fails with RemoteError. Pickled responses are rejected,
+    unless allow_pickle is set.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float = 1,
+        compressions: ty.Sequence[str] = COMPRESSIONS,
+        compress_threshold: int = COMPRESS_THRESHOLD,
+        allow_pickle: bool = False,
+    ) -> None:
+        """Persistent connection with many requests in flight.
+
+        Parameters
+        ----------
+        host : str
+            ip address of server
+        port : int
+        timeout : float, optional
+            of connecting and default of call()
+        compressions : Sequence[str], optional
+            see networking.Connection
+        compress_threshold : int, optional
+            bytes, smaller payloads are sent raw
+        allow_pickle : bool, optional
+            decode pickled responses, only for trusted server,
+            see codec.decode()
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.compressions = supported_compressions(compressions)
+        self.compress_threshold = compress_threshold
+        self.allow_pickle = allow_pickle
+        self.compression: ty.Optional[str] = None
+        self._sock: ty.Optional[st.socket] = None
+        self._pending: ty.Dict[int, 'Future[ty.Any]'] = {}
+        self._last_id = 0
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._connect_lock = Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._sock is not None
+
+    def submit(
+        self,
+        type_: str,
+        data: object,
+        schema: ty.Optional[Schema] = None,
+    ) -> 'Future[ty.Any]':
+        """Send request without waiting for response.
+
+        Parameters
+        ----------
+        type_ : str
+            up to 10 bytes, see IHandler
+        data : object
+            see networking.encode_data()
+        schema : Optional[Schema], optional
+            of data, see codec.register()
+
+        Returns
+        -------
+        Future[Any]
+            of response, see networking.Connection.request()
+
+        Raises
+        ------
+        ConnectionRefusedError
+            if server is not running
+        ProtocolError
+            if server did not negotiate compression
+        """
+        codec, payload = encode(data, schema)
+        future: 'Future[ty.Any]' = Future()
+        sock = self._socket()
+        with self._lock:
+            if self._sock is not sock:
+                future.set_exception(ConnectionError('connection is closed'))
+                return future
+            request_id = self._next_id()
+            self._pending[request_id] = future
+            compression = self.compression
+        frame = compress_frame(
+            Frame(type_.encode(), payload, request_id, codec=codec),
+            compression, self.compress_threshold
+        )
+        try:
+            with self._send_lock:
+                sock.sendall(pack_frame(frame))
+        except OSError as e:
+            self._fail(sock, e)
+        return future
+
+    def call(
+        self,
+        type_: str,
+        data: object,
+        timeout: ty.Optional[float] = None,
+        schema: ty.Optional[Schema] = None,
+    ) -> ty.Any:
+        """Send request and wait for response.
+
+        Unlike networking.Connection, the timed out request does not
+        close the connection: its late response is just dropped.
+
+        Raises
+        ------
+        concurrent.futures.TimeoutError
+        ConnectionError
+        RemoteError
+            if server handlers failed
+        """
+        future = self.submit(type_, data, schema)
+        try:
+            return future.result(timeout or self.timeout)
+        except TimeoutError:
+            with self._lock:
+                for request_id, pending in list(self._pending.items()):
+                    if pending is future:
+                        del self._pending[request_id]
+            raise
+
+    def close(self) -> None:
+        """Close socket, pending requests fail with ConnectionError."""
+        with self._lock:
+            sock = self._sock
+        if sock is not None:
+            self._fail(sock, ConnectionError('connection is closed'))
+
+    def _next_id(self) -> int:
+        self._last_id = self._last_id % 0xffffffff + 1
+        return self._last_id
+
+    def _socket(self) -> st.socket:
+        """Get open socket, or open the new one.
+
+        Connecting is blocking, so it is done without holding the lock,
+        needed by the reader thread to deliver responses.
+        """
+        with self._connect_lock:
+            sock = self._sock
+            if sock is None:
+                sock = self._connect()
+            return sock
+
+    def _connect(self) -> st.socket:
+        sock = st.create_connection((self.host, self.port), self.timeout)
+        try:
+            compression = self._negotiate(sock)
+        except Exception:
+            sock.close()
+            raise
+        # futures have their own timeouts, reader waits forever
+        sock.settimeout(None)
+        with self._lock:
+            self._sock, self.compression = sock, compression
+        Thread(
+            target=self._read, args=(sock, ), name='RpcConnection reader',
+            daemon=True
+        ).start()
+        return sock
+
+    def _negotiate(self, sock: st.socket) -> ty.Optional[str]:
+        if not self.compressions:
+            return None
+        with self._lock:
+            request_id = self._next_id()
+        sock.sendall(
+            pack_frame(
+                Frame(
+                    COMPRESS_TYPE,
+                    ','.join(self.compressions).encode(), request_id
+                )
+            )
+        )
+        response = read_frame(sock)
+        if response.request_id != request_id:
+            raise ProtocolError(f'response {response.request_id} to hello')
+        name = bytes(response.data).decode()
+        return name if name in self.compressions else None
+
+    def _read(self, sock: st.socket) -> None:
+        try:
+            while True:
+                frame = decompress_frame(read_frame(sock))
+                with self._lock:
+                    future = self._pending.pop(frame.request_id, None)
+                if future is None or not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if frame.flags & FLAG_ERROR:
+                        future.set_exception(
+                            RemoteError(
+                                bytes(frame.data).decode('utf-8', 'replace')
+                            )
+                        )
+                    elif frame.codec == CODEC_RAW:
+                        future.set_result(bytes(frame.data))
+                    else:
+                        future.set_result(
+                            decode(frame.codec, frame.data, self.allow_pickle)
+                        )
+                except Exception as e:
+                    future.set_exception(e)
+        except (OSError, ProtocolError) as e:
+            self._fail(sock, e)
+
+    def _fail(self, sock: st.socket, error: Exception) -> None:
+        """Close socket and fail all pending requests."""
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            self.compression = None
+            pending, self._pending = self._pending, {}
+        log(f'connection to {self.host}:{self.port} is broken: {error!r}')
+        try:
+            sock.shutdown(st.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        if not isinstance(error, ConnectionError):
+            error = ConnectionError(str(error))
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
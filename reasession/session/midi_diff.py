@@ -0,0 +1,101 @@
+"""Diff of MIDI take contents for patching slave items in place.
+
+Events are compared as raw messages at ppq positions, so the patch can
+be applied with MIDI_InsertEvt / MIDI_SetEvt / MIDI_DeleteEvt, which
+index all events of the take.
+"""
+
+import typing as ty
+import typing_extensions as te
+from collections import defaultdict
+
+ALL_NOTES_OFF = (0xb0, 0x7b, 0x00)
+
+
+class PpqEvent(te.TypedDict):
+    """Raw MIDI message at the take position."""
+
+    ppq: float
+    buf: ty.List[int]
+
+
+class MidiPatch(te.TypedDict):
+    """Changes, turning old take events to the new ones.
+
+    Parameters
+    ----------
+    delete : List[int]
+        indexes of old events, in descending order
+    move : List[Tuple[int, float]]
+        index of old event and its new ppq
+    insert : List[PpqEvent]
+    """
+
+    delete: ty.List[int]
+    move: ty.List[ty.Tuple[int, float]]
+    insert: ty.List[PpqEvent]
+
+
+def patch_size(patch: MidiPatch) -> int:
+    """Number of MIDI API calls, needed to apply the patch."""
+    return len(patch['delete']) + len(patch['move']) + len(patch['insert'])
+
+
+def diff_midi(old: ty.Sequence[PpqEvent],
+              new: ty.Sequence[PpqEvent]) -> MidiPatch:
+    """Compare old events of take with the new ones.
+
+    Events with the same message at the same (rounded) ppq are kept,
+    rest of the events with the same message are paired in time order
+    and moved, unpaired are inserted or deleted.
+
+    Note
+    ----
+    Trailing 'all notes off', which REAPER puts at the end of item,
+    is never deleted.
+
+    Parameters
+    ----------
+    old : Sequence[PpqEvent]
+        events of take in their order
+    new : Sequence[PpqEvent]
+
+    Returns
+    -------
+    MidiPatch
+    """
+    n_old = len(old)
+    if n_old and tuple(old[-1]['buf']) == ALL_NOTES_OFF:
+        n_old -= 1
+
+    exact: ty.Dict[ty.Tuple[int, ty.Tuple[int, ...]],
+                   ty.List[int]] = defaultdict(list)
+    for idx in range(n_old):
+        evt = old[idx]
+        exact[(round(evt['ppq']), tuple(evt['buf']))].append(idx)
+
+    left_new: ty.Dict[ty.Tuple[int, ...],
+                      ty.List[PpqEvent]] = defaultdict(list)
+    for evt in new:
+        key = (round(evt['ppq']), tuple(evt['buf']))
+        if exact.get(key):
+            exact[key].pop()
+        else:
+            left_new[key[1]].append(evt)
+
+    left_old: ty.Dict[ty.Tuple[int, ...], ty.List[int]] = defaultdict(list)
+    for (_, buf), idxs in exact.items():
+        left_old[buf].extend(idxs)
+
+    patch = MidiPatch(delete=[], move=[], insert=[])
+    for buf in set(left_old) | set(left_new):
+        olds = sorted(left_old.get(buf, []), key=lambda i: old[i]['ppq'])
+        news = sorted(left_new.get(buf, []), key=lambda e: e['ppq'])
+        for idx, evt in zip(olds, news):
+            patch['move'].append((idx, evt['ppq']))
+        patch['delete'].extend(olds[len(news):])
+        patch['insert'].extend(news[len(olds):])
+    patch['delete'].sort(reverse=True)
+    patch['move'].sort()
+    patch['insert'].sort(key=lambda e: e['ppq'])
+    return patch
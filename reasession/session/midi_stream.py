@@ -0,0 +1,231 @@
+"""Compact binary stream of rendered MIDI for pushing it to slaves.
+
+Stream layout
+-------------
+    MAGIC, count, then for every event:
+        varint (delta_ticks << 1 | bus_changed)
+        [varint bus]  — only if bus changed since the previous event
+        varint len, MIDI bytes
+
+qn are quantized to TICKS_PER_QN, so deltas are small integers.
+Bus is written only when it changes (run-length of the bus prefix,
+which is added back on the slave side by build_midi_on_track).
+"""
+
+import typing as ty
+
+import reapy as rpr
+
+from reasession.networking import IHandler
+from reasession.networking import DEF_PORT
+from reasession.networking import request
+from .render_midi import MidiBuf, MidiRenderer
+
+MAGIC = b'RSMC\x01'
+TICKS_PER_QN = 15360
+GUID_SIZE = 38
+
+
+class StreamError(Exception):
+    """Stream is broken or has unknown format."""
+
+
+def thin_midi(midi_buf: ty.List[MidiBuf],
+              cc_tolerance: int = 0) -> ty.List[MidiBuf]:
+    """Remove redundant events.
+
+    Note
+    ----
+        - CC, differing from the last kept value of the same controller
+          not more than by cc_tolerance, is dropped, unless it is the
+          last event of the controller, so its final value is kept
+        - note-on with velocity 0 is turned into note-off
+        - note-off of not sounding note is dropped
+
+    Parameters
+    ----------
+    midi_buf : List[MidiBuf]
+    cc_tolerance : int, optional
+        0 removes only repeated values
+
+    Returns
+    -------
+    List[MidiBuf]
+    """
+    out: ty.List[MidiBuf] = []
+    last_cc: ty.Dict[ty.Tuple[int, int, int], int] = {}
+    last_idx: ty.Dict[ty.Tuple[int, int, int], int] = {}
+    sounding: ty.Dict[ty.Tuple[int, int, int], int] = {}
+    for idx, msg in enumerate(midi_buf):
+        buf = msg['buf']
+        if len(buf) == 3 and buf[0] & 0xf0 == 0xb0:
+            last_idx[(msg['bus'], buf[0], buf[1])] = idx
+    for idx, msg in enumerate(midi_buf):
+        buf = msg['buf']
+        status = buf[0] & 0xf0 if buf else 0
+        if status == 0xb0 and len(buf) == 3:
+            key = (msg['bus'], buf[0], buf[1])
+            if key in last_cc:
+                delta = abs(last_cc[key] - buf[2])
+                if delta == 0 or (
+                    delta <= cc_tolerance and last_idx[key] != idx
+                ):
+                    continue
+            last_cc[key] = buf[2]
+        elif status in (0x80, 0x90) and len(buf) == 3:
+            key = (msg['bus'], buf[0] & 0x0f, buf[1])
+            if status == 0x90 and buf[2] > 0:
+                sounding[key] = sounding.get(key, 0) + 1
+            else:
+                if not sounding.get(key):
+                    continue
+                sounding[key] -= 1
+                if status == 0x90:
+                    msg = MidiBuf(
+                        qn=msg['qn'],
+                        bus=msg['bus'],
+                        buf=[0x80 | (buf[0] & 0x0f), buf[1], 0]
+                    )
+        out.append(msg)
+    return out
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: ty.Union[bytes, memoryview], pos: int
+                 ) -> ty.Tuple[int, int]:
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise StreamError('unexpected end of MIDI stream')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def compact(midi_buf: ty.List[MidiBuf], cc_tolerance: int = 0) -> bytes:
+    """Make compact stream from the rendered MIDI.
+
+    Parameters
+    ----------
+    midi_buf : List[MidiBuf]
+        sorted by qn
+    cc_tolerance : int, optional
+        see thin_midi()
+
+    Returns
+    -------
+    bytes
+    """
+    midi_buf = thin_midi(midi_buf, cc_tolerance)
+    out = bytearray(MAGIC)
+    _write_varint(out, len(midi_buf))
+    last_tick, last_bus = 0, 0
+    for msg in midi_buf:
+        tick = round(msg['qn'] * TICKS_PER_QN)
+        if tick < last_tick:
+            raise StreamError(f'MIDI is not sorted at qn {msg["qn"]}')
+        bus_changed = msg['bus'] != last_bus
+        _write_varint(out, (tick - last_tick) << 1 | bus_changed)
+        if bus_changed:
+            _write_varint(out, msg['bus'])
+        _write_varint(out, len(msg['buf']))
+        out.extend(msg['buf'])
+        last_tick, last_bus = tick, msg['bus']
+    return bytes(out)
+
+
+def expand(data: ty.Union[bytes, memoryview]) -> ty.List[MidiBuf]:
+    """Restore MIDI from the compact stream.
+
+    Raises
+    ------
+    StreamError
+    """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise StreamError('not a compact MIDI stream')
+    count, pos = _read_varint(data, len(MAGIC))
+    midi_buf: ty.List[MidiBuf] = []
+    tick, bus = 0, 0
+    for _ in range(count):
+        delta, pos = _read_varint(data, pos)
+        tick += delta >> 1
+        if delta & 1:
+            bus, pos = _read_varint(data, pos)
+        length, pos = _read_varint(data, pos)
+        if pos + length > len(data):
+            raise StreamError('unexpected end of MIDI stream')
+        buf = list(data[pos:pos + length])
+        pos += length
+        midi_buf.append(MidiBuf(qn=tick / TICKS_PER_QN, bus=bus, buf=buf))
+    return midi_buf
+
+
+def push_midi(
+    track_guid: str,
+    midi_buf: ty.List[MidiBuf],
+    host: str,
+    port: int = DEF_PORT,
+    cc_tolerance: int = 0,
+    timeout: float = 5,
+) -> str:
+    """Send MIDI to the slave track, handled by MidiPushHandler.
+
+    Parameters
+    ----------
+    track_guid : str
+        GUID of the slave track
+    midi_buf : List[MidiBuf]
+    host : str
+        ip address of slave server
+    port : int, optional
+    cc_tolerance : int, optional
+        see thin_midi()
+    timeout : float, optional
+
+    Returns
+    -------
+    str
+        slave response
+    """
+    payload = track_guid.encode() + b'\n' + compact(midi_buf, cc_tolerance)
+    return str(request('midi_push', payload, host, port, timeout), 'utf-8')
+
+
+class MidiPushHandler(IHandler):
+    """Expands pushed MIDI and patches the slave track with it."""
+
+    data_types = (b'midi_push', )
+    main_thread = True
+
+    def __init__(self, renderer: ty.Optional[MidiRenderer] = None) -> None:
+        self._renderer = renderer
+
+    def handle(self, data_type: bytes, data: bytes) -> bytes:
+        view = memoryview(data)
+        # only GUID is copied, the stream is expanded from the view
+        guid, _, _ = bytes(view[:GUID_SIZE + 1]).partition(b'\n')
+        try:
+            midi_buf = expand(view[len(guid) + 1:])
+        except StreamError:
+            return b'fail'
+        if not midi_buf:
+            return b'success'
+        if self._renderer is None:
+            self._renderer = MidiRenderer()
+        with rpr.inside_reaper():
+            track = rpr.Track.from_GUID(str(guid, 'utf-8'), 'all')
+            self._renderer.patch_midi_on_track(track, midi_buf)
+        return b'success'
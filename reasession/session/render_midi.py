@@ -1,10 +1,19 @@
+from __future__ import annotations
 import reapy as rpr
+from reapy import reascript_api as RPR
 import typing as ty
 import typing_extensions as te
 import json
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+from reasession import codec
+from reasession.common import log
 from reasession.config import EXT_SECTION
+from .midi_diff import MidiPatch, diff_midi, patch_size
+
+T = ty.TypeVar('T')
 
 MidiBuf = te.TypedDict(
     'MidiBuf', {
@@ -13,6 +22,7 @@ MidiBuf = te.TypedDict(
         'buf': ty.List[int],
     }
 )
+MIDI_BUFS = codec.register(16, ty.List[MidiBuf])
 MidiNote = te.TypedDict(
     'MidiNote', {
         'start': float,
@@ -29,6 +39,87 @@ RenderSettings = te.TypedDict(
     }
 )
 
+RENDER_DIR = 'reasession_render'
+"""Dir in REAPER resource path, where audio is rendered to."""
+
+MIDI_RENDER_PROFILE = RenderSettings(
+    value={
+        # stems of selected tracks only, entire project
+        'RENDER_SETTINGS': 3.0,
+        'RENDER_BOUNDSFLAG': 1,
+        'RENDER_CHANNELS': 1,
+        'RENDER_ADDTOPROJ': 0,
+        'RENDER_SRATE': 8000,
+        'RENDER_TAILFLAG': 0,
+        'RENDER_TAILMS': 0,
+        'RENDER_DITHER': 0,
+    },
+    string={
+        # 8-bit PCM WAV: no encoding at all
+        'RENDER_FORMAT': 'ZXZhdwgAAA==',
+    }
+)
+"""Cheapest render: audio is thrown away, only JSFX output matters."""
+
+
+class TrackIndex:
+    """Project indexes and track GUIDs of the host.
+
+    Every lookup is a remote call, so they are cached. Cache is checked
+    by `validate()` once per render (or other batch of lookups), not by
+    every lookup. GUIDs are dropped if any project changed its state
+    (REAPER counts changes, so the track, deleted and replaced by
+    another one, is caught, even if the track count is the same).
+    Project indexes are updated also if tabs are reordered.
+    """
+
+    def __init__(self) -> None:
+        self._stamp: ty.Optional[ty.Tuple[ty.Tuple[str, int], ...]] = None
+        self.projects: ty.Dict[str, int] = {}
+        self.guids: ty.Dict[str, str] = {}
+
+    def validate(self) -> None:
+        """Update the cache if projects or their tracks were changed."""
+        with rpr.inside_reaper():
+            stamp = tuple(
+                (
+                    pr.id,
+                    RPR.GetProjectStateChangeCount(pr.id)  # type:ignore
+                ) for pr in rpr.get_projects()
+            )
+        if stamp == self._stamp:
+            return
+        if self._stamp is None or set(stamp) != set(self._stamp):
+            self.guids = {}
+        self._stamp = stamp
+        self.projects = {pr_id: idx for idx, (pr_id, _) in enumerate(stamp)}
+
+    def invalidate(self) -> None:
+        self._stamp = None
+
+    def project_idx(self, project: rpr.Project) -> int:
+        if self._stamp is None:
+            self.validate()
+        try:
+            return self.projects[project.id]
+        except KeyError:
+            raise RuntimeError(f'cannot find project {project.id} on the host')
+
+    def track_guid(self, track: rpr.Track) -> str:
+        if self._stamp is None:
+            self.validate()
+        if track.id not in self.guids:
+            self.guids[track.id] = track.GUID
+        return self.guids[track.id]
+
+
+class MidiOverflowError(RuntimeError):
+    """Render JSFX had no room for all events of the track."""
+
+
+class RenderCancelled(Exception):
+    """Render was stopped by its cancelled() callback."""
+
 
 class MidiRenderer:
     """Renders midi and can past it to different tracks (and hosts).
@@ -39,14 +130,51 @@ class MidiRenderer:
     """
 
     key_fx_idx = 'render_midi_fx_idx'
-    key_track_idx = 'render_midi_track_idx'
+    key_track_guid = 'render_midi_track_guid'
     key_proj_idx = 'render_midi_proj_idx'
 
     key_result = 'render_midi_output'
+    key_overflow = 'render_midi_overflow'
+    key_remaining = 'render_midi_remaining'
+    key_cleanup = 'render_midi_cleanup'
 
     fx_name = 'levitanus(reasession)_render_midi'
 
-    def __init__(self) -> None:
+    _capacity_param = 3
+    _chunk_param = 4
+
+    def __init__(
+        self,
+        capacity: int = 100000,
+        chunk: int = 100000,
+        raise_on_overflow: bool = False,
+    ) -> None:
+        """Set limits of JSFX buffers.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            events, JSFX can store for the one track during render
+        chunk : int, optional
+            events, transferred from JSFX at once
+        raise_on_overflow : bool, optional
+            if False, lost events are only reported in `overflows`
+
+        Attributes
+        ----------
+        overflows : Dict[str, int]
+            number of lost events by track id of the last render
+        timings : Dict[str, float]
+            seconds, spent on every phase of the last render
+        index : TrackIndex
+            cached project indexes and track GUIDs of the host
+        """
+        self.capacity = capacity
+        self.chunk = chunk
+        self.raise_on_overflow = raise_on_overflow
+        self.overflows: ty.Dict[str, int] = {}
+        self.timings: ty.Dict[str, float] = {}
+        self.index = TrackIndex()
         with rpr.inside_reaper():
             self.get_command_id: int = rpr.get_command_id(  # type:ignore
                 "_RSf3f54c28105cef27e0d62a326647e71bd48d882a"
@@ -55,7 +183,10 @@ class MidiRenderer:
                 'cannot load render_midi.lua'
 
     def add_jsfx_to_track(self, track: rpr.Track) -> rpr.FX:
-        return track.add_fx(self.fx_name)
+        fx = track.add_fx(self.fx_name)
+        fx.params[self._capacity_param] = self.capacity
+        fx.params[self._chunk_param] = self.chunk
+        return fx
 
     def _deserialize_buffer(self, raw_midi: str) -> ty.List[MidiBuf]:
         m_list = json.loads(raw_midi)
@@ -73,24 +204,52 @@ class MidiRenderer:
     def get_midi_from_track(
         self, track: rpr.Track, project_idx: ty.Optional[int] = None
     ) -> ty.List[MidiBuf]:
+        midi_buf: ty.List[MidiBuf] = []
+        for chunk in self.iter_midi_from_track(track, project_idx):
+            midi_buf.extend(chunk)
+        return midi_buf
+
+    def iter_midi_from_track(
+        self, track: rpr.Track, project_idx: ty.Optional[int] = None
+    ) -> ty.Iterator[ty.List[MidiBuf]]:
+        """Drain JSFX buffer of the track chunk by chunk.
+
+        Raises
+        ------
+        MidiOverflowError
+            if JSFX lost events and `raise_on_overflow` is set
+        """
         pr = track.project
 
         project_idx = self._get_project_idx(pr, project_idx)
-        for idx, tr in enumerate(pr.tracks):
-            if tr.id == track.id:
-                track_idx = idx
+        track_guid = self.index.track_guid(track)
 
         rpr.set_ext_state(EXT_SECTION, self.key_proj_idx, str(project_idx))
-        rpr.set_ext_state(EXT_SECTION, self.key_track_idx, str(track_idx))
-        # fx = add_jsfx_to_track(track)
-        fx = track.fxs[self.fx_name]
-        rpr.set_ext_state(EXT_SECTION, self.key_fx_idx, str(fx.index))
+        rpr.set_ext_state(EXT_SECTION, self.key_track_guid, track_guid)
+        # JSFX is found by name on the lua side
+        rpr.set_ext_state(EXT_SECTION, self.key_fx_idx, '-1')
 
-        self._get_from_lua()
-        raw_midi = rpr.get_ext_state(EXT_SECTION, self.key_result)
-        if raw_midi == '':
-            raise RuntimeError('no midi_data got from the track')
-        return self._deserialize_buffer(raw_midi)
+        remaining = 1
+        while remaining:
+            rpr.set_ext_state(EXT_SECTION, self.key_result, '')
+            self._get_from_lua()
+            raw_midi = rpr.get_ext_state(EXT_SECTION, self.key_result)
+            if raw_midi == '':
+                raise RuntimeError('no midi_data got from the track')
+            remaining = int(rpr.get_ext_state(EXT_SECTION, self.key_remaining))
+            overflow = int(rpr.get_ext_state(EXT_SECTION, self.key_overflow))
+            yield self._deserialize_buffer(raw_midi)
+        self._report_overflow(track, overflow)
+
+    def _report_overflow(self, track: rpr.Track, overflow: int) -> None:
+        if not overflow:
+            return
+        self.overflows[track.id] = overflow
+        if self.raise_on_overflow:
+            raise MidiOverflowError(
+                f'{overflow} events of track {track.id} are lost, '
+                f'capacity of {self.capacity} events is too small'
+            )
 
     def _get_from_lua(self) -> None:
         """For profiling needs."""
@@ -101,10 +260,7 @@ class MidiRenderer:
     ) -> int:
         if project_idx is not None:
             return project_idx
-        for idx, proj in enumerate(rpr.get_projects()):
-            if proj.id == pr.id:
-                return idx
-        raise RuntimeError('cannot find project {pr.id} on the host')
+        return self.index.project_idx(pr)
 
     def build_midi_on_track(
         self,
@@ -112,7 +268,6 @@ class MidiRenderer:
         midi_buf: ty.List[MidiBuf],
         erase_items: bool = True
     ) -> None:
-        prefix = [0xFF, 0x52, 0x50, 0x62]
         if erase_items:
             for itm in track.items:
                 itm.delete()
@@ -122,6 +277,75 @@ class MidiRenderer:
         )
 
         take = item.active_take
+        take.set_midi(self._make_midi_events(take, midi_buf))
+
+    def patch_midi_on_track(
+        self, track: rpr.Track, midi_buf: ty.List[MidiBuf]
+    ) -> int:
+        """Make the first item of track contain midi_buf.
+
+        Only changed events are inserted, moved or deleted. If the
+        track has no items, new MIDI doesn't fit the item, or it
+        changed too much, item is rebuilt by build_midi_on_track.
+
+        Parameters
+        ----------
+        track : rpr.Track
+        midi_buf : List[MidiBuf]
+
+        Returns
+        -------
+        int
+            number of changed events, -1 if item was rebuilt
+        """
+        with rpr.inside_reaper():
+            items = list(track.items)
+            if not items or not items[0].active_take.is_midi:
+                self.build_midi_on_track(track, midi_buf)
+                return -1
+            take = items[0].active_take
+            i_s, i_e = (
+                take.time_to_ppq(t) for t in (
+                    items[0].position,
+                    items[0].position + items[0].length,
+                )
+            )
+            new = self._make_midi_events(take, midi_buf)
+            patch = diff_midi(take.get_midi(), new)
+            fits = all(i_s <= evt['ppq'] < i_e for evt in patch['insert'])
+            fits &= all(i_s <= ppq < i_e for _, ppq in patch['move'])
+            if not fits or patch_size(patch) >= len(new):
+                self.build_midi_on_track(track, midi_buf)
+                return -1
+            self._apply_patch(take, patch)
+        return patch_size(patch)
+
+    def _apply_patch(self, take: rpr.Take, patch: MidiPatch) -> None:
+
+        def bytestr(buf: ty.List[int]) -> str:
+            return bytes(buf).decode('latin-1')
+
+        # moves keep indexes, deletes are sorted from the end
+        RPR.MIDI_DisableSort(take.id)  # type:ignore
+        for idx, ppq in patch['move']:
+            (_, _, _, sel, mut, _, msg, _) = RPR.MIDI_GetEvt(  # type:ignore
+                take.id, idx, False, False, 0, '', 65536
+            )
+            RPR.MIDI_SetEvt(  # type:ignore
+                take.id, idx, sel, mut, ppq, msg, len(msg), True
+            )
+        for idx in patch['delete']:
+            RPR.MIDI_DeleteEvt(take.id, idx)  # type:ignore
+        for evt in patch['insert']:
+            msg = bytestr(evt['buf'])
+            RPR.MIDI_InsertEvt(  # type:ignore
+                take.id, False, False, evt['ppq'], msg, len(msg)
+            )
+        RPR.MIDI_Sort(take.id)  # type:ignore
+
+    def _make_midi_events(self, take: rpr.Take, midi_buf: ty.List[MidiBuf]
+                          ) -> ty.List[rpr.MIDIEventDict]:
+        prefix = [0xFF, 0x52, 0x50, 0x62]
         ppqs = take.map(
             'beat_to_ppq', iterables={'beat': [it['qn'] for it in midi_buf]}
         )
@@ -144,57 +368,201 @@ class MidiRenderer:
                 'buf': buf
             }
             end_buf.append(end_evt)
-        take.set_midi(end_buf)
+        return end_buf
+
+    def render_tracks(
+        self,
+        tracks: ty.List[rpr.Track],
+        profile: RenderSettings = MIDI_RENDER_PROFILE,
+        on_progress: ty.Optional[ty.Callable[[float], None]] = None,
+        cancelled: ty.Optional[ty.Callable[[], bool]] = None,
+    ) -> ty.Dict[str, ty.List[MidiBuf]]:
+        """Render tracks and get MIDI, reached the end of their FX chains.
+
+        See render_tracks_iter for parameters.
 
-    def render_tracks(self, tracks: ty.List[rpr.Track]
-                      ) -> ty.Dict[str, ty.List[MidiBuf]]:
+        Returns
+        -------
+        Dict[str, List[MidiBuf]]
+            by track id
+        """
+        return dict(
+            self.render_tracks_iter(tracks, profile, on_progress, cancelled)
+        )
+
+    def render_tracks_pipelined(
+        self,
+        tracks: ty.List[rpr.Track],
+        consumer: ty.Callable[[str, ty.List[MidiBuf]], T],
+        max_workers: int = 4,
+        profile: RenderSettings = MIDI_RENDER_PROFILE,
+    ) -> ty.Dict[str, T]:
+        """Render tracks and pass MIDI of each to consumer in the pool.
+
+        Consumer gets track MIDI as soon as it is extracted, so
+        extraction of the next tracks overlaps with, e.g., pushing
+        to slaves (see midi_stream.push_midi) and building items there.
+
+        Note
+        ----
+        consumer runs in a worker thread, so it should not use reapy.
+
+        Parameters
+        ----------
+        tracks : List[rpr.Track]
+        consumer : Callable[[str, List[MidiBuf]], T]
+            gets track id and its MIDI
+        max_workers : int, optional
+        profile : RenderSettings, optional
+
+        Returns
+        -------
+        Dict[str, T]
+            consumer results by track id
+
+        Raises
+        ------
+        Exception
+            the first one, raised by consumer
+        """
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = {
+                track_id: pool.submit(consumer, track_id, midi)
+                for track_id, midi in self.render_tracks_iter(tracks, profile)
+            }
+        return {track_id: fut.result() for track_id, fut in futures.items()}
+
+    def render_tracks_iter(
+        self,
+        tracks: ty.List[rpr.Track],
+        profile: RenderSettings = MIDI_RENDER_PROFILE,
+        on_progress: ty.Optional[ty.Callable[[float], None]] = None,
+        cancelled: ty.Optional[ty.Callable[[], bool]] = None,
+    ) -> ty.Iterator[ty.Tuple[str, ty.List[MidiBuf]]]:
+        """Render tracks and yield MIDI of each as soon as it is extracted.
+
+        Parameters
+        ----------
+        tracks : List[rpr.Track]
+            all have to be in one project
+        profile : RenderSettings, optional
+            project render settings to be used instead of the user ones,
+            output file and pattern are always overridden.
+        on_progress : Optional[Callable[[float], None]], optional
+            called with the done part of work (from 0 to 1)
+        cancelled : Optional[Callable[[], bool]], optional
+            checked before the render itself and before extraction
+            of every track, render stops if it returns True
+
+        Yields
+        ------
+        Tuple[str, List[MidiBuf]]
+            track id and its MIDI
+
+        Note
+        ----
+        Audio is rendered into RENDER_DIR on the host of REAPER
+        and removed after. Duration of every phase is kept in `timings`.
+
+        Raises
+        ------
+        RenderCancelled
+            user settings are restored before it is raised
+        """
+        self.timings = {}
+        self.overflows = {}
+        self.index.validate()
+
+        def progress(done: float) -> None:
+            if on_progress is not None:
+                on_progress(done)
+
+        def check_cancelled() -> None:
+            if cancelled is not None and cancelled():
+                raise RenderCancelled('render is cancelled')
 
         pattern = 'temp_for_render_midi'
-        resource_path = rpr.get_resource_path()
         project = tracks[0].project
-        selected_tracks = list(project.selected_tracks)
-        for track in tracks:
-            self.add_jsfx_to_track(track)
-
-        original_settings = self._get_render_settings(project)
-        new_settings: RenderSettings = {
-            'value':
-                {
-                    'RENDER_SETTINGS': 3.0,
-                    'RENDER_BOUNDSFLAG': 1,
-                    'RENDER_CHANNELS': 1,
-                    'RENDER_ADDTOPROJ': 0,
-                    'RENDER_SRATE': 0,
-                },
-            'string':
-                {
-                    'RENDER_FILE': resource_path,
-                    'RENDER_PATTERN': pattern,
-                    'RENDER_FORMAT': 'vggo',
-                }
-        }
-        project.selected_tracks = tracks
-        self._set_render_settings(new_settings, project)
-        self._render_it()
-        self._set_render_settings(original_settings, project)
-        self._remove_rendered_audio(resource_path, pattern, tracks)
-        project.selected_tracks = selected_tracks
-        midi = {}
-        for track in tracks:
-            midi[track.id] = self.get_midi_from_track(track)
-        return midi
+        selected_tracks: ty.Optional[ty.List[rpr.Track]] = None
+        original_settings: ty.Optional[RenderSettings] = None
+        render_dir: ty.Optional[str] = None
+        try:
+            with self._phase('setup'):
+                with rpr.inside_reaper():
+                    selected_tracks = list(project.selected_tracks)
+                    original_settings = self._get_render_settings(
+                        project, profile
+                    )
+                    render_dir = self._get_render_dir()
+                    # left by interrupted render, REAPER would ask
+                    # for overwriting them
+                    self._remove_rendered_audio(render_dir)
+                    for track in tracks:
+                        self.add_jsfx_to_track(track)
+                    new_settings: RenderSettings = {
+                        'value': dict(profile['value']),
+                        'string':
+                            {
+                                **profile['string'],
+                                'RENDER_FILE': render_dir,
+                                'RENDER_PATTERN': pattern,
+                            }
+                    }
+                    project.selected_tracks = tracks
+                    self._set_render_settings(new_settings, project)
+            check_cancelled()
+            with self._phase('render'):
+                self._render_it()
+            progress(.6)
+        finally:
+            with self._phase('restore'):
+                with rpr.inside_reaper():
+                    if original_settings is not None:
+                        self._set_render_settings(original_settings, project)
+                    if selected_tracks is not None:
+                        project.selected_tracks = selected_tracks
+            if render_dir is not None:
+                with self._phase('cleanup'):
+                    self._remove_rendered_audio(render_dir)
+        for idx, track in enumerate(tracks):
+            check_cancelled()
+            with self._phase('extract'):
+                midi = self.get_midi_from_track(track)
+            progress(.6 + .4 * (idx + 1) / len(tracks))
+            yield track.id, midi
+        log(
+            'render_midi timings:', ', '.join(
+                f'{phase}: {sec:.3f}s' for phase, sec in self.timings.items()
+            )
+        )
+
+    @contextmanager
+    def _phase(self, name: str) -> ty.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + (
+                time.perf_counter() - start
+            )
+
+    def _get_render_dir(self) -> str:
+        """Make RENDER_DIR in resource path on the host of REAPER."""
+        resource_path = rpr.get_resource_path()
+        sep = '\\' if '\\' in resource_path else '/'
+        render_dir = resource_path.rstrip(sep) + sep + RENDER_DIR
+        RPR.RecursiveCreateDirectory(render_dir, 0)  # type:ignore
+        return render_dir
 
     def _render_it(self) -> None:
         render_action = 42230
         rpr.perform_action(render_action)
 
-    def _remove_rendered_audio(
-        self, resource_path: str, pattern: str, tracks: ty.List[rpr.Track]
-    ) -> None:
-        for idx, track in enumerate(tracks):
-            idx_str = '' if len(tracks) == 1 else f'-{idx+1:03d}'
-            filename = f'{os.path.join(resource_path, pattern)}{idx_str}.ogg'
-            os.remove(filename)
+    def _remove_rendered_audio(self, render_dir: str) -> None:
+        """Remove files of the dir by lua, on the host of REAPER."""
+        with rpr.inside_reaper():
+            rpr.set_ext_state(EXT_SECTION, self.key_cleanup, render_dir)
+            rpr.perform_action(self.get_command_id)
 
     def _set_render_settings(
         self, new_settings: RenderSettings, project: rpr.Project
@@ -204,7 +572,11 @@ class MidiRenderer:
         for key, string in new_settings['string'].items():
             project.set_info_string(key, string)
 
-    def _get_render_settings(self, project: rpr.Project) -> RenderSettings:
+    def _get_render_settings(
+        self,
+        project: rpr.Project,
+        profile: ty.Optional[RenderSettings] = None
+    ) -> RenderSettings:
         value_keys = [
             'RENDER_SETTINGS', 'RENDER_BOUNDSFLAG', 'RENDER_CHANNELS',
             'RENDER_SRATE', 'RENDER_STARTPOS', 'RENDER_ENDPOS',
@@ -212,9 +584,132 @@ class MidiRenderer:
             'RENDER_DITHER'
         ]
         string_keys = ['RENDER_FILE', 'RENDER_PATTERN', 'RENDER_FORMAT']
+        if profile is not None:
+            value_keys += [k for k in profile['value'] if k not in value_keys]
+            string_keys += [
+                k for k in profile['string'] if k not in string_keys
+            ]
         out: RenderSettings = {'value': {}, 'string': {}}
         for key in value_keys:
             out['value'][key] = project.get_info_value(key)
         for key in string_keys:
             out['string'][key] = project.get_info_string(key)
         return out
+
+
+class LiveMidiReader:
+    """Drains MIDI captured by render JSFX during normal playback.
+
+    JSFX in live mode writes every event into the gmem ring buffer of
+    its slot and moves the head counter. Reader takes events between
+    tail and head and moves the tail, so it can be called every defer
+    tick without stopping the playback.
+
+    Note
+    ----
+    gmem is shared by all JSFX instances, so every track captured at the
+    same time needs its own slot. Layout mirrors the JSFX `@init`.
+
+    Example
+    -------
+        reader = LiveMidiReader(fx, slot=0, on_midi=push_to_slaves)
+        reader.start()
+
+        def main_loop() -> None:
+            reader.run()
+            rpr.defer(main_loop)
+    """
+
+    gmem_name = 'ReasessionRenderMidi'
+    live_base = 6000000
+    slot_size = 65536
+    header_size = 8
+    events_cap = 8192
+    bytes_cap = slot_size - header_size - events_cap * 4
+    max_slots = 16
+
+    _live_param = 1
+    _slot_param = 2
+
+    _head, _tail, _dropped, _bytes_head, _bytes_tail = range(5)
+
+    def __init__(
+        self,
+        fx: rpr.FX,
+        slot: int = 0,
+        on_midi: ty.Optional[ty.Callable[[ty.List[MidiBuf]], None]] = None
+    ) -> None:
+        assert 0 <= slot < self.max_slots, f'slot {slot} is out of range'
+        self.fx = fx
+        self.slot = slot
+        self._on_midi = on_midi
+        self._base = self.live_base + slot * self.slot_size
+
+    def start(self) -> None:
+        """Skip stale events and put JSFX in live mode."""
+        with rpr.inside_reaper():
+            RPR.gmem_attach(self.gmem_name)  # type:ignore
+            self._sync_tail()
+            self.fx.params[self._slot_param] = self.slot
+            self.fx.params[self._live_param] = 1
+
+    def stop(self) -> None:
+        """Put JSFX out of live mode."""
+        self.fx.params[self._live_param] = 0
+
+    @property
+    def dropped(self) -> int:
+        """Events missed by JSFX because the ring was full."""
+        with rpr.inside_reaper():
+            RPR.gmem_attach(self.gmem_name)  # type:ignore
+            return int(self._read(self._dropped))
+
+    def drain(self) -> ty.List[MidiBuf]:
+        """Get all events captured since the last call."""
+        with rpr.inside_reaper():
+            RPR.gmem_attach(self.gmem_name)  # type:ignore
+            head = int(self._read(self._head))
+            tail = int(self._read(self._tail))
+            if head < tail:
+                # ring was reset (e.g. JSFX reloaded), start over
+                self._sync_tail()
+                return []
+            events_ptr = self._base + self.header_size
+            bytes_ptr = events_ptr + self.events_cap * 4
+            midi_buf: ty.List[MidiBuf] = []
+            bytes_tail = int(self._read(self._bytes_tail))
+            for idx in range(tail, head):
+                ev = events_ptr + (idx % self.events_cap) * 4
+                qn, bus, ptr, length = (
+                    RPR.gmem_read(ev + i)  # type:ignore
+                    for i in range(4)
+                )
+                ptr, length = int(ptr), int(length)
+                buf = [
+                    int(
+                        RPR.gmem_read(  # type:ignore
+                            bytes_ptr + (ptr + i) % self.bytes_cap
+                        )
+                    ) for i in range(length)
+                ]
+                midi_buf.append(MidiBuf(qn=qn, bus=int(bus), buf=buf))
+                bytes_tail = ptr + length
+            self._write(self._bytes_tail, bytes_tail)
+            self._write(self._tail, head)
+        return midi_buf
+
+    def run(self) -> None:
+        """Callback to be put in defer loop."""
+        midi_buf = self.drain()
+        if midi_buf and self._on_midi is not None:
+            self._on_midi(midi_buf)
+
+    def _sync_tail(self) -> None:
+        self._write(self._bytes_tail, self._read(self._bytes_head))
+        self._write(self._tail, self._read(self._head))
+
+    def _read(self, field: int) -> float:
+        return ty.cast(float, RPR.gmem_read(self._base + field))  # type:ignore
+
+    def _write(self, field: int, value: float) -> None:
+        RPR.gmem_write(self._base + field, value)  # type:ignore
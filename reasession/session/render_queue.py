@@ -0,0 +1,261 @@
+"""Render jobs, queued per host and processed from the defer loop.
+
+Render itself blocks REAPER, so it cannot be done in background.
+But callers (e.g. handlers of slave requests) just put the job and get
+the Future, while the queue renders one job per defer tick. Jobs can be
+submitted and cancelled from any thread. The running job stops at the
+next phase of its render (before the render itself or before extraction
+of the next track).
+
+Example
+-------
+    queue = RenderQueue('localhost')
+
+    def on_slave_request(tracks: ty.List[rpr.Track]) -> None:
+        future = queue.submit(tracks)
+        future.add_done_callback(push_to_slave)
+
+    def main_loop() -> None:
+        queue.run()
+        rpr.defer(main_loop)
+
+    rpr.at_exit(queue.at_exit)
+"""
+
+import typing as ty
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import InvalidStateError
+from enum import Enum
+from threading import Lock
+
+import reapy as rpr
+
+from reasession.common import log
+from .render_midi import MidiBuf, MidiRenderer, RenderCancelled
+from .render_midi import RenderSettings
+from .render_midi import MIDI_RENDER_PROFILE
+
+RenderResult = ty.Dict[str, ty.List[MidiBuf]]
+JobKey = ty.Tuple[str, ty.Tuple[str, ...], ty.Tuple[object, ...]]
+
+
+class JobState(Enum):
+    pending = 'pending'
+    running = 'running'
+    done = 'done'
+    cancelled = 'cancelled'
+    failed = 'failed'
+
+
+class RenderJob:
+    """Tracks to be rendered and the Future of their MIDI.
+
+    Attributes
+    ----------
+    key : JobKey
+        identical requests have the same key
+    future : Future[RenderResult]
+        stays pending while the job is rendered, so it can be cancelled
+    progress : float
+        from 0 to 1
+    state : JobState
+    """
+
+    def __init__(
+        self, tracks: ty.List[rpr.Track], profile: RenderSettings
+    ) -> None:
+        self.tracks = tracks
+        self.profile = profile
+        self.key = self.make_key(tracks, profile)
+        self.future: 'Future[RenderResult]' = Future()
+        self.progress = 0.0
+        self.state = JobState.pending
+
+    @staticmethod
+    def make_key(
+        tracks: ty.List[rpr.Track], profile: RenderSettings
+    ) -> JobKey:
+        settings = (
+            *sorted(profile['value'].items()),
+            *sorted(profile['string'].items()),
+        )
+        return (
+            tracks[0].project.id,
+            tuple(sorted(track.id for track in tracks)),
+            settings,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f'RenderJob(tracks={len(self.tracks)}, state={self.state.value},'
+            f' progress={self.progress:.2f})'
+        )
+
+
+class RenderQueue:
+    """Sequential render service of one host."""
+
+    def __init__(
+        self,
+        host: str = 'localhost',
+        renderer: ty.Optional[MidiRenderer] = None,
+        on_progress: ty.Optional[ty.Callable[[RenderJob], None]] = None,
+    ) -> None:
+        """Sequential render service of one host.
+
+        Parameters
+        ----------
+        host : str, optional
+            'localhost' or IPV4 address
+        renderer : Optional[MidiRenderer], optional
+            made at the first job, if not given
+        on_progress : Optional[Callable[[RenderJob], None]], optional
+            called every time progress or state of the job changed
+        """
+        self.host = host
+        self._renderer = renderer
+        self._on_progress = on_progress
+        self._pending: ty.Deque[RenderJob] = deque()
+        self._jobs: ty.Dict[JobKey, RenderJob] = {}
+        # guards _pending and _jobs, never held while calling futures
+        self._lock = Lock()
+        self.current: ty.Optional[RenderJob] = None
+
+    @property
+    def jobs(self) -> ty.List[RenderJob]:
+        """Running and pending jobs in order of processing."""
+        current = [self.current] if self.current else []
+        with self._lock:
+            return current + list(self._pending)
+
+    def submit(
+        self,
+        tracks: ty.List[rpr.Track],
+        profile: RenderSettings = MIDI_RENDER_PROFILE,
+    ) -> 'Future[RenderResult]':
+        """Put tracks to the queue.
+
+        If the same tracks are already waiting for render or rendering,
+        Future of that job is returned.
+
+        Parameters
+        ----------
+        tracks : List[rpr.Track]
+            all have to be in one project of the host
+        profile : RenderSettings, optional
+
+        Returns
+        -------
+        Future[Dict[str, List[MidiBuf]]]
+            MIDI by track id
+        """
+        assert tracks, 'nothing to render'
+        key = RenderJob.make_key(tracks, profile)
+        job = RenderJob(tracks, profile)
+        with self._lock:
+            if key in self._jobs:
+                return self._jobs[key].future
+            self._jobs[key] = job
+            self._pending.append(job)
+        job.future.add_done_callback(lambda _: self._forget(job))
+        return job.future
+
+    def cancel(self, future: 'Future[RenderResult]') -> bool:
+        """Cancel job.
+
+        Running job is cancelled at once, but its render stops at the
+        next phase.
+        """
+        return future.cancel()
+
+    def cancel_all(self) -> None:
+        """Cancel running and all pending jobs."""
+        for job in self.jobs:
+            job.future.cancel()
+
+    def run(self) -> None:
+        """Callback to be put in defer loop.
+
+        Renders at most one job per call.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+            if not job.future.cancelled():
+                self._process(job)
+                return
+
+    def at_exit(self) -> None:
+        """Has to be put into reapy.at_exit."""
+        self.cancel_all()
+
+    def _process(self, job: RenderJob) -> None:
+        self.current = job
+        self._set_progress(job, 0.0, JobState.running)
+        try:
+            with rpr.connect(None if self.host == 'localhost' else self.host):
+                result = self._get_renderer().render_tracks(
+                    job.tracks,
+                    job.profile,
+                    on_progress=lambda done: self._set_progress(job, done),
+                    cancelled=job.future.cancelled,
+                )
+        except RenderCancelled:
+            log(f'render job {job} is cancelled')
+            self._set_progress(job, job.progress, JobState.cancelled)
+        except Exception as e:
+            log(f'render job {job} failed: {e}')
+            self._resolve(job, JobState.failed, error=e)
+        else:
+            self._resolve(job, JobState.done, result=result)
+        finally:
+            self.current = None
+
+    def _resolve(
+        self,
+        job: RenderJob,
+        state: JobState,
+        result: ty.Optional[RenderResult] = None,
+        error: ty.Optional[Exception] = None,
+    ) -> None:
+        """Set result of the job, unless it was cancelled meanwhile."""
+        if job.future.cancelled():
+            return
+        progress = 1.0 if state is JobState.done else job.progress
+        self._set_progress(job, progress, state)
+        try:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(ty.cast(RenderResult, result))
+        except InvalidStateError:
+            pass  # cancelled right after the check, see _forget()
+
+    def _get_renderer(self) -> MidiRenderer:
+        if self._renderer is None:
+            self._renderer = MidiRenderer()
+        return self._renderer
+
+    def _set_progress(
+        self,
+        job: RenderJob,
+        progress: float,
+        state: ty.Optional[JobState] = None
+    ) -> None:
+        job.progress = progress
+        if state is not None:
+            job.state = state
+        if self._on_progress is not None:
+            self._on_progress(job)
+
+    def _forget(self, job: RenderJob) -> None:
+        with self._lock:
+            if job.future.cancelled() and job in self._pending:
+                self._pending.remove(job)
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+        if job.future.cancelled():
+            self._set_progress(job, job.progress, JobState.cancelled)
@@ -0,0 +1,325 @@
+"""Render one project on several hosts in parallel, slice by slice.
+
+The main flow is
+----------------
+    - get bar positions of the project
+    - split timeline at bar boundaries into one slice per host
+    - render every slice (with a tail for hanging notes) on its host
+    - stitch MIDI buffers of every track in qn order
+
+Every host has to have the same project opened.
+"""
+
+import typing as ty
+import typing_extensions as te
+from concurrent.futures import Executor
+from collections import Counter
+
+import reapy as rpr
+from reapy import reascript_api as RPR
+
+from reasession.host_pool import shared_pool
+from .render_midi import MidiBuf, MidiRenderer, RenderSettings
+from .render_midi import MIDI_RENDER_PROFILE
+
+Slice = ty.Tuple[float, float]
+"""(start, end) in quarter notes."""
+SliceMidi = ty.List[ty.List[MidiBuf]]
+"""MIDI of every rendered track in the order tracks were given."""
+_NoteKey = ty.Tuple[int, int, int]
+
+
+class SliceHost(te.Protocol):
+    """Anything, that can render slice of the project.
+
+    host is 'localhost' or IPV4 address, slices of one host are
+    rendered by one worker of the HostPool.
+    """
+
+    host: str
+
+    def render_slice(
+        self, track_idxs: ty.List[int], start: float, end: float
+    ) -> SliceMidi:
+        """Render tracks between start and end quarter notes."""
+        ...
+
+
+class RenderHost:
+    """Renders slices of the project on the REAPER host.
+
+    Note
+    ----
+    reapy keeps the selected host globally, so slices of different
+    hosts have to be rendered in different processes.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        project: ty.Union[str, int],
+        profile: RenderSettings = MIDI_RENDER_PROFILE,
+    ) -> None:
+        """Renders slices of the project on the REAPER host.
+
+        Parameters
+        ----------
+        host : str
+            'localhost' or IPV4 address
+        project : Union[str, int]
+            name or index of the project on the host
+        profile : RenderSettings, optional
+            render bounds will be replaced by the slice
+        """
+        self.host = host
+        self.project = project
+        self.profile = profile
+
+    def render_slice(
+        self, track_idxs: ty.List[int], start: float, end: float
+    ) -> SliceMidi:
+        host = None if self.host == 'localhost' else self.host
+        with rpr.connect(host):
+            pr = rpr.Project(self.project)
+            with pr.make_current_project():
+                with rpr.inside_reaper():
+                    tracks = [pr.tracks[idx] for idx in track_idxs]
+                    profile = slice_profile(pr, self.profile, start, end)
+                midi = MidiRenderer().render_tracks(tracks, profile)
+        return [midi[track.id] for track in tracks]
+
+
+def _render_slice(
+    host: str, slice_host: SliceHost, track_idxs: ty.List[int],
+    start: float, end: float
+) -> SliceMidi:
+    """Render slice, called by the worker of the host."""
+    return slice_host.render_slice(track_idxs, start, end)
+
+
+def slice_profile(
+    project: rpr.Project, profile: RenderSettings, start: float, end: float
+) -> RenderSettings:
+    """Make render settings for the time bounds of the slice.
+
+    Parameters
+    ----------
+    project : rpr.Project
+    profile : RenderSettings
+    start : float
+        quarter notes
+    end : float
+        quarter notes
+
+    Returns
+    -------
+    RenderSettings
+    """
+    value = dict(profile['value'])
+    value['RENDER_BOUNDSFLAG'] = 0
+    value['RENDER_STARTPOS'] = RPR.TimeMap2_QNToTime(  # type:ignore
+        project.id, start
+    )
+    value['RENDER_ENDPOS'] = RPR.TimeMap2_QNToTime(  # type:ignore
+        project.id, end
+    )
+    return RenderSettings(value=value, string=dict(profile['string']))
+
+
+def get_bars(project: rpr.Project) -> ty.List[float]:
+    """Get quarter note positions of all bars, including the project end.
+
+    Parameters
+    ----------
+    project : rpr.Project
+
+    Returns
+    -------
+    List[float]
+    """
+    with rpr.inside_reaper():
+        end = RPR.TimeMap2_timeToQN(project.id, project.length)  # type:ignore
+        bars: ty.List[float] = []
+        measure = 0
+        while True:
+            qn_start = RPR.TimeMap_GetMeasureInfo(  # type:ignore
+                project.id, measure, 0, 0, 0, 0, 0
+            )[3]
+            if qn_start >= end:
+                break
+            bars.append(qn_start)
+            measure += 1
+    bars.append(end)
+    return bars
+
+
+def split_at_bars(bars: ty.List[float], n_slices: int) -> ty.List[Slice]:
+    """Split timeline to slices of (almost) equal bars count.
+
+    Parameters
+    ----------
+    bars : List[float]
+        quarter note positions of bars and the end of timeline
+    n_slices : int
+        can be reduced if there are not enough bars
+
+    Returns
+    -------
+    List[Slice]
+    """
+    n_bars = len(bars) - 1
+    if n_bars < 1:
+        return [(bars[0], bars[0])] if bars else []
+    n_slices = max(1, min(n_slices, n_bars))
+    bounds = [bars[round(i * n_bars / n_slices)] for i in range(n_slices)]
+    bounds.append(bars[-1])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _note_key(msg: MidiBuf) -> ty.Optional[ty.Tuple[_NoteKey, bool]]:
+    """Return (bus, channel, pitch) and whether it is note-on."""
+    buf = msg['buf']
+    if len(buf) < 3:
+        return None
+    status = buf[0] & 0xf0
+    if status not in (0x80, 0x90):
+        return None
+    key = (msg['bus'], buf[0] & 0x0f, buf[1])
+    return key, status == 0x90 and buf[2] > 0
+
+
+def stitch_slices(slices: ty.List[Slice],
+                  midi: ty.List[ty.List[MidiBuf]]) -> ty.List[MidiBuf]:
+    """Join MIDI of one track, rendered by slices.
+
+    Every slice is expected to be rendered with a tail, so note-offs of
+    notes started inside the slice are caught. Other events of the tail
+    belong to the next slice and are dropped, as well as note-offs of
+    notes, started in the previous slices. If the tail was too short,
+    note is closed by the first matching note-off of the next slices
+    or at the very end.
+
+    Parameters
+    ----------
+    slices : List[Slice]
+    midi : List[List[MidiBuf]]
+        MIDI of the track for every slice
+
+    Returns
+    -------
+    List[MidiBuf]
+        sorted by qn
+    """
+    out: ty.List[MidiBuf] = []
+    hanging: ty.Counter[_NoteKey] = Counter()
+    for (start, end), slice_midi in zip(slices, midi):
+        opened: ty.Counter[_NoteKey] = Counter()
+        for msg in sorted(slice_midi, key=lambda m: m['qn']):
+            note = _note_key(msg)
+            if note is None:
+                if start <= msg['qn'] < end:
+                    out.append(msg)
+                continue
+            key, is_on = note
+            if is_on:
+                if start <= msg['qn'] < end:
+                    opened[key] += 1
+                    out.append(msg)
+            elif opened[key]:
+                opened[key] -= 1
+                out.append(msg)
+            elif hanging[key] and msg['qn'] >= start:
+                hanging[key] -= 1
+                out.append(msg)
+        hanging.update(opened)
+    if slices:
+        for (bus, channel, pitch), count in hanging.items():
+            out.extend(
+                MidiBuf(
+                    qn=slices[-1][1], bus=bus, buf=[0x80 | channel, pitch, 0]
+                ) for _ in range(count)
+            )
+    out.sort(key=lambda m: m['qn'])
+    return out
+
+
+class SlicedMidiRenderer:
+    """Renders project on several hosts in parallel and stitches MIDI.
+
+    Example
+    -------
+        renderer = SlicedMidiRenderer(
+            [RenderHost('localhost', 'cue_1'),
+             RenderHost('192.168.2.2', 'cue_1')]
+        )
+        midi = renderer.render_tracks(tracks)
+    """
+
+    def __init__(
+        self,
+        hosts: ty.Sequence[SliceHost],
+        tail: float = 16,
+        executor: ty.Optional[Executor] = None,
+    ) -> None:
+        """Renders project on several hosts in parallel.
+
+        Parameters
+        ----------
+        hosts : Sequence[SliceHost]
+            one slice will be rendered by each host
+        tail : float, optional
+            quarter notes rendered after the slice to catch note-offs
+        executor : Optional[Executor], optional
+            shared HostPool by default
+        """
+        assert hosts, 'at least one host is needed'
+        self.hosts = list(hosts)
+        self.tail = tail
+        self._executor = executor
+
+    def render_tracks(self, tracks: ty.List[rpr.Track]
+                      ) -> ty.Dict[str, ty.List[MidiBuf]]:
+        """Render tracks of the current host project by slices.
+
+        Returns
+        -------
+        Dict[str, List[MidiBuf]]
+            by track id
+        """
+        project = tracks[0].project
+        with rpr.inside_reaper():
+            ids = [tr.id for tr in project.tracks]
+            track_idxs = [ids.index(track.id) for track in tracks]
+        bars = get_bars(project)
+        slices = self.render_slices(track_idxs, bars)
+        return {
+            track.id: stitch_slices(
+                [sl for sl, _ in slices], [midi[n] for _, midi in slices]
+            )
+            for n, track in enumerate(tracks)
+        }
+
+    def render_slices(self, track_idxs: ty.List[int], bars: ty.List[float]
+                      ) -> ty.List[ty.Tuple[Slice, SliceMidi]]:
+        """Give every host its slice and wait for all of them.
+
+        Parameters
+        ----------
+        track_idxs : List[int]
+        bars : List[float]
+            see get_bars()
+
+        Returns
+        -------
+        List[Tuple[Slice, SliceMidi]]
+            in the timeline order
+        """
+        slices = split_at_bars(bars, len(self.hosts))
+        executor = self._executor or shared_pool
+        futures = [
+            executor.submit(
+                _render_slice, host.host, host, track_idxs, start,
+                end + self.tail
+            ) for host, (start, end) in zip(self.hosts, slices)
+        ]
+        return [(sl, fut.result()) for sl, fut in zip(slices, futures)]
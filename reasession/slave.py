@@ -6,7 +6,7 @@ from time import sleep
 import reapy as rpr
 import reapy.reascript_api as RPR
 
-from networking import ReaperServer
+from networking import AsyncReaperServer
 from networking import DEF_HOST
 from networking import DEF_PORT
 from networking import Announce
@@ -35,7 +35,7 @@ else:
     HOST = rpr.get_ext_state(EXT_SECTION, ADDRESS_KEY_SLAVE)
 
 handlers = [PrintHandler, PingHandler]
-server = ReaperServer(HOST, PORT, handlers)
+server = AsyncReaperServer(HOST, PORT, handlers)
 
 announce = Announce(HOST, PORT)
 
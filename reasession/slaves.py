@@ -1,6 +1,7 @@
 import typing as ty
 from networking import Discovery
-from networking import send_data
+from networking import connections
+from networking import request
 from networking import GUI_PORT
 from common import TimeCallback
 from common import log
@@ -23,7 +24,7 @@ class Slaves:
         self._pinger = TimeCallback(self._ping, time=1)
 
     def _send_slaves_to_gui(self) -> None:
-        send_data(
+        request(
             'slave_list', [key for key in self._slaves_active],
             port=GUI_PORT,
             timeout=0.03
@@ -41,12 +42,13 @@ class Slaves:
         active = self._slaves_active.copy()
         for host in active:
             try:
-                response = send_data(
+                response = request(
                     'ping', 'ping', host, self._slaves_port, timeout=0.03
                 )
             except ConnectionRefusedError as e:
                 log(f'slave {host} is dead: {e}')
                 del self._slaves_active[host]
+                connections.close(host, self._slaves_port)
                 rpr.defer(self._send_slaves_to_gui)
                 return
             except st.timeout as e:
@@ -66,6 +68,7 @@ class Slaves:
 
     def at_exit(self) -> None:
         self._discovery.at_exit()
+        connections.close_all()
 
     def active_slaves(self) -> ty.Dict[str, SlaveForMaster]:
         return self._slaves_active
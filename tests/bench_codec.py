@@ -0,0 +1,82 @@
+"""Benchmark of networking payload codecs.
+
+Run as:
+    python -m tests.bench_codec
+"""
+
+import json
+import pickle
+import timeit
+import typing as ty
+
+from reasession import codec
+from reasession.connections import jack_backend as bck
+from reasession.session.render_midi import MIDI_BUFS, MidiBuf
+
+from .bench_port_matching import make_inventory
+
+
+def make_midi(n_events: int) -> ty.List[MidiBuf]:
+    """Make notes and dense CC, as rendered from the track."""
+    midi = []
+    for i in range(n_events):
+        if i % 4:
+            buf = [0xb0, 1, i % 128]
+        else:
+            buf = [0x90 | i % 16, 36 + i % 48, 100]
+        midi.append(MidiBuf(qn=i / 48, bus=i % 3, buf=buf))
+    return midi
+
+
+def make_host_info(n_ports: int) -> bck._HostInfo:
+    r_ports, j_ports = make_inventory(n_ports)
+    return bck._HostInfo(
+        host='192.168.2.1',
+        reaper_in_ports=r_ports,
+        jack_in_ports=j_ports,
+        in_tracks=[],
+        reaper_out_ports=r_ports,
+        jack_out_ports=j_ports,
+        out_tracks=[],
+    )
+
+
+def measure(
+    name: str, value: object, schema: codec.Schema, number: int
+) -> None:
+    codecs: ty.Dict[str, ty.Tuple[ty.Callable[[], bytes],
+                                  ty.Callable[[bytes], object]]] = {
+        'pickle': (lambda: pickle.dumps(value), pickle.loads),
+        'json': (lambda: json.dumps(value).encode(), json.loads),
+        'schema': (lambda: schema.encode(value), schema.decode),
+    }
+    for codec_name, (dump, load) in codecs.items():
+        data = dump()
+        assert load(data) == value
+        enc = timeit.timeit(dump, number=number) / number
+        dec = timeit.timeit(lambda: load(data), number=number) / number
+        print(
+            f'{name:>16} {codec_name:>7} {len(data):>9}'
+            f' {enc * 1000:>9.3f} {dec * 1000:>9.3f}'
+        )
+
+
+def main() -> None:
+    print(
+        f'{"payload":>16} {"codec":>7} {"bytes":>9}'
+        f' {"enc, ms":>9} {"dec, ms":>9}'
+    )
+    for n_events in (100, 10000):
+        measure(
+            f'MidiBuf x{n_events}', make_midi(n_events), MIDI_BUFS,
+            max(1, 20000 // n_events)
+        )
+    for n_ports in (10, 500):
+        measure(
+            f'_HostInfo x{n_ports}', make_host_info(n_ports),
+            bck.HOST_INFO, max(1, 2000 // n_ports)
+        )
+
+
+if __name__ == '__main__':
+    main()
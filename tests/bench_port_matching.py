@@ -0,0 +1,77 @@
+"""Benchmark of Reaper to jack MIDI ports matching.
+
+Run as:
+    python -m tests.bench_port_matching
+"""
+
+import typing as ty
+import timeit
+
+from reasession.connections import jack_backend as bck
+
+SIZES = (10, 100, 500, 1000, 5000)
+
+
+def make_inventory(
+    n_ports: int
+) -> ty.Tuple[ty.List[bck._RMidiPort], ty.List[bck._JMidiPort]]:
+    """Make Reaper and jack ports of a2j / netjack-like rig.
+
+    Quarter of ports are system devices, the rest are connected
+    to the slaves, and some Reaper ports have no jack pair at all.
+    """
+    r_ports: ty.List[bck._RMidiPort] = []
+    j_ports: ty.List[bck._JMidiPort] = []
+    for i in range(n_ports):
+        if i % 4 == 0:
+            r_name = f'system:midi_capture_{i}'
+            conn = bck._JConnection(host='system', name=f'midi_capture_{i}')
+        else:
+            r_name = f'MIDI Input {i}'
+            conn = bck._JConnection(
+                host=f'192.168.2.{i % 7 + 2}', name=f'midi_from_slave_{i}'
+            )
+        r_ports.append(bck._RMidiPort(idx=i, name=r_name))
+        if i % 10 != 9:
+            j_ports.append(
+                bck._JMidiPort(name=f'MIDI Input {i}', connection=conn)
+            )
+    return r_ports, j_ports
+
+
+def naive_match(
+    r_ports: ty.List[bck._RMidiPort],
+    j_ports: ty.List[bck._JMidiPort],
+) -> ty.List[ty.Tuple[int, bck._JMidiPort]]:
+    """Compare every Reaper port with every jack port."""
+    out = []
+    for r_port in r_ports:
+        for j_port in j_ports:
+            name = r_port['name']
+            if name == j_port['name'] or (
+                name.startswith(j_port['connection']['host'])
+                and name.endswith(j_port['connection']['name'])
+            ):
+                out.append((r_port['idx'], j_port))
+    return out
+
+
+def main() -> None:
+    print(f'{"ports":>6} {"naive, ms":>10} {"indexed, ms":>12}')
+    for size in SIZES:
+        r_ports, j_ports = make_inventory(size)
+        number = max(1, 2000 // size)
+        naive = timeit.timeit(
+            lambda: naive_match(r_ports, j_ports), number=number
+        ) / number
+        indexed = timeit.timeit(
+            lambda: bck.match_host_ports_parametrized(
+                r_ports, j_ports, '192.168.2.1'
+            ),
+            number=number
+        ) / number
+        print(f'{size:>6} {naive * 1000:>10.2f} {indexed * 1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import typing as ty
+import typing_extensions as te
+import pytest as pt
+import reapy as rpr
+from reasession import codec
+from reasession.connections import jack_backend as bck
+from reasession.session.render_midi import MIDI_BUFS, MidiBuf
+
+
+class Optionals(te.TypedDict, total=False):
+
+    name: str
+    values: ty.Dict[str, ty.Optional[float]]
+    pair: ty.Tuple[int, bool]
+    rest: ty.Tuple[bytes, ...]
+
+
+OPTIONALS = codec.register(255, Optionals)
+
+
+def make_track(idx: int) -> rpr.Track:
+    return rpr.Track(f'(MediaTrack*)0x{idx:016x}')
+
+
+def test_midi_bufs():
+    midi = [
+        MidiBuf(qn=i / 3, bus=i % 2, buf=[0x90, 60 + i % 10, 100])
+        for i in range(100)
+    ]
+    tag, data = codec.encode(midi, MIDI_BUFS)
+    assert tag == MIDI_BUFS.tag
+    assert codec.decode(tag, data) == midi
+    sysex = [MidiBuf(qn=-1.5, bus=-1, buf=[-1, 300, 0])]
+    assert codec.decode(tag, MIDI_BUFS.encode(sysex)) == sysex
+
+
+def test_host_info():
+    port = bck._RMidiPort(idx=3, name='MIDI Input 3')
+    j_port = bck._JMidiPort(
+        name='MIDI Input 3',
+        connection=bck._JConnection(host='192.168.2.2', name='midi_1')
+    )
+    info = bck._HostInfo(
+        host='192.168.2.1',
+        reaper_in_ports=[port],
+        jack_in_ports=[j_port],
+        in_tracks=[make_track(1)],
+        reaper_out_ports=[],
+        jack_out_ports=[],
+        out_tracks=[
+            bck._ROutTrack(
+                track=make_track(2),
+                slave=bck._RSlaveTrack(host='192.168.2.2', track=make_track(3))
+            )
+        ],
+    )
+    decoded = codec.decode(*codec.encode(info, bck.HOST_INFO))
+    assert decoded['in_tracks'] == [make_track(1)]
+    assert decoded['out_tracks'][0]['slave']['track'] == make_track(3)
+    assert decoded['jack_in_ports'] == [j_port]
+    assert codec.decode(
+        *codec.encode([port], bck.R_MIDI_PORTS)
+    ) == [port]
+
+
+def test_columns():
+    ports = [
+        bck._RMidiPort(idx=idx, name=name) for idx, name in (
+            (0, 'MIDI Input 1'), (-1, 'Вход MIDI'), (2**40, ''),
+            (2**70, 'out'), (5, 'Ausgang ä')
+        )
+    ]
+    for n in range(len(ports) + 1):
+        decoded = codec.decode(*codec.encode(ports[:n], bck.R_MIDI_PORTS))
+        assert decoded == ports[:n]
+    nested = codec.register(252, ty.List[ty.List[Optionals]])
+    value = [[], [Optionals(name='a')], [Optionals(), Optionals(pair=(1, 0))]]
+    assert nested.decode(nested.encode(value)) == value
+
+
+def test_optional_keys():
+    for value in (
+        Optionals(),
+        Optionals(name='x', values={'a': None, 'b': 1.5}),
+        Optionals(pair=(-3, True), rest=(b'', b'\x00\xff')),
+    ):
+        assert codec.decode(*codec.encode(value, OPTIONALS)) == value
+
+
+def test_fallback_and_errors():
+    assert codec.encode(b'raw', MIDI_BUFS) == (codec.CODEC_RAW, b'raw')
+    assert codec.encode('str') == (codec.CODEC_RAW, b'str')
+    tag, data = codec.encode({1, 2})
+    assert tag == codec.CODEC_PICKLE
+    assert codec.decode(tag, data, allow_pickle=True) == {1, 2}
+    with pt.raises(codec.CodecError, match='pickled'):
+        codec.decode(tag, data)
+    data = MIDI_BUFS.encode([MidiBuf(qn=0, bus=0, buf=[1])])
+    with pt.raises(codec.CodecError):
+        codec.decode(MIDI_BUFS.tag, data[:-1])
+    with pt.raises(codec.CodecError):
+        codec.decode(MIDI_BUFS.tag, data + b'\0')
+    with pt.raises(codec.CodecError, match='unknown codec'):
+        codec.decode(254, data)
+    with pt.raises(codec.CodecError, match='no schema'):
+        codec.register(253, ty.List[object])
+    with pt.raises(AssertionError):
+        codec.register(MIDI_BUFS.tag, ty.List[int])
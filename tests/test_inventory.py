@@ -0,0 +1,75 @@
+import threading
+import time
+import mock
+import pytest as pt
+from reasession import networking as nw
+from reasession.connections import interface as iface
+from reasession.connections import jack_backend as bck
+from reasession.connections import inventory as inv
+
+
+def monkey_observer() -> mock.MagicMock:
+    observer = mock.MagicMock(version=3)
+    observer.midi_ports.side_effect = lambda want_output=False: [
+        dict(
+            name='MIDI Out 1' if want_output else 'MIDI Input 1',
+            connection=dict(host='system', name='midi_1')
+        )
+    ]
+    return observer
+
+
+@pt.fixture
+def agent(monkeypatch):
+    ports = ([dict(idx=0, name='system:midi_capture_1')], [])
+    monkeypatch.setattr(inv, '_read_midi_ports', lambda: ports)
+    observer = monkey_observer()
+    agent = inv.InventoryAgent(observer=lambda: observer)
+    agent.run()
+    return agent, ports, observer
+
+
+def test_agent_handle(agent):
+    agent, ports, observer = agent
+    assert agent.can_handle(b'inventory')
+    reply = agent.handle(b'inventory', b'')
+    assert reply['reaper_in_ports'] == ports[0]
+    assert reply['jack_out_ports'][0]['name'] == 'MIDI Out 1'
+    stamp = reply['stamp']
+    assert agent.handle(b'inventory', stamp.encode()) == b'same'
+    assert agent.handle(b'host_stamp', b'') == stamp.encode()
+    observer.version = 4
+    assert agent.handle(b'inventory', stamp.encode()) != b'same'
+    assert agent.handle(b'host_stamp', b'') != stamp.encode()
+
+
+def test_agent_over_network(agent):
+    agent, ports, observer = agent
+    server = nw.ReaperServer('127.0.0.1', 0, [])
+    server.register_handler(agent)
+    port = server._server.server_address[1]
+    cache = inv.AgentPortsCache(port=port, timeout=1)
+    stop = threading.Event()
+
+    def defer_loop() -> None:
+        while not stop.is_set():
+            server.run()
+            time.sleep(.03)
+
+    threading.Thread(target=defer_loop).start()
+    try:
+        got = cache.get(['localhost'])
+        assert got['localhost']['reaper_in_ports'] == ports[0]
+        stamp = got['localhost']['stamp']  # type:ignore
+        assert inv.request_inventory('localhost', port, stamp) is None
+        assert cache.get(['localhost'])['localhost']['stamp'] == stamp
+        assert bck.request_host_stamp('localhost', port) == stamp
+    finally:
+        stop.set()
+        cache.close()
+        time.sleep(.05)
+        server.at_exit()
+
+    with pt.raises(iface.ConnectionsError, match="'localhost'"):
+        inv.AgentPortsCache(port=port, timeout=.1).get(['localhost'])
+    assert bck.request_host_stamp('localhost', port, .1) == ''
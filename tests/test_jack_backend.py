@@ -1,4 +1,9 @@
+import os
 import typing as ty
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from random import randint
 import pytest as pt
 import mock
@@ -409,7 +414,15 @@ def monkey_get_all_connections(
     return func
 
 
-def test_get_jack_ports_parametrized(monkeypatch):
+@pt.fixture
+def observer(monkeypatch):
+    monkeypatch.setattr(bck, '_observer', None)
+    yield
+    if bck._observer is not None:
+        bck._observer.close()
+
+
+def test_get_jack_ports_parametrized(monkeypatch, observer):
     t_in_ports, t_out_ports = get_jack_ports_test_data()
     monkeypatch.setattr(
         jack.Client, 'get_ports', monkey_Client_get_ports(ins=2, outs=2)
@@ -417,27 +430,153 @@ def test_get_jack_ports_parametrized(monkeypatch):
     monkeypatch.setattr(
         jack.Client, 'get_all_connections',
         monkey_get_all_connections(
-            from_list=['system:midi_capture_1', 'REAPER:MIDI Out 2']
+            from_list=[
+                'system:midi_capture_1',
+                'REAPER:MIDI Out 2',
+                'system:midi_playback_1',
+                'REAPER:MIDI Input 2',
+            ]
         )
     )
     r_ins = bck.get_jack_ports_parametrized(want_output=False)
     assert r_ins == t_in_ports
+    r_outs = bck.get_jack_ports_parametrized(want_output=True)
+    assert r_outs == t_out_ports
     monkeypatch.setattr(
         jack.Client, 'get_all_connections',
         monkey_get_all_connections(min=2, max=2)
     )
+    # graph is cached until jack reports changes
+    assert bck.get_jack_ports_parametrized(want_output=False) == t_in_ports
+    bck.get_observer().invalidate()
     r_ins = bck.get_jack_ports_parametrized(want_output=False)
     assert r_ins == []
     r_outs = bck.get_jack_ports_parametrized(want_output=True)
     assert r_outs == []
-    monkeypatch.setattr(
-        jack.Client, 'get_all_connections',
-        monkey_get_all_connections(
-            from_list=['system:midi_playback_1', 'REAPER:MIDI Input 2']
+
+
+class MonkeyObservedPort(MonkeyJackPort):
+
+    def __init__(
+        self, name: str, is_output: bool = False, is_midi: bool = True
+    ) -> None:
+        super().__init__(name)
+        self.is_output = is_output
+        self.is_input = not is_output
+        self.is_midi = is_midi
+
+
+class MonkeyObservedClient:
+
+    def __init__(self) -> None:
+        self.ports = [
+            MonkeyObservedPort('REAPER:MIDI Input 1'),
+            MonkeyObservedPort('REAPER:MIDI Out 1', is_output=True),
+        ]
+        self.connections = {'REAPER:MIDI Input 1': ['system:midi_capture_1']}
+        self.reads = 0
+        self.active = False
+
+    def set_port_registration_callback(self, callback):
+        self.on_register = callback
+
+    def set_port_connect_callback(self, callback):
+        self.on_connect = callback
+
+    def set_graph_order_callback(self, callback):
+        self.on_graph_order = callback
+
+    def set_shutdown_callback(self, callback):
+        self.on_shutdown = callback
+
+    def activate(self):
+        self.active = True
+
+    def deactivate(self):
+        self.active = False
+
+    def close(self):
+        pass
+
+    def get_ports(self, name_pattern, is_midi, is_output, is_input):
+        self.reads += 1
+        return [p for p in self.ports if p.is_output == is_output]
+
+    def get_all_connections(self, port):
+        return [
+            MonkeyJackPort(name)
+            for name in self.connections.get(port.name, [])
+        ]
+
+
+def test_jack_observer_callbacks():
+    client = MonkeyObservedClient()
+    obs = bck.JackObserver(client=client)
+    assert client.active
+    assert obs.midi_ports() == [
+        bck._JMidiPort(
+            name='MIDI Input 1',
+            connection=bck._JConnection(host='system', name='midi_capture_1')
         )
-    )
-    r_outs = bck.get_jack_ports_parametrized(want_output=True)
-    assert r_outs == t_out_ports
+    ]
+    assert obs.midi_ports(want_output=True) == []
+    assert client.reads == 2
+
+    out = client.ports[1]
+    playback = MonkeyObservedPort('system:midi_playback_1')
+    version = obs.version
+    client.on_connect(out, playback, True)
+    assert obs.midi_ports(want_output=True) == [
+        bck._JMidiPort(
+            name='MIDI Out 1',
+            connection=bck._JConnection(host='system', name='midi_playback_1')
+        )
+    ]
+    assert obs.version > version
+
+    new = MonkeyObservedPort('REAPER:MIDI Out 2', is_output=True)
+    client.on_register(new, True)
+    client.on_register(MonkeyObservedPort('a2j:some', is_midi=True), True)
+    client.on_connect(new, playback, True)
+    assert len(obs.midi_ports(want_output=True)) == 2
+    client.on_connect(out, playback, False)
+    client.on_register(new, False)
+    assert obs.midi_ports(want_output=True) == []
+    assert client.reads == 2
+
+    version = obs.version
+    client.on_graph_order()
+    assert obs.version == version + 1
+    client.on_shutdown(None, 'server stopped')
+    assert obs.closed
+    obs.midi_ports()
+    assert client.reads == 4
+
+
+def test_jack_observer_change_while_reading():
+    client = MonkeyObservedClient()
+    obs = bck.JackObserver(client=client)
+    playback = MonkeyObservedPort('system:midi_playback_1')
+    get_all_connections = client.get_all_connections
+
+    def connect_while_reading(port):
+        # callback fires after the port is read, but before snapshot
+        # is installed
+        connections = get_all_connections(port)
+        if port.name == 'REAPER:MIDI Out 1':
+            client.connections[port.name] = [playback.name]
+            client.on_connect(port, playback, True)
+        return connections
+
+    client.get_all_connections = connect_while_reading
+    assert obs.midi_ports(want_output=True) == []
+    assert client.reads == 2
+    client.get_all_connections = get_all_connections
+    # graph is read again, and the change is not lost
+    assert len(obs.midi_ports(want_output=True)) == 1
+    assert client.reads == 4
+    assert len(obs.midi_ports(want_output=True)) == 1
+    assert client.reads == 4
 
 
 # @pt.mark.skip
@@ -547,12 +686,13 @@ def test_match_host_ports(monkeypatch):
 
 @mock.patch.object(rpr, 'Project')
 @mock.patch.object(rpr, 'Track')
+@mock.patch.object(rpr, 'inside_reaper')
 @mock.patch.object(rpr, 'connect')
 @mock.patch.object(bck, 'set_track_midi_in')
 @mock.patch.object(bck, 'set_track_midi_out')
 def test_connect(
-    set_track_midi_out, set_track_midi_in, monkey_connect, MonkeyTrack,
-    MonkeyProject
+    set_track_midi_out, set_track_midi_in, monkey_connect, inside_reaper,
+    MonkeyTrack, MonkeyProject
 ):
     track = rpr.Track(
         id='slave_track_2', project=rpr.Project(id='slave_project_2')
@@ -569,7 +709,7 @@ def test_connect(
     bck.connect_by_task(task)
     monkey_connect.assert_called_with('192.168.2.2')
     track.project.make_current_project.assert_called()
-    set_track_midi_in.assert_called_with(track, 2)
+    set_track_midi_in.assert_called_with(track, 2, 0)
 
     track = rpr.Track(
         id='master_track_1', project=rpr.Project(id='master_project')
@@ -590,4 +730,401 @@ def test_connect(
     bck.connect_by_task(task)
     monkey_connect.assert_called_with('localhost')
     track.project.make_current_project.assert_called()
-    set_track_midi_out.assert_called_with(track, 3)
+    set_track_midi_out.assert_called_with(track, 3, 0)
+
+
+def test_jack_port_index():
+    from .bench_port_matching import make_inventory, naive_match
+    r_ports, j_ports = make_inventory(200)
+    j_ports.append(
+        bck._JMidiPort(
+            name='MIDI Input 3',
+            connection=bck._JConnection(host='MIDI', name='Input 3')
+        )
+    )
+    index = bck.JackPortIndex(j_ports)
+    indexed = [(r['idx'], j) for r in r_ports for j in index.match(r['name'])]
+    assert indexed == naive_match(r_ports, j_ports)
+    assert len(index.match('MIDI Input 3')) == 2
+    assert index.match('unknown') == []
+
+
+def test_port_matcher_augmenting():
+    ports = [
+        bck._RHostPort(
+            host='localhost', port=dict(idx=0, name='a'), dest_host='slave1'
+        ),
+        bck._RHostPort(
+            host='localhost', port=dict(idx=0, name='a'), dest_host='slave2'
+        ),
+        bck._RHostPort(
+            host='localhost', port=dict(idx=1, name='b'), dest_host='slave1'
+        ),
+    ]
+    matcher = bck.PortMatcher(ports)
+    # greedy would give the only port of slave2 to slave1
+    first = matcher.request('slave1')
+    second = matcher.request('slave2')
+    assert second is not None
+    assert matcher.port_of(first)['idx'] == 1
+    assert matcher.port_of(second)['idx'] == 0
+    assert matcher.request('slave1') is None
+    assert matcher.request('unknown') is None
+    assert matcher.n_free == 0
+
+
+def host_ports(
+    host: str, *dests: ty.Tuple[int, str]
+) -> ty.List[bck._RHostPort]:
+    return [
+        bck._RHostPort(
+            host=host, port=dict(idx=idx, name=f'port {idx}'), dest_host=dest
+        ) for idx, dest in dests
+    ]
+
+
+def test_port_link_allocator_failed_link():
+    out_matchers = {
+        'master1': bck.PortMatcher(host_ports('master1', (0, 'slave2'))),
+        'master2': bck.PortMatcher(host_ports('master2', (0, 'slave1'))),
+    }
+    in_matchers = {
+        'slave1': bck.PortMatcher(host_ports('slave1', (0, 'localhost'))),
+        'slave2': bck.PortMatcher([]),
+    }
+    allocator = bck.PortLinkAllocator(out_matchers, in_matchers)
+    # failed links do not hold ports of the next ones
+    with pt.raises(iface.ConnectionsError, match='not enough in ports'):
+        allocator.allocate('master1', 'slave2')
+    with pt.raises(iface.ConnectionsError, match='is not known'):
+        allocator.allocate('master1', 'slave3')
+    assert out_matchers['master1'].n_free == 1
+    with pt.raises(iface.ConnectionsError, match='not enough out ports'):
+        allocator.allocate('master1', 'slave1')
+    assert in_matchers['slave1'].n_free == 1
+    o_req, i_req, _ = allocator.allocate('master2', 'slave1')
+    assert out_matchers['master2'].port_of(o_req)['idx'] == 0
+    assert in_matchers['slave1'].port_of(i_req)['idx'] == 0
+
+
+def test_assign_ports_diagnostics(monkeypatch):
+    monkeypatch.setattr(rpr, 'Track', MonkeyTrack)
+    monkeypatch.setattr(rpr, 'Project', MonkeyProject)
+    t_master, t_slave, t_midi_outs, t_midi_ins = get_test_data()
+    assignment = bck.assign_ports([t_master, t_slave])
+    assert assignment['errors'] == []
+    assert assignment['midi_outs'] == t_midi_outs
+    assert assignment['free_ports'] == {
+        'localhost': (1, 0),
+        '192.168.2.2': (1, 1),
+    }
+
+    t_master, t_slave, t_midi_outs, t_midi_ins = get_test_data()
+    t_slave['in_tracks'].pop(0)
+    for _ in range(3):
+        t_slave['jack_in_ports'].pop(0)
+    assignment = bck.assign_ports([t_master, t_slave])
+    assert len(assignment['errors']) == 2
+    assert 'slave_track_3' in assignment['errors'][0]
+    assert 'not enough in ports' in assignment['errors'][1]
+    assert [p['track'].id for p in assignment['midi_ins']] == [
+        'slave_track_2', 'slave_track_1'
+    ]
+
+
+def test_assign_ports_unroutable_first(monkeypatch):
+    monkeypatch.setattr(rpr, 'Track', MonkeyTrack)
+    monkeypatch.setattr(rpr, 'Project', MonkeyProject)
+    t_master, t_slave, _, _ = get_test_data()
+    # the only port to slave is also connected to the host without ins
+    del t_master['jack_out_ports'][3:5]
+    t_master['jack_out_ports'].append(
+        dict(
+            name='MIDI Output 3',
+            connection=dict(host='192.168.2.3', name='midi_to_slave_1')
+        )
+    )
+    s_track = rpr.Track(id='slave_track_5', project=rpr.Project(id='p'))
+    t_master['out_tracks'].insert(
+        0,
+        dict(
+            track=rpr.Track(id='master_track_5', project=rpr.Project(id='m')),
+            slave=dict(host='192.168.2.3', track=s_track)
+        )
+    )
+    t_slave2 = bck._HostInfo(
+        host='192.168.2.3',
+        reaper_in_ports=[],
+        jack_in_ports=[],
+        in_tracks=[s_track],
+        reaper_out_ports=[],
+        jack_out_ports=[],
+        out_tracks=[],
+    )
+    assignment = bck.assign_ports([t_master, t_slave, t_slave2])
+    assert "not enough in ports for host '192.168.2.3'" in (
+        assignment['errors'][0]
+    )
+    assert [(p['track'].id, p['port']['idx'])
+            for p in assignment['midi_outs']][0] == ('master_track_1', 2)
+
+
+@mock.patch.object(rpr, 'inside_reaper')
+@mock.patch.object(rpr, 'connect')
+@mock.patch.object(bck, 'set_track_midi_in')
+@mock.patch.object(bck, 'set_track_midi_out')
+def test_connect_batched(
+    set_track_midi_out, set_track_midi_in, monkey_connect, inside_reaper
+):
+    projects = {
+        name: mock.MagicMock(id=name)
+        for name in ('master', 'slave_1', 'slave_2')
+    }
+
+    def port(host: str, project: str, idx: int) -> bck._RTrackPort:
+        return bck._RTrackPort(
+            host=host,
+            track=MonkeyTrack(f'{project}_{idx}', projects[project]),
+            port=dict(idx=idx, name=f'port {idx}')
+        )
+
+    ins = [port('slave', 'slave_1', i) for i in range(3)]
+    ins += [port('slave', 'slave_2', i) for i in range(3)]
+    outs = [port('localhost', 'master', i) for i in range(6)]
+    groups = bck.group_task_by_host((ins, outs))
+    assert [(p.id, len(i), len(o)) for p, i, o in groups['slave']] == [
+        ('slave_1', 3, 0), ('slave_2', 3, 0)
+    ]
+    assert [(p.id, len(i), len(o)) for p, i, o in groups['localhost']] == [
+        ('master', 0, 6)
+    ]
+
+    with ThreadPoolExecutor(2) as executor:
+        bck.connect_by_task((ins, outs), executor)
+    assert sorted(c[0][0] for c in monkey_connect.call_args_list) == [
+        'localhost', 'slave'
+    ]
+    assert inside_reaper.call_count == 2
+    assert projects['slave_2'].make_current_project.call_count == 1
+    assert set_track_midi_in.call_count == 6
+    set_track_midi_out.assert_called_with(outs[-1]['track'], 5, 0)
+
+
+def test_update_host_info_parallel(monkeypatch):
+    monkeypatch.setattr(rpr, 'Track', MonkeyTrack)
+    monkeypatch.setattr(rpr, 'Project', MonkeyProject)
+    t_master, t_slave, _, _ = get_test_data()
+    both_asked = threading.Barrier(2, timeout=1)
+
+    def get_host_ports(host):
+        both_asked.wait()
+        if host == 'slow':
+            time.sleep(0.5)
+        info = t_master if host == 'localhost' else t_slave
+        return bck._HostPorts(
+            jack_in_ports=info['jack_in_ports'],
+            jack_out_ports=info['jack_out_ports'],
+            reaper_in_ports=info['reaper_in_ports'],
+            reaper_out_ports=info['reaper_out_ports'],
+        )
+
+    monkeypatch.setattr(bck, 'get_host_ports', get_host_ports)
+    hosts = [
+        iface.HostInfo(host=info['host'], in_tracks=[], out_tracks=[])
+        for info in (t_master, t_slave)
+    ]
+    with ThreadPoolExecutor(2) as executor:
+        new = bck.update_host_info(hosts, executor=executor)
+    assert [h['host'] for h in new] == ['localhost', '192.168.2.2']
+    assert new[1]['reaper_in_ports'] == t_slave['reaper_in_ports']
+
+    hosts[1]['host'] = 'slow'
+    with ThreadPoolExecutor(2) as executor:
+        with pt.raises(iface.ConnectionsError, match="'slow' did not answer"):
+            bck.update_host_info(hosts, timeout=0.1, executor=executor)
+
+
+def test_host_ports_cache(monkeypatch):
+    stamps = {'localhost': 'a', 'slave': 'b'}
+    # localhost has no agent, slave has
+    agent_stamps = {'localhost': '', 'slave': 'b:1'}
+    asked: ty.List[str] = []
+
+    def get_host_ports(host):
+        asked.append(host)
+        return bck._HostPorts(
+            jack_in_ports=[],
+            jack_out_ports=[],
+            reaper_in_ports=[dict(idx=0, name=stamps[host])],
+            reaper_out_ports=[],
+        )
+
+    def get_host_stamp(host):
+        assert host == 'localhost', 'Reaper of host with agent is asked'
+        return stamps[host]
+
+    monkeypatch.setattr(bck, 'get_host_stamp', get_host_stamp)
+    monkeypatch.setattr(
+        bck, 'request_host_stamp',
+        lambda host, port, timeout=1: agent_stamps[host]
+    )
+    monkeypatch.setattr(bck, 'get_host_ports', get_host_ports)
+    observer = mock.MagicMock(version=1)
+    with ThreadPoolExecutor(2) as executor:
+        cache = bck.HostPortsCache(
+            executor=executor, observer=lambda: observer
+        )
+        ports = cache.get(['localhost', 'slave'])
+        assert sorted(asked) == ['localhost', 'slave']
+        assert ports['slave']['reaper_in_ports'][0]['name'] == 'b'
+
+        asked.clear()
+        cache.get(['localhost', 'slave'])
+        assert asked == []
+        stamps['slave'] = 'c'
+        agent_stamps['slave'] = 'c:1'
+        ports = cache.get(['localhost', 'slave'])
+        assert asked == ['slave']
+        assert ports['slave']['reaper_in_ports'][0]['name'] == 'c'
+
+        asked.clear()
+        # jack graph of the slave is changed
+        agent_stamps['slave'] = 'c:2'
+        cache.get(['localhost', 'slave'])
+        assert asked == ['slave']
+
+        asked.clear()
+        observer.version = 2
+        cache.get(['localhost', 'slave'])
+        assert asked == ['localhost']
+        asked.clear()
+        cache.invalidate('slave')
+        cache.get(['slave'])
+        assert asked == ['slave']
+        asked.clear()
+        cache.max_age = 0
+        cache.get(['localhost'])
+        assert asked == ['localhost']
+        cache.close()
+
+    # jack is not touched, unless observer is given
+    monkeypatch.setattr(
+        bck, 'get_observer', mock.Mock(side_effect=AssertionError)
+    )
+    with ThreadPoolExecutor(1) as executor:
+        bck.HostPortsCache(executor=executor).get(['localhost'])
+
+
+def test_connector_differential(monkeypatch):
+    monkeypatch.setattr(rpr, 'Track', MonkeyTrack)
+    monkeypatch.setattr(rpr, 'Project', MonkeyProject)
+    t_master, t_slave, t_midi_outs, t_midi_ins = get_test_data()
+    cache = mock.MagicMock()
+    cache.get.return_value = {
+        info['host']: bck._HostPorts(
+            jack_in_ports=info['jack_in_ports'],
+            jack_out_ports=info['jack_out_ports'],
+            reaper_in_ports=info['reaper_in_ports'],
+            reaper_out_ports=info['reaper_out_ports'],
+        )
+        for info in (t_master, t_slave)
+    }
+    applied: ty.List[ty.Tuple[ty.List[bck._RTrackPort], ...]] = []
+    monkeypatch.setattr(bck, 'connect_by_task', applied.append)
+
+    def host_info(info):
+        return iface.HostInfo(
+            host=info['host'],
+            in_tracks=list(info['in_tracks']),
+            out_tracks=list(info['out_tracks']),
+        )
+
+    hosts = [host_info(t_master), host_info(t_slave)]
+    connector = bck.Connector(hosts, ports_cache=cache)
+    connector.update(hosts)
+    assert applied == [(t_midi_ins, t_midi_outs)]
+
+    connector.update(hosts)
+    assert len(applied) == 1
+
+    # slave_project_3 is closed
+    hosts[0]['out_tracks'].pop(2)
+    hosts[1]['in_tracks'].pop(2)
+    connector.update(hosts)
+    ins, outs = applied[-1]
+    assert ins == []
+    assert [(p['track'].id, p['port']['idx']) for p in outs] == [
+        ('master_track_3', -1)
+    ]
+
+    connector.differential = False
+    connector.update(hosts)
+    assert len(applied[-1][0]) == 3
+
+
+@mock.patch.object(bck, 'RPR')
+def test_set_track_midi_disconnect(RPR):
+    track = MonkeyTrack('track')
+    bck.set_track_midi_out(track, 2)
+    RPR.SetMediaTrackInfo_Value.assert_called_with('track', 'I_MIDIHWOUT', 64)
+    bck.set_track_midi_out(track, -1)
+    RPR.SetMediaTrackInfo_Value.assert_called_with('track', 'I_MIDIHWOUT', -1)
+    bck.set_track_midi_in(track, -1)
+    RPR.SetMediaTrackInfo_Value.assert_called_with('track', 'I_RECINPUT', -1)
+
+
+def test_assign_ports_channels(monkeypatch):
+    monkeypatch.setattr(rpr, 'Track', MonkeyTrack)
+    monkeypatch.setattr(rpr, 'Project', MonkeyProject)
+    t_master, t_slave, _, _ = get_test_data()
+    # leave only one port from master to slave
+    del t_master['jack_out_ports'][3:5]
+    with pt.raises(iface.ConnectionsError, match='not enough out ports'):
+        bck.get_connection_task([t_master, t_slave])
+
+    midi_outs, midi_ins = bck.get_connection_task([t_master, t_slave],
+                                                  channels=16)
+    assert [(p['port']['idx'], p['channel']) for p in midi_outs] == [
+        (2, 1), (2, 2), (2, 3), (5, 1)
+    ]
+    assert [(p['port']['idx'], p['channel']) for p in midi_ins] == [
+        (0, 1), (0, 2), (0, 3), (2, 1)
+    ]
+
+    t_master, t_slave, _, _ = get_test_data()
+    midi_outs, _ = bck.get_connection_task([t_master, t_slave], channels=2)
+    assert [(p['port']['idx'], p['channel']) for p in midi_outs] == [
+        (2, 1), (2, 2), (3, 1), (5, 1)
+    ]
+
+
+def hang(host: str) -> str:
+    if host != 'fast':
+        time.sleep(30)
+    return host
+
+
+def worker_pid(host: str) -> int:
+    return os.getpid()
+
+
+def test_host_pool_recycles_hung_workers():
+    pool = bck.HostPool()
+    with pt.raises(iface.ConnectionsError, match='did not answer'):
+        bck._gather_from_hosts(hang, ['a', 'b', 'fast'], .3, pool)
+    # only workers of hung hosts are killed
+    assert list(pool._pools) == ['fast']
+    fast_pid = pool.submit(worker_pid, 'fast').result(5)
+
+    pids = [pool.submit(worker_pid, host).result(5) for host in 'ab']
+    futures = [pool.submit(hang, host) for host in 'ab']
+    pool.recycle(['a'])
+    with pt.raises(BrokenProcessPool):
+        futures[0].result(2)
+    assert not futures[1].done()
+    # the next call starts the new worker
+    assert pool.submit(worker_pid, 'a').result(5) not in pids
+    assert pool.submit(worker_pid, 'fast').result(5) == fast_pid
+    pool.shutdown(cancel_futures=True)
+    with pt.raises(BrokenProcessPool):
+        futures[1].result(2)
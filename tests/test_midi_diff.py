@@ -0,0 +1,57 @@
+import typing as ty
+from reasession.session import midi_diff as md
+
+
+def evt(ppq: float, *buf: int) -> md.PpqEvent:
+    return md.PpqEvent(ppq=ppq, buf=list(buf))
+
+
+def apply(old: ty.List[md.PpqEvent],
+          patch: md.MidiPatch) -> ty.List[ty.Tuple[float, ty.List[int]]]:
+    """Apply patch the way MIDI API does."""
+    out = [dict(e) for e in old]
+    for idx, ppq in patch['move']:
+        out[idx]['ppq'] = ppq
+    for idx in patch['delete']:
+        del out[idx]
+    out.extend(patch['insert'])
+    return sorted((e['ppq'], e['buf']) for e in out)
+
+
+def test_diff_midi_small_edit():
+    old = [
+        evt(0, 0x90, 60, 100),
+        evt(480, 0x80, 60, 0),
+        evt(480, 0xb0, 1, 10),
+        evt(960, 0x90, 62, 100),
+        evt(1440, 0x80, 62, 0),
+        evt(1920, *md.ALL_NOTES_OFF),
+    ]
+    new = [
+        evt(0, 0x90, 60, 100),
+        evt(480, 0x80, 60, 0),
+        evt(960.2, 0x90, 62, 100),
+        evt(1200, 0x80, 62, 0),
+        evt(1300, 0xb0, 1, 20),
+    ]
+    patch = md.diff_midi(old, new)
+    assert patch == md.MidiPatch(
+        delete=[2],
+        move=[(4, 1200)],
+        insert=[evt(1300, 0xb0, 1, 20)],
+    )
+    assert md.patch_size(patch) == 3
+    assert apply(old, patch)[:-1] == sorted(
+        (round(e['ppq']), e['buf']) for e in new
+    )
+
+
+def test_diff_midi_duplicates_and_empty():
+    old = [evt(0, 0x90, 60, 1), evt(0, 0x90, 60, 1), evt(10, 0x90, 60, 1)]
+    new = [evt(0, 0x90, 60, 1), evt(5, 0x90, 60, 1)]
+    patch = md.diff_midi(old, new)
+    assert md.patch_size(patch) == 2
+    assert apply(old, patch) == [(0, [0x90, 60, 1]), (5, [0x90, 60, 1])]
+    assert md.diff_midi([], new)['insert'] == new
+    assert md.diff_midi(old, [])['delete'] == [2, 1, 0]
+    assert md.patch_size(md.diff_midi(old, old)) == 0
@@ -0,0 +1,83 @@
+import pickle
+import json
+import pytest as pt
+from reasession.session import midi_stream as ms
+from reasession.session.render_midi import MidiBuf
+
+
+def dense_controllers():
+    midi = []
+    for i in range(2000):
+        qn = i / 32
+        midi.append(MidiBuf(qn=qn, bus=0, buf=[0xb0, 1, (i // 8) % 128]))
+        midi.append(MidiBuf(qn=qn, bus=3, buf=[0xb1, 11, 64]))
+    return midi
+
+
+def test_thin_midi():
+    midi = [
+        MidiBuf(qn=0, bus=0, buf=[0xb0, 1, 10]),
+        MidiBuf(qn=0.1, bus=0, buf=[0xb0, 1, 10]),
+        MidiBuf(qn=0.2, bus=1, buf=[0xb0, 1, 10]),
+        MidiBuf(qn=0.3, bus=0, buf=[0xb0, 1, 11]),
+        MidiBuf(qn=0.4, bus=0, buf=[0x90, 60, 0]),
+        MidiBuf(qn=0.5, bus=0, buf=[0x91, 60, 100]),
+        MidiBuf(qn=0.6, bus=0, buf=[0x91, 60, 0]),
+    ]
+    assert ms.thin_midi(midi) == [
+        midi[0], midi[2], midi[3], midi[5],
+        MidiBuf(qn=0.6, bus=0, buf=[0x81, 60, 0]),
+    ]
+    # the last value of the controller is kept anyway
+    assert ms.thin_midi(midi, cc_tolerance=1) == [
+        midi[0], midi[2], midi[3], midi[5],
+        MidiBuf(qn=0.6, bus=0, buf=[0x81, 60, 0]),
+    ]
+
+
+def test_thin_midi_keeps_end_of_ramp():
+    ramp = [MidiBuf(qn=i / 4, bus=0, buf=[0xb0, 1, i]) for i in range(11)]
+    thinned = ms.thin_midi(ramp, cc_tolerance=3)
+    assert [m['buf'][2] for m in thinned] == [0, 4, 8, 10]
+    ramp.append(MidiBuf(qn=3, bus=0, buf=[0xb0, 1, 10]))
+    thinned = ms.thin_midi(ramp, cc_tolerance=3)
+    assert [m['buf'][2] for m in thinned] == [0, 4, 8, 10]
+    # other controller ends its ramp at its own last event
+    other = [MidiBuf(qn=i / 4, bus=0, buf=[0xb1, 7, i]) for i in range(3)]
+    thinned = ms.thin_midi(sorted(ramp + other, key=lambda m: m['qn']), 3)
+    assert [m['buf'][2] for m in thinned if m['buf'][0] == 0xb1] == [0, 2]
+
+
+def test_compact_round_trip():
+    midi = [
+        MidiBuf(qn=0.25, bus=0, buf=[0x90, 60, 100]),
+        MidiBuf(qn=0.25, bus=2, buf=[0xb0, 7, 100]),
+        MidiBuf(qn=1000.5, bus=2, buf=[0xf0, 1, 2, 3, 0xf7]),
+        MidiBuf(qn=1001, bus=0, buf=[0x80, 60, 0]),
+    ]
+    assert ms.expand(ms.compact(midi)) == midi
+    assert ms.expand(memoryview(ms.compact([]))) == []
+    with pt.raises(ms.StreamError):
+        ms.expand(b'junk')
+    with pt.raises(ms.StreamError):
+        ms.expand(ms.compact(midi)[:-2])
+    with pt.raises(ms.StreamError, match='not sorted'):
+        ms.compact(midi[::-1])
+
+
+def test_compact_payload_size():
+    midi = dense_controllers()
+    stream = ms.compact(midi)
+    assert len(stream) * 10 < len(pickle.dumps(midi))
+    assert len(stream) * 20 < len(json.dumps(midi))
+    expanded = ms.expand(stream)
+    assert expanded == ms.thin_midi(midi)
+
+
+def test_push_handler_rejects_broken_stream():
+    handler = ms.MidiPushHandler()
+    assert handler.can_handle(b'midi_push')
+    assert handler.handle(b'midi_push', b'guid\njunk') == b'fail'
+    assert handler.handle(
+        b'midi_push', b'guid\n' + ms.compact([])
+    ) == b'success'
@@ -0,0 +1,431 @@
+import os
+import socket as st
+import threading
+import time
+import typing as ty
+import pytest as pt
+from reasession import networking as nw
+from reasession.session.render_midi import MIDI_BUFS, MidiBuf
+
+
+class EchoHandler(nw.IHandler):
+
+    def __init__(self) -> None:
+        self.threads: ty.List[threading.Thread] = []
+        self.received_types: ty.List[type] = []
+
+    def can_handle(self, data_type: bytes) -> bool:
+        return data_type == b'echo'
+
+    def handle(self, data_type: bytes, data: bytes) -> bytes:
+        self.threads.append(threading.current_thread())
+        self.received_types.append(type(data))
+        return bytes(data)
+
+
+@pt.fixture
+def server():
+    server = nw.ReaperServer('127.0.0.1', 0, [])
+    handler = EchoHandler()
+    server.register_handler(handler)
+    stop = threading.Event()
+
+    def defer_loop() -> None:
+        while not stop.is_set():
+            server.run()
+            time.sleep(.03)
+
+    threading.Thread(target=defer_loop).start()
+    manager = nw.ConnectionManager(timeout=1)
+    yield server, handler, manager, server._server.server_address[1]
+    stop.set()
+    manager.close_all()
+    time.sleep(.05)
+    server.at_exit()
+
+
+def test_frame_roundtrip():
+    a, b = st.socketpair()
+    with a, b:
+        frame = nw.Frame(b'ping', b'x' * 3000, 7, nw.FLAG_RESPONSE)
+        a.sendall(nw.pack_frame(frame))
+        assert nw.read_frame(b) == frame
+        a.sendall(b'0000000ping0000000004ping' + b'\0' * 10)
+        with pt.raises(nw.ProtocolError):
+            nw.read_frame(b)
+        a.close()
+        with pt.raises(ConnectionError):
+            nw.read_frame(b)
+
+
+def test_persistent_connection(server):
+    server, handler, manager, port = server
+    data = bytes(range(256)) * 1000
+    assert manager.request('echo', data, '127.0.0.1', port) == data
+    assert manager.request('echo', 'ping', '127.0.0.1', port) == b'ping'
+    assert manager.get('127.0.0.1', port).is_open
+    # both requests are served by one connection
+    assert handler.threads[0] is handler.threads[1]
+    assert len(server._server.open_sockets) == 1
+
+
+def test_reconnect(server):
+    server, handler, manager, port = server
+    assert manager.request('echo', 'one', '127.0.0.1', port) == b'one'
+    for sock in list(server._server.open_sockets):
+        sock.shutdown(st.SHUT_RDWR)
+    time.sleep(.05)
+    assert manager.request('echo', 'two', '127.0.0.1', port) == b'two'
+    assert handler.threads[0] is not handler.threads[1]
+
+
+def test_legacy_package(server):
+    server, handler, manager, port = server
+    assert nw.send_data('echo', 'legacy', '127.0.0.1', port, 1) == 'legacy'
+
+
+def test_split_magic(server):
+    server, handler, manager, port = server
+    packed = nw.pack_frame(nw.Frame(b'echo', b'split', 1))
+    with st.create_connection(('127.0.0.1', port), 1) as sock:
+        sock.sendall(packed[:2])
+        time.sleep(.05)
+        sock.sendall(packed[2:])
+        assert nw.read_frame(sock).data == b'split'
+
+
+def test_zero_copy_receive(server):
+    server, handler, manager, port = server
+    data = bytes(range(256)) * 4000
+    assert manager.request('echo', data, '127.0.0.1', port) == data
+    # sizes with trailing zeros were stripped by the legacy parser
+    for size in (2000, 10, 0):
+        assert nw.send_data(
+            'echo', 'x' * size, '127.0.0.1', port, 1
+        ) == 'x' * size
+    assert handler.received_types == [memoryview] * 4
+
+
+def test_recv_view():
+    a, b = st.socketpair()
+    with a, b:
+        a.sendall(b'abcdef')
+        view = nw.recv_view(b, 4)
+        assert isinstance(view, memoryview)
+        assert view == b'abcd'
+        a.close()
+        with pt.raises(ConnectionError):
+            nw.recv_view(b, 4)
+
+
+def test_max_frame_size(server, async_server):
+    a, b = st.socketpair()
+    with a, b:
+        header = nw.FRAME_HEADER.pack(
+            nw.FRAME_MAGIC, 0, 0, b'echo'.zfill(10), 1,
+            nw.MAX_FRAME_SIZE + 1
+        )
+        a.sendall(header)
+        with pt.raises(nw.ProtocolError, match='too large'):
+            nw.read_frame(b)
+    # servers close connection without reading the data
+    for address in (('127.0.0.1', server[3]), async_server[0].address):
+        with st.create_connection(address, 1) as sock:
+            sock.sendall(b'000000echo9999999999')
+            assert sock.recv(10) == b''
+
+
+class ShiftHandler(nw.IHandler):
+    schema = MIDI_BUFS
+
+    def can_handle(self, data_type: bytes) -> bool:
+        return data_type == b'shift'
+
+    def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+        if not data:
+            return b'empty'
+        return [MidiBuf(qn=m['qn'] + 1, bus=m['bus'], buf=m['buf'])
+                for m in data]
+
+
+def test_schema_payload(server):
+    server, handler, manager, port = server
+    server.register_handler(ShiftHandler())
+    midi = [MidiBuf(qn=.5, bus=1, buf=[0x90, 60, 1])]
+    assert manager.request(
+        'shift', midi, '127.0.0.1', port, schema=MIDI_BUFS
+    ) == [MidiBuf(qn=1.5, bus=1, buf=[0x90, 60, 1])]
+    assert manager.request(
+        'shift', [], '127.0.0.1', port, schema=MIDI_BUFS
+    ) == b'empty'
+
+
+def test_pickle_rejected(server):
+    server, handler, manager, port = server
+    midi = [MidiBuf(qn=.5, bus=1, buf=[0x90, 60, 1])]
+    codec, pickled = nw.encode(midi)
+    with pt.raises(nw.CodecError, match='pickled'):
+        nw._get_response([ShiftHandler()], b'shift', pickled, codec)
+    # only servers, that opt in, unpickle requests
+    assert nw.decode(
+        *nw._get_response(
+            [ShiftHandler()], b'shift', pickled, codec, allow_pickle=True
+        )
+    ) == [MidiBuf(qn=1.5, bus=1, buf=[0x90, 60, 1])]
+
+
+class FailingHandler(nw.IHandler):
+    data_types = (b'fail', b'drop')
+
+    def __init__(self, server: nw.SlaveTCPServer) -> None:
+        self.server = server
+        self.calls: ty.List[bytes] = []
+
+    def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+        self.calls.append(bytes(data))
+        if data_type == b'drop':
+            for sock in list(self.server.open_sockets):
+                sock.shutdown(st.SHUT_RDWR)
+        if data == b'boom':
+            raise ValueError('boom')
+        return b'ok'
+
+
+def test_handler_error(server, async_server):
+    server, _, manager, port = server
+    failing = FailingHandler(server._server)
+    server.register_handler(failing)
+    async_failing = FailingHandler(server._server)
+    async_server[0].register_handler(async_failing)
+    for handler, address in (
+        (failing, ('127.0.0.1', port)),
+        (async_failing, async_server[0].address),
+    ):
+        conn = nw.Connection(*address)
+        assert conn.request('fail', 'ok') == b'ok'
+        with pt.raises(nw.RemoteError, match='boom'):
+            conn.request('fail', 'boom')
+        # connection is kept, and failed request is not repeated
+        assert conn.is_open
+        assert conn.request('fail', 'next') == b'ok'
+        assert handler.calls == [b'ok', b'boom', b'next']
+        conn.close()
+    # request, that reached handler, is not repeated on the new socket
+    conn = nw.Connection('127.0.0.1', port)
+    assert conn.request('fail', 'ok') == b'ok'
+    with pt.raises(ConnectionError):
+        conn.request('drop', 'once')
+    assert failing.calls[-2:] == [b'ok', b'once']
+    conn.close()
+
+
+def test_refused():
+    manager = nw.ConnectionManager(timeout=.1)
+    with st.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with pt.raises(ConnectionRefusedError):
+        manager.request('echo', 'ping', '127.0.0.1', port)
+    assert not manager.get('127.0.0.1', port).is_open
+
+
+class ReaperHandler(EchoHandler):
+    main_thread = True
+
+    def can_handle(self, data_type: bytes) -> bool:
+        return data_type == b'reaper'
+
+
+@pt.fixture
+def async_server():
+    server = nw.AsyncReaperServer('127.0.0.1', 0, [])
+    echo, reaper = EchoHandler(), ReaperHandler()
+    server.register_handler(echo)
+    server.register_handler(reaper)
+    stop = threading.Event()
+
+    def defer_loop() -> None:
+        while not stop.is_set():
+            server.run()
+            time.sleep(.01)
+
+    loop_thread = threading.Thread(target=defer_loop)
+    loop_thread.start()
+    yield server, echo, reaper, loop_thread
+    stop.set()
+    loop_thread.join()
+    server.at_exit()
+
+
+def test_async_server_concurrent(async_server):
+    server, echo, reaper, loop_thread = async_server
+    host, port = server.address
+    managers = [nw.ConnectionManager(timeout=1) for _ in range(20)]
+    results: ty.Dict[int, ty.Tuple[bytes, bytes]] = {}
+
+    def client(idx: int) -> None:
+        data = str(idx).encode() * 1000
+        results[idx] = (
+            managers[idx].request('echo', data, host, port),
+            managers[idx].request('reaper', data, host, port),
+        )
+
+    threads = [
+        threading.Thread(target=client, args=(i, )) for i in range(20)
+    ]
+    for tr in threads:
+        tr.start()
+    for tr in threads:
+        tr.join()
+    assert results == {
+        i: (str(i).encode() * 1000, ) * 2
+        for i in range(20)
+    }
+    assert len(server._writers) == 20
+    assert set(reaper.threads) == {loop_thread}
+    assert loop_thread not in echo.threads
+    assert nw.send_data('echo', 'legacy', host, port, 1) == 'legacy'
+    for manager in managers:
+        manager.close_all()
+
+
+def test_async_server_at_exit():
+    server = nw.AsyncReaperServer('127.0.0.1', 0, [])
+    server.register_handler(ReaperHandler())
+    manager = nw.ConnectionManager(timeout=1)
+    result: ty.List[object] = []
+
+    def client() -> None:
+        try:
+            manager.request('reaper', 'never', *server.address)
+        except Exception as e:
+            result.append(e)
+
+    tr = threading.Thread(target=client)
+    tr.start()
+    # defer loop does not run, so the request waits in the queue
+    time.sleep(.1)
+    server.at_exit()
+    tr.join(1)
+    assert not tr.is_alive()
+    assert isinstance(result[0], (ConnectionError, nw.ProtocolError))
+    assert not server._thread.is_alive()
+
+
+def test_compress_frame():
+    data = b'MIDI ' * 2000
+    frame = nw.Frame(b'echo', data, 3, nw.FLAG_RESPONSE)
+    assert nw.compress_frame(frame, None) is frame
+    assert nw.compress_frame(frame, 'zlib', threshold=len(data) + 1) is frame
+    random = os.urandom(5000)
+    assert nw.compress_frame(frame._replace(data=random), 'zlib',
+                             threshold=10).flags == nw.FLAG_RESPONSE
+    for name in ('zlib', 'lzma'):
+        packed = nw.compress_frame(frame, name)
+        assert packed.flags & ~nw.FLAG_RESPONSE
+        assert len(packed.data) < len(data) / 10
+        assert nw.decompress_frame(packed) == frame
+    with pt.raises(nw.ProtocolError):
+        nw.decompress_frame(frame._replace(flags=nw.FLAG_ZLIB))
+
+
+def test_compression_negotiated(server, async_server, monkeypatch):
+    servers = [
+        ('127.0.0.1', server[3]),
+        async_server[0].address,
+    ]
+    data = b'note on ' * 100000
+    for host, port in servers:
+        for compressions in (('zlib', 'lzma'), ('lzma', )):
+            conn = nw.Connection(host, port, 1, compressions)
+            assert conn.request('echo', data) == data
+            assert conn.compression == compressions[0]
+            conn.close()
+        # server, that does not support any of compressions
+        conn = nw.Connection(host, port, 1, ('zlib', ))
+        with monkeypatch.context() as patch:
+            patch.setattr(nw, 'choose_compression', lambda offered: None)
+            assert conn.request('echo', data) == data
+        assert conn.compression is None
+        conn.close()
+
+
+class CountingHandler(nw.IHandler):
+
+    def __init__(self, data_types: ty.Tuple[bytes, ...] = ()) -> None:
+        self.data_types = data_types
+        self.asked: ty.List[bytes] = []
+
+    def can_handle(self, data_type: bytes) -> bool:
+        self.asked.append(data_type)
+        return super().can_handle(data_type) or data_type == b'any'
+
+
+def test_dispatch_table():
+    table = nw.DispatchTable()
+    ping, both = CountingHandler((b'ping', )), CountingHandler((b'ping', b'x'))
+    generic = CountingHandler()
+    for handler in (ping, both, generic):
+        table.register(handler)
+    assert table.handlers(b'x') == [both]
+    assert table.handlers(b'ping') == [ping, both]
+    assert table.handlers(b'any') == [generic]
+    assert table.handlers(b'none') == []
+    assert ping.asked == both.asked == []
+    assert generic.asked == [b'x', b'ping', b'any', b'none']
+
+
+class ObjectHandler(CountingHandler):
+    schema = MIDI_BUFS
+
+    def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+        return [MidiBuf(qn=0, bus=0, buf=[1])]
+
+
+def test_several_handlers_responses():
+    table = nw.DispatchTable()
+    table.register(CountingHandler((b'ping', )))
+    with pt.raises(AssertionError, match='only one'):
+        table.register(ObjectHandler((b'ping', )))
+    table.register(ObjectHandler((b'midi', )))
+    with pt.raises(AssertionError, match='only one'):
+        table.register(CountingHandler((b'midi', )))
+
+    class TextHandler(CountingHandler):
+        def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+            return 'text'
+
+    handlers = [CountingHandler(), TextHandler()]
+    assert nw._get_response(handlers, b'any', b'') == (
+        nw.CODEC_RAW, b'CountingHandler passed\ntext'
+    )
+    # handlers without data_types are not checked at registration
+    handlers.append(ObjectHandler())
+    with pt.raises(nw.CodecError, match='not the only handler'):
+        nw._get_response(handlers, b'any', b'')
+
+
+def test_servers_do_not_share_handlers(server):
+    server, handler, manager, port = server
+    other = nw.ReaperServer('127.0.0.1', 0, [])
+    other.register_handler(CountingHandler((b'other', )))
+    other_port = other._server.server_address[1]
+    stop = threading.Event()
+
+    def defer_loop() -> None:
+        while not stop.is_set():
+            other.run()
+            time.sleep(.03)
+
+    threading.Thread(target=defer_loop).start()
+    try:
+        assert manager.request('other', '', '127.0.0.1', port) == b''
+        assert manager.request(
+            'other', '', '127.0.0.1', other_port
+        ) == b'CountingHandler passed'
+        assert manager.request('echo', 'x', '127.0.0.1', other_port) == b''
+    finally:
+        stop.set()
+        manager.close_all()
+        time.sleep(.05)
+        other.at_exit()
@@ -0,0 +1,364 @@
+import typing as ty
+import threading
+from contextlib import contextmanager
+import mock
+import pytest as pt
+import reapy as rpr
+from reapy import reascript_api as RPR
+from reasession.session import render_midi as rm
+
+
+class MonkeyGmem:
+
+    def __init__(self) -> None:
+        self.mem: ty.Dict[int, float] = {}
+
+    def read(self, idx: int) -> float:
+        return self.mem.get(idx, 0.0)
+
+    def write(self, idx: int, val: float) -> None:
+        self.mem[idx] = val
+
+
+@contextmanager
+def monkey_inside_reaper() -> ty.Iterator[None]:
+    yield
+
+
+@pt.fixture
+def gmem(monkeypatch):
+    mem = MonkeyGmem()
+    monkeypatch.setattr(rpr, 'inside_reaper', monkey_inside_reaper)
+    monkeypatch.setattr(RPR, 'gmem_attach', lambda name: None, raising=False)
+    monkeypatch.setattr(RPR, 'gmem_read', mem.read, raising=False)
+    monkeypatch.setattr(RPR, 'gmem_write', mem.write, raising=False)
+    return mem
+
+
+def jsfx_live_store(
+    mem: MonkeyGmem, slot: int, qn: float, bus: int, buf: ty.List[int]
+) -> bool:
+    """Mirror of JSFX live_store."""
+    rd = rm.LiveMidiReader
+    base = rd.live_base + slot * rd.slot_size
+    head, bhead = int(mem.read(base)), int(mem.read(base + 3))
+    if head - mem.read(base + 1) >= rd.events_cap or \
+            bhead + len(buf) - mem.read(base + 4) > rd.bytes_cap:
+        mem.write(base + 2, mem.read(base + 2) + 1)
+        return False
+    ev = base + rd.header_size + (head % rd.events_cap) * 4
+    bytes_ptr = base + rd.header_size + rd.events_cap * 4
+    for i, val in enumerate((qn, bus, bhead, len(buf))):
+        mem.write(ev + i, val)
+    for i, byte in enumerate(buf):
+        mem.write(bytes_ptr + (bhead + i) % rd.bytes_cap, byte)
+    mem.write(base + 3, bhead + len(buf))
+    mem.write(base, head + 1)
+    return True
+
+
+def test_live_reader_drain(gmem):
+    fx = mock.MagicMock()
+    got: ty.List[ty.List[rm.MidiBuf]] = []
+    reader = rm.LiveMidiReader(fx, slot=1, on_midi=got.append)
+    jsfx_live_store(gmem, 1, 0.0, 0, [0x90, 60, 100])
+    reader.start()
+    fx.params.__setitem__.assert_called_with(1, 1)
+    assert reader.drain() == []
+
+    jsfx_live_store(gmem, 1, 1.0, 0, [0x90, 62, 100])
+    jsfx_live_store(gmem, 1, 1.5, 2, [0x80, 62, 0])
+    jsfx_live_store(gmem, 0, 1.5, 0, [0x80, 1, 0])
+    reader.run()
+    assert got == [[
+        rm.MidiBuf(qn=1.0, bus=0, buf=[0x90, 62, 100]),
+        rm.MidiBuf(qn=1.5, bus=2, buf=[0x80, 62, 0]),
+    ]]
+    reader.run()
+    assert len(got) == 1
+
+
+def test_live_reader_wraps_and_drops(gmem):
+    reader = rm.LiveMidiReader(mock.MagicMock())
+    reader.start()
+    cap = reader.events_cap
+    for i in range(cap + 3):
+        jsfx_live_store(gmem, 0, float(i), 0, [0xb0, 1, i % 128])
+    assert reader.dropped == 3
+    assert len(reader.drain()) == cap
+    for i in range(5):
+        jsfx_live_store(gmem, 0, float(i), 0, [0xb0, 1, i])
+    midi = reader.drain()
+    assert [m['buf'][2] for m in midi] == list(range(5))
+
+    base = reader.live_base
+    gmem.write(base, 0)
+    assert reader.drain() == []
+    jsfx_live_store(gmem, 0, 2.0, 0, [0xb0, 1, 7])
+    assert reader.drain() == [rm.MidiBuf(qn=2.0, bus=0, buf=[0xb0, 1, 7])]
+
+
+class MonkeyProject:
+
+    def __init__(self, id: str) -> None:
+        self.id = id
+        self.state_changes = 0
+
+
+@pt.fixture
+def projects(monkeypatch):
+    projects = [MonkeyProject('project')]
+    monkeypatch.setattr(rpr, 'get_projects', lambda: projects)
+    monkeypatch.setattr(
+        RPR, 'GetProjectStateChangeCount',
+        lambda pr_id: {pr.id: pr.state_changes for pr in projects}[pr_id],
+        raising=False
+    )
+    return projects
+
+
+@pt.fixture
+def renderer(monkeypatch, projects):
+    ext_state: ty.Dict[ty.Tuple[str, str], str] = {}
+    monkeypatch.setattr(rpr, 'inside_reaper', monkey_inside_reaper)
+    monkeypatch.setattr(rpr, 'get_command_id', lambda cmd: 42)
+    monkeypatch.setattr(
+        rpr, 'set_ext_state',
+        lambda sec, key, val: ext_state.__setitem__((sec, key), val)
+    )
+    monkeypatch.setattr(
+        rpr, 'get_ext_state', lambda sec, key: ext_state.get((sec, key), '')
+    )
+    return rm.MidiRenderer(capacity=1000, chunk=2), ext_state
+
+
+@pt.fixture
+def cleaned(monkeypatch):
+    monkeypatch.setattr(rpr, 'get_resource_path', lambda: '/reaper/')
+    monkeypatch.setattr(
+        RPR, 'RecursiveCreateDirectory', lambda path, ign: 1, raising=False
+    )
+    cleaned: ty.List[str] = []
+    key = rm.MidiRenderer.key_cleanup
+
+    def perform_action(cmd: int) -> None:
+        # lua script removes files of the render dir and resets the key
+        render_dir = rpr.get_ext_state(rm.EXT_SECTION, key)
+        if render_dir:
+            cleaned.append(render_dir)
+            rpr.set_ext_state(rm.EXT_SECTION, key, '')
+
+    monkeypatch.setattr(rpr, 'perform_action', perform_action)
+    return cleaned
+
+
+def monkey_lua_chunks(
+    renderer: rm.MidiRenderer, ext_state: ty.Dict[ty.Tuple[str, str], str],
+    events: ty.List[str], overflow: int
+) -> None:
+    sec = rm.EXT_SECTION
+
+    def get_from_lua() -> None:
+        size = min(renderer.chunk, len(events))
+        chunk = [events.pop(0) for _ in range(size)]
+        ext_state[(sec, renderer.key_result)] = f'[{",".join(chunk)}]'
+        ext_state[(sec, renderer.key_overflow)] = str(overflow)
+        ext_state[(sec, renderer.key_remaining)] = str(len(events))
+
+    renderer._get_from_lua = get_from_lua  # type:ignore
+
+
+def monkey_track() -> mock.MagicMock:
+    track = mock.MagicMock()
+    track.id = 'track_1'
+    track.GUID = '{track_1_guid}'
+    track.project.id = 'project'
+    return track
+
+
+def test_get_midi_from_track_chunked(renderer):
+    renderer, ext_state = renderer
+    events = [
+        f'{{"qn":{i}, "bus":0, "buf":[144,{60 + i},100]}}' for i in range(5)
+    ]
+    monkey_lua_chunks(renderer, ext_state, events, overflow=0)
+    chunks = list(renderer.iter_midi_from_track(monkey_track()))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    sec = rm.EXT_SECTION
+    assert ext_state[(sec, renderer.key_track_guid)] == '{track_1_guid}'
+    assert ext_state[(sec, renderer.key_proj_idx)] == '0'
+    assert chunks[2] == [rm.MidiBuf(qn=4, bus=0, buf=[144, 64, 100])]
+    assert renderer.overflows == {}
+
+
+def test_get_midi_from_track_overflow(renderer):
+    renderer, ext_state = renderer
+    events = ['{"qn":0, "bus":0, "buf":[144,60,100]}']
+    monkey_lua_chunks(renderer, ext_state, events[:], overflow=3)
+    track = monkey_track()
+    midi = renderer.get_midi_from_track(track, 0)
+    assert len(midi) == 1
+    assert renderer.overflows == {'track_1': 3}
+
+    renderer.raise_on_overflow = True
+    monkey_lua_chunks(renderer, ext_state, events[:], overflow=3)
+    with pt.raises(rm.MidiOverflowError, match='3 events'):
+        renderer.get_midi_from_track(track, 0)
+
+
+def test_render_tracks_profile(renderer, cleaned, monkeypatch):
+    renderer, _ = renderer
+    project = mock.MagicMock()
+    project.get_info_value.return_value = 44100.0
+    project.get_info_string.return_value = 'user'
+    track = monkey_track()
+    track.project = project
+    rendered_to: ty.List[str] = []
+
+    def render_it() -> None:
+        calls = project.set_info_string.call_args_list
+        rendered_to.append(dict(c[0] for c in calls)['RENDER_FILE'])
+
+    monkeypatch.setattr(renderer, '_render_it', render_it)
+    monkeypatch.setattr(
+        renderer, 'get_midi_from_track', lambda track: ['midi']
+    )
+    assert renderer.render_tracks([track]) == {'track_1': ['midi']}
+
+    profile = rm.MIDI_RENDER_PROFILE
+    values = [c[0] for c in project.set_info_value.call_args_list]
+    n_keys = len(profile['value'])
+    assert dict(values[:n_keys]) == profile['value']
+    assert set(values[n_keys:]) >= {(k, 44100.0) for k in profile['value']}
+    strings = dict(
+        c[0] for c in project.set_info_string.call_args_list[:3]
+    )
+    assert strings['RENDER_FORMAT'] == profile['string']['RENDER_FORMAT']
+    assert project.set_info_string.call_args[0][1] == 'user'
+    assert rendered_to == ['/reaper/' + rm.RENDER_DIR]
+    # before the render and after it
+    assert cleaned == rendered_to * 2
+    assert set(renderer.timings) == {
+        'setup', 'render', 'restore', 'cleanup', 'extract'
+    }
+
+
+def test_render_tracks_failed_setup(renderer, cleaned, monkeypatch):
+    renderer, _ = renderer
+    project = mock.MagicMock()
+    project.get_info_value.return_value = 44100.0
+    project.get_info_string.return_value = 'user'
+    track = monkey_track()
+    track.project = project
+    failed: ty.List[bool] = []
+
+    def set_info_value(key: str, val: float) -> None:
+        if not failed:
+            failed.append(True)
+            raise RuntimeError('setup failed')
+
+    project.set_info_value.side_effect = set_info_value
+    monkeypatch.setattr(
+        renderer, '_render_it', mock.Mock(side_effect=AssertionError)
+    )
+    with pt.raises(RuntimeError, match='setup failed'):
+        renderer.render_tracks([track])
+    # user settings are restored and the render dir is cleaned
+    assert project.set_info_string.call_args[0][1] == 'user'
+    assert project.set_info_value.call_args[0][1] == 44100.0
+    assert cleaned == ['/reaper/' + rm.RENDER_DIR] * 2
+
+
+def test_render_tracks_cancelled(renderer, cleaned, monkeypatch):
+    renderer, _ = renderer
+    project = mock.MagicMock()
+    project.get_info_value.return_value = 44100.0
+    project.get_info_string.return_value = 'user'
+    track = monkey_track()
+    track.project = project
+    monkeypatch.setattr(
+        renderer, '_render_it', mock.Mock(side_effect=AssertionError)
+    )
+    with pt.raises(rm.RenderCancelled):
+        renderer.render_tracks([track], cancelled=lambda: True)
+    assert project.set_info_string.call_args[0][1] == 'user'
+    assert cleaned == ['/reaper/' + rm.RENDER_DIR] * 2
+
+    # cancelled between extraction of tracks
+    tracks = [track, monkey_track()]
+    extracted: ty.List[str] = []
+    monkeypatch.setattr(renderer, '_render_it', lambda: None)
+    monkeypatch.setattr(
+        renderer, 'get_midi_from_track',
+        lambda track: extracted.append(track.id) or []
+    )
+    with pt.raises(rm.RenderCancelled):
+        renderer.render_tracks(tracks, cancelled=lambda: bool(extracted))
+    assert extracted == ['track_1']
+
+
+def test_track_index(monkeypatch, projects):
+    monkeypatch.setattr(rpr, 'inside_reaper', monkey_inside_reaper)
+    get_projects = mock.Mock(side_effect=lambda: projects)
+    monkeypatch.setattr(rpr, 'get_projects', get_projects)
+    index = rm.TrackIndex()
+    track = monkey_track()
+    assert index.project_idx(track.project) == 0
+    assert index.track_guid(track) == '{track_1_guid}'
+    track.GUID = 'changed'
+    assert index.track_guid(track) == '{track_1_guid}'
+    index.validate()
+    assert index.track_guid(track) == '{track_1_guid}'
+    # lookups do not enumerate projects
+    assert get_projects.call_count == 2
+
+    projects.insert(0, MonkeyProject('other'))
+    assert index.project_idx(track.project) == 0
+    index.validate()
+    assert index.project_idx(track.project) == 1
+    assert index.track_guid(track) == 'changed'
+    # tabs are reordered, GUIDs are still valid
+    track.GUID = 'replaced'
+    projects.reverse()
+    index.validate()
+    assert index.project_idx(track.project) == 0
+    assert index.track_guid(track) == 'changed'
+    projects.reverse()
+
+    # track is deleted and the new one is added, count is the same
+    projects[1].state_changes += 2
+    index.validate()
+    assert index.project_idx(track.project) == 1
+    assert index.track_guid(track) == 'replaced'
+    projects.pop()
+    index.validate()
+    with pt.raises(RuntimeError, match='cannot find project'):
+        index.project_idx(track.project)
+
+
+def test_render_tracks_pipelined(renderer, cleaned, monkeypatch):
+    renderer, _ = renderer
+    tracks = [monkey_track(), monkey_track()]
+    tracks[1].id = 'track_2'
+    first_pushed = threading.Event()
+
+    def get_midi_from_track(track):
+        if track.id == 'track_2':
+            # consumer of the first track works during extraction
+            assert first_pushed.wait(1)
+        return [rm.MidiBuf(qn=0, bus=0, buf=[0x90, 60, 1])]
+
+    def consumer(track_id, midi):
+        if track_id == 'track_1':
+            first_pushed.set()
+        return f'{track_id}: {len(midi)}'
+
+    monkeypatch.setattr(renderer, '_render_it', lambda: None)
+    monkeypatch.setattr(renderer, 'get_midi_from_track', get_midi_from_track)
+    assert renderer.render_tracks_pipelined(tracks, consumer) == {
+        'track_1': 'track_1: 1',
+        'track_2': 'track_2: 1',
+    }
+    assert set(renderer.timings) == {
+        'setup', 'render', 'restore', 'cleanup', 'extract'
+    }
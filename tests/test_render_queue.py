@@ -0,0 +1,141 @@
+import typing as ty
+import threading
+from contextlib import contextmanager
+import mock
+import pytest as pt
+import reapy as rpr
+from reasession.session import render_queue as rq
+from reasession.session.render_midi import RenderCancelled
+
+
+class MonkeyRenderer:
+
+    def __init__(self, fail: bool = False) -> None:
+        self.rendered: ty.List[ty.List[str]] = []
+        self.fail = fail
+
+    def render_tracks(self, tracks, profile, on_progress, cancelled):
+        on_progress(.5)
+        if cancelled():
+            raise RenderCancelled('render is cancelled')
+        self.rendered.append([tr.id for tr in tracks])
+        if self.fail:
+            raise RuntimeError('render failed')
+        return {tr.id: [] for tr in tracks}
+
+
+def monkey_track(id: str) -> mock.MagicMock:
+    track = mock.MagicMock()
+    track.id = id
+    track.project.id = 'project'
+    return track
+
+
+@pt.fixture(autouse=True)
+def monkey_connect(monkeypatch):
+
+    @contextmanager
+    def connect(host):
+        yield
+
+    monkeypatch.setattr(rpr, 'connect', connect)
+
+
+def test_queue_dedupes_and_runs_sequentially():
+    renderer = MonkeyRenderer()
+    progress: ty.List[ty.Tuple[float, rq.JobState]] = []
+    queue = rq.RenderQueue(
+        renderer=renderer,
+        on_progress=lambda job: progress.append((job.progress, job.state))
+    )
+    tr_1, tr_2 = monkey_track('1'), monkey_track('2')
+    f_1 = queue.submit([tr_1, tr_2])
+    assert queue.submit([tr_2, tr_1]) is f_1
+    f_2 = queue.submit([tr_1])
+    assert len(queue.jobs) == 2
+    assert not f_1.done()
+
+    queue.run()
+    assert f_1.result() == {'1': [], '2': []}
+    assert not f_2.done()
+    assert progress == [
+        (0., rq.JobState.running),
+        (.5, rq.JobState.running),
+        (1., rq.JobState.done),
+    ]
+    assert queue.submit([tr_1, tr_2]) is not f_1
+
+    queue.run()
+    queue.run()
+    assert f_2.done()
+    assert renderer.rendered == [['1', '2'], ['1'], ['1', '2']]
+    assert queue.jobs == []
+
+
+def test_queue_cancel_and_fail():
+    queue = rq.RenderQueue(renderer=MonkeyRenderer(fail=True))
+    f_1 = queue.submit([monkey_track('1')])
+    f_2 = queue.submit([monkey_track('2')])
+    assert queue.cancel(f_1)
+    assert len(queue.jobs) == 1
+    queue.run()
+    assert f_1.cancelled()
+    with pt.raises(RuntimeError, match='render failed'):
+        f_2.result()
+
+    f_3 = queue.submit([monkey_track('3')])
+    queue.at_exit()
+    assert f_3.cancelled()
+    assert queue.jobs == []
+
+
+def test_queue_cancel_running_job():
+    renderer = MonkeyRenderer()
+    states: ty.List[rq.JobState] = []
+
+    def on_progress(job: rq.RenderJob) -> None:
+        states.append(job.state)
+        if job.progress == .5 and job.tracks[0].id == '1':
+            assert queue.cancel(job.future)
+
+    queue = rq.RenderQueue(renderer=renderer, on_progress=on_progress)
+    f_1 = queue.submit([monkey_track('1')])
+    f_2 = queue.submit([monkey_track('2')])
+    queue.run()
+    assert f_1.cancelled()
+    assert states[-1] is rq.JobState.cancelled
+    assert renderer.rendered == []
+    assert len(queue.jobs) == 1
+    queue.run()
+    assert f_2.result() == {'2': []}
+    assert renderer.rendered == [['2']]
+    assert queue.jobs == []
+
+
+def test_queue_submit_from_threads():
+    renderer = MonkeyRenderer()
+    queue = rq.RenderQueue(renderer=renderer)
+    futures: ty.List[ty.Any] = []
+    lock = threading.Lock()
+
+    def handler(idx: int) -> None:
+        for i in range(50):
+            future = queue.submit([monkey_track(f'{idx}_{i}')])
+            if i % 5 == 0:
+                queue.cancel(future)
+            with lock:
+                futures.append(future)
+
+    threads = [
+        threading.Thread(target=handler, args=(i, )) for i in range(8)
+    ]
+    for tr in threads:
+        tr.start()
+    # defer loop drains the queue meanwhile
+    while any(tr.is_alive() for tr in threads) or queue.jobs:
+        queue.run()
+    assert len(futures) == 400
+    assert all(f.done() for f in futures)
+    # running job can be cancelled after its render
+    assert len(renderer.rendered) >= sum(not f.cancelled() for f in futures)
+    assert queue._jobs == {}
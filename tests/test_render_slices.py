@@ -0,0 +1,89 @@
+import typing as ty
+from concurrent.futures import ThreadPoolExecutor
+import pytest as pt
+from reasession.host_pool import shared_pool
+from reasession.session import render_slices as rsl
+from reasession.session.render_midi import MidiBuf
+
+
+def note_on(qn: float, pitch: int, bus: int = 0) -> MidiBuf:
+    return MidiBuf(qn=qn, bus=bus, buf=[0x90, pitch, 100])
+
+
+def note_off(qn: float, pitch: int, bus: int = 0) -> MidiBuf:
+    return MidiBuf(qn=qn, bus=bus, buf=[0x80, pitch, 0])
+
+
+def cc(qn: float, val: int) -> MidiBuf:
+    return MidiBuf(qn=qn, bus=0, buf=[0xb0, 1, val])
+
+
+# the whole performance, as if it was rendered at once
+PERFORMANCE = [
+    note_on(0, 60),
+    cc(1, 10),
+    note_off(2, 60),
+    note_on(3, 62),  # crosses the first slice boundary
+    note_on(7, 64, bus=1),  # crosses both boundaries
+    cc(8, 20),
+    note_off(9, 62),
+    note_on(10, 60),
+    note_off(11, 60),
+    note_off(17, 64, bus=1),
+    note_on(18, 65),  # never ends
+]
+
+
+class FakeHost:
+    """Renders slices of PERFORMANCE, as REAPER would do."""
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.rendered: ty.List[ty.Tuple[float, float]] = []
+
+    def render_slice(
+        self, track_idxs: ty.List[int], start: float, end: float
+    ) -> rsl.SliceMidi:
+        self.rendered.append((start, end))
+        midi = [m for m in PERFORMANCE if start <= m['qn'] < end]
+        return [midi for _ in track_idxs]
+
+
+def test_split_at_bars():
+    bars = [0., 4., 8., 11., 14., 18., 20.]
+    assert rsl.split_at_bars(bars, 3) == [(0, 8), (8, 14), (14, 20)]
+    assert rsl.split_at_bars(bars, 1) == [(0, 20)]
+    assert len(rsl.split_at_bars(bars, 10)) == 6
+    assert rsl.split_at_bars([0., 4.], 4) == [(0, 4)]
+
+
+@pt.mark.parametrize('tail', [0, 2, 16])
+def test_sliced_render_stitches_in_qn_order(tail):
+    hosts = [FakeHost('a'), FakeHost('b'), FakeHost('c')]
+    with ThreadPoolExecutor(3) as executor:
+        renderer = rsl.SlicedMidiRenderer(hosts, tail=tail, executor=executor)
+        slices = renderer.render_slices([0, 1], [0., 6., 12., 20.])
+    assert [h.rendered for h in hosts] == [
+        [(0, 6 + tail)], [(6, 12 + tail)], [(12, 20 + tail)]
+    ]
+    stitched = rsl.stitch_slices(
+        [sl for sl, _ in slices], [midi[1] for _, midi in slices]
+    )
+    assert stitched == PERFORMANCE + [note_off(20, 65)]
+
+
+def test_sliced_render_reuses_shared_pool():
+    hosts = [FakeHost('a'), FakeHost('b')]
+    renderer = rsl.SlicedMidiRenderer(hosts, tail=16)
+    try:
+        first = renderer.render_slices([0], [0., 12., 20.])
+        workers = dict(shared_pool._pools)
+        assert renderer.render_slices([0], [0., 12., 20.]) == first
+        # workers are kept between renders
+        assert shared_pool._pools == workers
+        assert set(workers) == {'a', 'b'}
+    finally:
+        shared_pool.shutdown()
+    assert rsl.stitch_slices(
+        [sl for sl, _ in first], [midi[0] for _, midi in first]
+    ) == PERFORMANCE + [note_off(20, 65)]
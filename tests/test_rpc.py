@@ -0,0 +1,153 @@
+import socket as st
+import threading
+import time
+import typing as ty
+import pytest as pt
+from concurrent.futures import TimeoutError
+from reasession import networking as nw
+from reasession import rpc
+from reasession.session.render_midi import MIDI_BUFS, MidiBuf
+
+
+class GateHandler(nw.IHandler):
+    """Responds to 'slow' only after the gate is opened."""
+
+    schema = MIDI_BUFS
+
+    def __init__(self) -> None:
+        self.gate = threading.Event()
+
+    def can_handle(self, data_type: bytes) -> bool:
+        return data_type in (b'slow', b'fast', b'midi', b'fail')
+
+    def handle(self, data_type: bytes, data: ty.Any) -> ty.Any:
+        if data_type == b'slow':
+            self.gate.wait(2)
+        if data_type == b'fail':
+            raise ValueError(bytes(data).decode())
+        if data_type == b'midi':
+            return data
+        return data_type + b':' + bytes(data)
+
+
+@pt.fixture
+def async_server():
+    server = nw.AsyncReaperServer('127.0.0.1', 0, [])
+    handler = GateHandler()
+    server.register_handler(handler)
+    yield server, handler
+    handler.gate.set()
+    server.at_exit()
+
+
+def test_out_of_order(async_server):
+    server, handler = async_server
+    conn = rpc.RpcConnection(*server.address)
+    slow = conn.submit('slow', 'first')
+    fast = [conn.submit('fast', str(i)) for i in range(10)]
+    assert [f.result(1) for f in fast] == [
+        f'fast:{i}'.encode() for i in range(10)
+    ]
+    assert not slow.done()
+    handler.gate.set()
+    assert slow.result(1) == b'slow:first'
+    midi = [MidiBuf(qn=1, bus=0, buf=[0x90, 1, 1])] * 1000
+    assert conn.call('midi', midi, schema=MIDI_BUFS) == midi
+    assert conn.compression == 'zlib'
+    conn.close()
+
+
+def test_timeout_keeps_connection(async_server):
+    server, handler = async_server
+    conn = rpc.RpcConnection(*server.address, timeout=.1)
+    with pt.raises(TimeoutError):
+        conn.call('slow', 'late')
+    assert conn.call('fast', 'next') == b'fast:next'
+    handler.gate.set()
+    time.sleep(.05)
+    assert conn.is_open
+    assert conn._pending == {}
+    conn.close()
+
+
+def test_failed_request(async_server):
+    server, handler = async_server
+    conn = rpc.RpcConnection(*server.address)
+    slow = conn.submit('slow', 'first')
+    failed = conn.submit('fail', 'broken handler')
+    fast = [conn.submit('fast', str(i)) for i in range(5)]
+    with pt.raises(nw.RemoteError, match='broken handler'):
+        failed.result(1)
+    handler.gate.set()
+    # other requests in flight are not affected
+    assert slow.result(1) == b'slow:first'
+    assert [f.result(1) for f in fast] == [
+        f'fast:{i}'.encode() for i in range(5)
+    ]
+    assert conn.is_open
+    assert conn.call('fast', 'next') == b'fast:next'
+    conn.close()
+
+
+def test_broken_connection(async_server):
+    server, handler = async_server
+    conn = rpc.RpcConnection(*server.address)
+    slow = conn.submit('slow', 'never')
+    for writer in list(server._writers):
+        server._loop.call_soon_threadsafe(writer.transport.abort)
+    with pt.raises(ConnectionError):
+        slow.result(1)
+    assert not conn.is_open
+    assert conn.call('fast', 'again') == b'fast:again'
+    conn.close()
+
+
+def test_connect_without_lock():
+    # accepts connection, but never answers the negotiation
+    silent = st.create_server(('127.0.0.1', 0))
+    conn = rpc.RpcConnection(*silent.getsockname(), timeout=.5)
+    errors: ty.List[Exception] = []
+
+    def connect() -> None:
+        try:
+            conn.submit('fast', 'hanging')
+        except Exception as e:
+            errors.append(e)
+
+    tr = threading.Thread(target=connect)
+    tr.start()
+    time.sleep(.1)
+    start = time.monotonic()
+    # lock is free, while the first request is connecting
+    with conn._lock:
+        assert time.monotonic() - start < .2
+    tr.join(1)
+    silent.close()
+    assert isinstance(errors[0], OSError)
+    assert not conn.is_open
+
+
+def test_sequential_server():
+    server = nw.ReaperServer('127.0.0.1', 0, [])
+    handler = GateHandler()
+    handler.gate.set()
+    server.register_handler(handler)
+    stop = threading.Event()
+
+    def defer_loop() -> None:
+        while not stop.is_set():
+            server.run()
+            time.sleep(.03)
+
+    threading.Thread(target=defer_loop).start()
+    conn = rpc.RpcConnection('127.0.0.1', server._server.server_address[1])
+    try:
+        futures = [conn.submit('slow', str(i)) for i in range(5)]
+        assert [f.result(1) for f in futures] == [
+            f'slow:{i}'.encode() for i in range(5)
+        ]
+    finally:
+        conn.close()
+        stop.set()
+        time.sleep(.05)
+        server.at_exit()